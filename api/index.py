@@ -19,7 +19,7 @@ from app.api.routes import api_router
 from app.middleware.auth import AuthMiddleware
 from app.middleware.logging import LoggingMiddleware
 from app.middleware.error_handler import (
-    error_handler_middleware,
+    ErrorHandlerMiddleware,
     validation_exception_handler,
     http_exception_handler
 )
@@ -41,22 +41,25 @@ app = FastAPI(
     redoc_url="/redoc" if settings.debug else None,
 )
 
+# Custom middlewares
+# 注意：中间件的添加顺序很重要，执行顺序是反向的（后添加的先执行）
+# 执行顺序：CORS -> Error Handler -> Auth -> Logging
+app.add_middleware(LoggingMiddleware)
+app.add_middleware(AuthMiddleware, enable=False)  # 启用全局认证
+app.add_middleware(ErrorHandlerMiddleware)
+
 # CORS middleware
+# 最后添加，位于最外层：预检请求（OPTIONS）直接在这里应答，不经过错误处理、认证和日志中间件；
+# 认证失败等错误响应也会带上 CORS 头，浏览器才能读取错误信息
 app.add_middleware(
     CORSMiddleware,
     allow_origins=settings.cors_origins,
     allow_credentials=settings.cors_credentials,
     allow_methods=settings.cors_methods,
     allow_headers=settings.cors_headers,
+    max_age=settings.cors_max_age,
 )
 
-# Custom middlewares
-# 注意：中间件的添加顺序很重要，执行顺序是反向的（后添加的先执行）
-# 执行顺序：Logging -> Auth -> Error Handler
-app.add_middleware(LoggingMiddleware)
-app.add_middleware(AuthMiddleware, enable=False)  # 启用全局认证
-app.middleware("http")(error_handler_middleware)
-
 logger.info("🚀 Vercel serverless function initialized")
 
 # Exception handlers
@@ -6,7 +6,7 @@
 
 from fastapi import APIRouter
 
-from app.core.dependencies import CurrentUser, OptionalUser
+from app.core.dependencies import CurrentUser, OptionalUser, StrictUser
 from app.core.response import success
 
 
@@ -14,11 +14,12 @@ router = APIRouter()
 
 
 @router.get("/verify")
-async def verify_token(current_user: CurrentUser):
+async def verify_token(current_user: StrictUser):
     """
     验证 JWT token 是否有效
     
-    前端使用 Supabase JS SDK 登录后，可以调用此接口验证 token 是否有效
+    前端使用 Supabase JS SDK 登录后，可以调用此接口验证 token 是否有效；
+    通过 Supabase Auth 远程校验，已登出或被封禁用户的 token 会被拒绝
     """
     return success(
         data={
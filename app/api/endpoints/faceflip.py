@@ -1,15 +1,43 @@
+import asyncio
 import json
-from fastapi import APIRouter, HTTPException, Request
-from fastapi.responses import StreamingResponse
-from typing import AsyncGenerator
+import logging
+from fastapi import APIRouter, Header, Query, Request
+from fastapi.responses import Response, StreamingResponse
+from typing import AsyncGenerator, Optional
 
+from app.core.admission import AdmissionQueueFullError, generation_admission, image_bytes_budget
 from app.core.config import settings
-from app.core.response import success
+from app.core.response import error, success
+from app.core.response_code import ResponseCode
 from app.core.dependencies import CurrentUser
+from app.core.executors import ark_executor, image_executor, image_process_pool
+from app.core.metrics import metrics_registry
+from app.core.resilience import ark_upstream, auth_upstream, storage_upstream
+from app.core.token_verifier import token_verifier
 from app.schemas.face_flip import ImageGenerationRequest, SSEEvent
+from app.services.generation_jobs import GenerationJobConflictError, generation_job_manager
 from app.services.image_generation_service import image_generation_service
+from app.services.image_variants import (
+    STORAGE_PATH_PATTERN,
+    VARIANT_FORMATS,
+    ImageNotFoundError,
+    image_variant_service,
+    snap_edge,
+)
+from app.services.result_cache import generation_result_cache
+from app.utils import image_codec
 
 
+# 配置日志
+logger = logging.getLogger(__name__)
+# SSE 事件数量多，使用单独的 logger 以便按 LOG_SAMPLE_RATES 采样
+sse_logger = logging.getLogger("app.sse")
+
+sse_streams_in_flight = metrics_registry.gauge(
+    "sse_streams_in_flight", "Open SSE streams (generation and task event replay)"
+).labels()
+sse_events_total = metrics_registry.counter("sse_events_total", "SSE events sent by type", ("event",))
+
 router = APIRouter()
 
 
@@ -43,11 +71,79 @@ async def debug_env():
     }
 
 
+@router.get("/debug/auth-cache")
+async def debug_auth_cache(current_user: CurrentUser):
+    """
+    查看 token 校验缓存的命中/未命中/淘汰计数
+    """
+    return success(data=token_verifier.cache.stats())
+
+
+@router.get("/debug/executors")
+async def debug_executors(current_user: CurrentUser):
+    """
+    查看 ARK 和图片处理线程池/进程池的排队深度和活跃任务数
+    """
+    return success(data={
+        "ark": ark_executor.stats(),
+        "image": image_executor.stats(),
+        "image_process": image_process_pool.stats()
+    })
+
+
+@router.get("/debug/transcode")
+async def debug_transcode(current_user: CurrentUser):
+    """
+    查看生成图片转码节省的字节数和编码耗时
+    """
+    return success(data=image_generation_service.transcode_stats())
+
+
+@router.get("/debug/admission")
+async def debug_admission(current_user: CurrentUser):
+    """
+    查看生成名额的占用、排队长度和等待时间分布，以及处理中的图片字节数
+    """
+    return success(data={
+        **generation_admission.stats(),
+        "image_bytes": image_bytes_budget.stats()
+    })
+
+
+@router.get("/debug/generation-jobs")
+async def debug_generation_jobs(current_user: CurrentUser):
+    """
+    查看生成任务数量、被放弃的任务数和浪费的 ARK 生成时间
+    """
+    return success(data=generation_job_manager.stats())
+
+
+@router.get("/debug/upstreams")
+async def debug_upstreams(current_user: CurrentUser):
+    """
+    查看 ARK、存储和认证上游的调用、重试、对冲次数和熔断器状态
+    """
+    return success(data={
+        "ark": ark_upstream.stats(),
+        "storage": storage_upstream.stats(),
+        "auth": auth_upstream.stats()
+    })
+
+
+@router.get("/debug/result-cache")
+async def debug_result_cache(current_user: CurrentUser):
+    """
+    查看生成结果缓存的命中率和节省的 ARK 耗时
+    """
+    return success(data=generation_result_cache.stats())
+
+
 @router.post("/generate/stream")
 async def generate_images_stream(
     request: ImageGenerationRequest,
-    current_user: CurrentUser
-) -> StreamingResponse:
+    current_user: CurrentUser,
+    http_request: Request
+):
     """
     流式生成图像接口（需要JWT认证）
     
@@ -56,65 +152,183 @@ async def generate_images_stream(
         current_user: 当前登录用户（通过依赖注入获取）
         
     Returns:
-        StreamingResponse: SSE流式响应
+        StreamingResponse: SSE流式响应；生成排队已满时返回 E_GENERATION_QUEUE_FULL
     """
     
     # 验证用户权限（可选：添加更多权限检查）
-    user_id = current_user.get("id")
+    user_id = current_user["id"]
     user_email = current_user.get("email")
     
     # 记录用户操作日志
-    print(f"用户 {user_email} (ID: {user_id}) 开始生成图像，任务ID: {request.task_id}")
+    logger.info(
+        f"🎨 User {user_email} started image generation - task {request.task_id}",
+        extra={"user_id": user_id, "task_id": request.task_id}
+    )
+    
+    # 生成任务在后台运行，连接断开后可通过 /tasks/{task_id}/events 续传（宽限期内没有重连的任务被放弃）
+    # 相同 task_id 重复提交时附加到已有任务，不会重新生成
+    try:
+        job = await generation_job_manager.start(
+            task_id=request.task_id,
+            user_id=user_id,
+            urls=request.urls,
+            user_email=user_email,
+            use_cache=request.use_cache
+        )
+    except GenerationJobConflictError as e:
+        return error(code=ResponseCode.E_INVALID_PARAM, msg=str(e))
+    except AdmissionQueueFullError:
+        # 排队已满，立即拒绝，客户端应退避后重试
+        return error(code=ResponseCode.E_GENERATION_QUEUE_FULL)
+    
+    return _event_stream_response(job.attach(), http_request)
+
+
+@router.get("/tasks/{task_id}/events")
+async def stream_task_events(
+    task_id: str,
+    current_user: CurrentUser,
+    http_request: Request,
+    last_event_id: Optional[str] = Header(default=None, alias="Last-Event-ID")
+):
+    """
+    重放并继续接收生成任务的事件流（需要JWT认证）
+    
+    从 Last-Event-ID 之后的事件开始重放，任务仍在运行时继续推送实时事件
+    
+    Args:
+        task_id: 任务ID
+        last_event_id: 客户端最后收到的事件 id（SSE 重连时浏览器自动携带）
+    """
+    job = generation_job_manager.get(current_user["id"], task_id)
+    if job is None:
+        return error(code=ResponseCode.E_ITEM_NOT_EXIST, msg="task not found")
+    
+    try:
+        after = int(last_event_id) if last_event_id else 0
+    except ValueError:
+        return error(code=ResponseCode.E_INVALID_PARAM, msg="invalid Last-Event-ID")
+    
+    return _event_stream_response(job.subscribe(after), http_request)
+
+
+@router.get("/images/{path:path}")
+async def get_image_variant(
+    path: str,
+    w: Optional[int] = Query(default=None, ge=1),
+    h: Optional[int] = Query(default=None, ge=1),
+    fmt: str = Query(default="webp"),
+    if_none_match: Optional[str] = Header(default=None, alias="If-None-Match")
+):
+    """
+    获取缩放后的生成图片（公开接口）
+    
+    按需从存储读取原图，缩放到 w x h 以内并编码为 fmt，结果缓存在本地磁盘；
+    w / h 向上取整到 IMAGE_VARIANT_SIZES 中的一档，任意尺寸不会各自触发渲染
+    
+    Args:
+        path: 存储中的图片路径，如 userId/2025-01-01/uuid.png
+        w: 最大宽度
+        h: 最大高度
+        fmt: 输出格式 webp / avif / jpeg / png
+    """
+    if not STORAGE_PATH_PATTERN.match(path) or fmt not in VARIANT_FORMATS:
+        return error(code=ResponseCode.E_INVALID_PARAM, msg="invalid image path or format")
+    try:
+        w, h = snap_edge(w), snap_edge(h)
+    except ValueError:
+        max_edge = max(settings.image_variant_sizes)
+        return error(code=ResponseCode.E_INVALID_PARAM, msg=f"w and h must not exceed {max_edge}")
+    
+    key = image_variant_service.variant_key(path, w, h, fmt)
+    headers = {
+        "ETag": image_variant_service.etag(key),
+        "Cache-Control": "public, max-age=31536000, immutable"
+    }
+    
+    # 客户端已有相同变体：直接返回 304，不读取磁盘或存储
+    if if_none_match and (
+        if_none_match.strip() == "*"
+        or headers["ETag"] in [tag.strip() for tag in if_none_match.split(",")]
+    ):
+        return Response(status_code=304, headers=headers)
+    
+    try:
+        content = await image_variant_service.get_variant(path, w, h, fmt)
+    except ImageNotFoundError:
+        return error(code=ResponseCode.E_ITEM_NOT_EXIST, msg="image not found")
+    
+    return Response(content=content, media_type=image_codec.content_type(fmt), headers=headers)
+
+
+@router.get("/debug/image-variants")
+async def debug_image_variants(current_user: CurrentUser):
+    """
+    查看图片变体的渲染次数、合并请求数和磁盘缓存命中率
+    """
+    return success(data=image_variant_service.stats())
+
+
+def format_sse(event: SSEEvent) -> str:
+    """格式化SSE事件"""
+    event_data = f"id: {event.id}\n" if event.id is not None else ""
+    event_data += f"event: {event.event}\n"
+    json_data = json.dumps(event.data, ensure_ascii=False)
+    event_data += f"data: {json_data}\n\n"
+    sse_logger.log(
+        logging.WARNING if event.event == "error" else logging.INFO,
+        f"📡 SSE event: {event.event}",
+        extra={"event": event.event, "event_id": event.id, "payload": json_data}
+    )
+    return event_data
+
+
+async def _until_disconnected(
+    events: AsyncGenerator[SSEEvent, None],
+    http_request: Request
+) -> AsyncGenerator[SSEEvent, None]:
+    """
+    转发事件直到客户端断开
+
+    等待下一个事件期间定期检查连接状态（生成可能长时间没有事件，不能依赖写入失败来发现断开），
+    断开后立即关闭事件迭代器，让任务知道订阅者已离开
+    """
+    poll_seconds = settings.sse_disconnect_poll_seconds
+    next_event: Optional[asyncio.Future] = None
+    try:
+        while True:
+            next_event = asyncio.ensure_future(events.__anext__())
+            while True:
+                done, _ = await asyncio.wait({next_event}, timeout=poll_seconds)
+                if done:
+                    break
+                if await http_request.is_disconnected():
+                    return
+            try:
+                event = next_event.result()
+            except StopAsyncIteration:
+                return
+            yield event
+    finally:
+        if next_event is not None and not next_event.done():
+            # 取消等待中的 __anext__，事件迭代器随之结束
+            next_event.cancel()
+        else:
+            await events.aclose()
+
+
+def _event_stream_response(events: AsyncGenerator[SSEEvent, None], http_request: Request) -> StreamingResponse:
+    """把事件迭代器包装为SSE流式响应，客户端断开时停止订阅"""
     
     async def event_generator() -> AsyncGenerator[str, None]:
         """生成SSE事件流"""
+        sse_streams_in_flight.inc()
         try:
-            # 发送开始事件，包含用户信息
-            start_event = SSEEvent(
-                event="start",
-                data={
-                    "task_id": request.task_id,
-                    "user_id": user_id,
-                    "user_email": user_email,
-                    "message": "开始生成图像..."
-                }
-            )
-            event_data = f"event: {start_event.event}\n"
-            json_data = json.dumps(start_event.data, ensure_ascii=False)
-            event_data += f"data: {json_data}\n\n"
-            print(f"发送开始SSE事件: {start_event.event}, 数据: {json_data}")
-            yield event_data
-            
-            # 调用图像生成服务
-            async for event in image_generation_service.generate_images_stream(
-                urls=request.urls,
-                task_id=request.task_id,
-                user_id=user_id
-            ):
-                # 格式化SSE事件
-                event_data = f"event: {event.event}\n"
-                json_data = json.dumps(event.data, ensure_ascii=False)
-                event_data += f"data: {json_data}\n\n"
-                print(f"发送SSE事件: {event.event}, 数据: {json_data}")
-                yield event_data
-                
-        except Exception as e:
-            # 发送错误事件
-            error_event = SSEEvent(
-                event="error",
-                data={
-                    "task_id": request.task_id,
-                    "user_id": user_id,
-                    "user_email": user_email,
-                    "error": str(e),
-                    "message": "图像生成过程中发生错误"
-                }
-            )
-            event_data = f"event: {error_event.event}\n"
-            json_data = json.dumps(error_event.data, ensure_ascii=False)
-            event_data += f"data: {json_data}\n\n"
-            print(f"发送错误SSE事件: {error_event.event}, 数据: {json_data}")
-            yield event_data
+            async for event in _until_disconnected(events, http_request):
+                sse_events_total.labels(event.event).inc()
+                yield format_sse(event)
+        finally:
+            sse_streams_in_flight.dec()
     
     return StreamingResponse(
         event_generator(),
@@ -123,7 +337,7 @@ async def generate_images_stream(
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
             "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Headers": "Cache-Control, Authorization",
-            "Access-Control-Allow-Methods": "POST, OPTIONS"
+            "Access-Control-Allow-Headers": "Cache-Control, Authorization, Last-Event-ID",
+            "Access-Control-Allow-Methods": "GET, POST, OPTIONS"
         }
     )
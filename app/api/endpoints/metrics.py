@@ -0,0 +1,107 @@
+"""Prometheus metrics endpoint"""
+
+from fastapi import APIRouter
+from fastapi.responses import Response
+
+from app.core.admission import generation_admission, image_bytes_budget
+from app.core.executors import ark_executor, image_executor, image_process_pool
+from app.core.logging_config import logging_stats
+from app.core.metrics import metrics_registry
+from app.core.resilience import ark_upstream, auth_upstream, storage_upstream
+from app.services.generation_jobs import generation_job_manager
+
+
+router = APIRouter()
+
+# Prometheus 文本格式
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 熔断器状态的数值表示
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+def _executors():
+    return [ark_executor, image_executor, image_process_pool]
+
+
+def _upstreams():
+    return [ark_upstream, storage_upstream, auth_upstream]
+
+
+# 以下指标在抓取时从已有的统计中读取，不增加热路径开销
+metrics_registry.collector(
+    "executor_queue_depth", "Tasks waiting for a worker", "gauge", ("executor",),
+    lambda: {(e.name,): e.queued for e in _executors()},
+)
+metrics_registry.collector(
+    "executor_active", "Tasks currently running on a worker", "gauge", ("executor",),
+    lambda: {(e.name,): e.active for e in _executors()},
+)
+metrics_registry.collector(
+    "executor_rejected_total", "Tasks rejected because the executor queue was full", "counter", ("executor",),
+    lambda: {(e.name,): e.rejected for e in _executors()},
+)
+metrics_registry.collector(
+    "generation_admission_active", "Generation jobs holding an ARK slot", "gauge", (),
+    lambda: {(): generation_admission.active},
+)
+metrics_registry.collector(
+    "generation_admission_queued", "Generation jobs waiting for an ARK slot", "gauge", (),
+    lambda: {(): generation_admission.queued},
+)
+metrics_registry.collector(
+    "generation_admission_rejected_total", "Generation requests rejected because the queue was full", "counter", (),
+    lambda: {(): generation_admission.rejected},
+)
+metrics_registry.collector(
+    "generation_admission_wait_seconds", "Time spent waiting for an ARK slot", "histogram", (),
+    lambda: {(): generation_admission.wait_time},
+)
+metrics_registry.collector(
+    "generation_admission_queue_length", "Waiting jobs seen by each generation request on arrival", "histogram", (),
+    lambda: {(): generation_admission.queue_length},
+)
+metrics_registry.collector(
+    "image_inflight_bytes", "Decoded image bytes currently held in memory", "gauge", (),
+    lambda: {(): image_bytes_budget.in_use},
+)
+metrics_registry.collector(
+    "generation_jobs_running", "Generation jobs still running", "gauge", (),
+    lambda: {(): generation_job_manager.stats()["running"]},
+)
+metrics_registry.collector(
+    "generation_jobs_abandoned_total", "Generation jobs abandoned after all clients disconnected", "counter", (),
+    lambda: {(): generation_job_manager.abandoned},
+)
+metrics_registry.collector(
+    "upstream_calls_total", "Upstream calls, including retries", "counter", ("upstream",),
+    lambda: {(u.name,): u.calls for u in _upstreams()},
+)
+metrics_registry.collector(
+    "upstream_retries_total", "Upstream call retries", "counter", ("upstream",),
+    lambda: {(u.name,): u.retries for u in _upstreams()},
+)
+metrics_registry.collector(
+    "upstream_failures_total", "Transient upstream failures", "counter", ("upstream",),
+    lambda: {(u.name,): u.failures for u in _upstreams()},
+)
+metrics_registry.collector(
+    "upstream_circuit_state", "Circuit breaker state (0 closed, 1 half-open, 2 open)", "gauge", ("upstream",),
+    lambda: {(u.name,): CIRCUIT_STATES[u.breaker.state] for u in _upstreams()},
+)
+metrics_registry.collector(
+    "upstream_latency_seconds", "Latency of successful upstream calls", "histogram", ("upstream",),
+    lambda: {(u.name,): u.latency for u in _upstreams()},
+)
+metrics_registry.collector(
+    "log_records_dropped_total", "Log records dropped because the log queue was full", "counter", (),
+    lambda: {(): logging_stats()["dropped"]},
+)
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+    Prometheus 指标（文本格式，公开接口）
+    """
+    return Response(content=metrics_registry.render(), media_type=CONTENT_TYPE)
@@ -1,16 +1,23 @@
+import logging
+
 from fastapi import APIRouter
 
+from app.core.config import settings
+from app.core.deadline import phase_timeout
 from app.core.dependencies import CurrentUser, SupabaseClient
 from app.core.response import success
 
+# 配置日志
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 @router.get("/list")
 async def get_order_list(current_user: CurrentUser, supabase_client: SupabaseClient):
-    res = supabase_client.table("t_order").select("*").execute()
-    print(res.data)
     """Get order list"""
+    async with phase_timeout("db", settings.db_timeout_seconds):
+        res = await supabase_client.table("t_order").select("*").execute()
+    logger.debug(f"📦 Loaded {len(res.data)} orders for user {current_user.get('id')}")
     return success(
         data={
             "orders": [
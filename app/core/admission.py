@@ -0,0 +1,251 @@
+"""生成名额准入控制
+
+限制同时调用 ARK 生成的任务数，超出时进入有界等待队列（先到先得），
+队列已满时立即拒绝，避免流量突增时直接打到 ARK 的限流上；
+并限制进程内处理中的图片字节数，超出时对新的生成施加背压
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import AsyncIterator, Deque, Optional
+
+from app.core.config import settings
+from app.core.metrics import Histogram
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 预估等待时间的平滑系数（指数移动平均）
+HOLD_TIME_SMOOTHING = 0.2
+
+
+class AdmissionQueueFullError(RuntimeError):
+    """等待队列已满"""
+
+
+class AdmissionTicket:
+    """一次准入申请：排队中或已获得名额"""
+
+    def __init__(self, controller: "AdmissionController"):
+        self._controller = controller
+        self.enqueued_at = time.monotonic()
+        self.granted_at: Optional[float] = None
+        self.released = False
+
+    @property
+    def granted(self) -> bool:
+        return self.granted_at is not None
+
+    @property
+    def position(self) -> int:
+        """排队位置（从 1 开始），已获得名额时为 0"""
+        return self._controller.position(self)
+
+    @property
+    def estimated_wait(self) -> Optional[float]:
+        """预估剩余等待秒数，尚无历史数据时为 None"""
+        return self._controller.estimate_wait(self.position)
+
+    async def wait(self) -> AsyncIterator[int]:
+        """
+        等待获得名额，排队期间每当位置变化时产出当前位置
+
+        已获得名额时不产出任何值直接返回
+        """
+        last_position = None
+        while not self.granted and not self.released:
+            changed = self._controller._changed
+            position = self.position
+            if position != last_position:
+                last_position = position
+                yield position
+            await changed.wait()
+
+    def release(self) -> None:
+        """归还名额或退出队列（可重复调用）"""
+        self._controller._release(self)
+
+
+class AdmissionController:
+    """有界并发 + 有界等待队列"""
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._active = 0
+        self._waiters: Deque[AdmissionTicket] = deque()
+        self._changed = asyncio.Event()
+        self._avg_hold: Optional[float] = None
+        self.admitted = 0
+        self.rejected = 0
+        # 每次申请时的队列长度分布，以及获得名额前的等待时间分布（秒）
+        self.queue_length = Histogram(f"{name}_queue_length", (0, 1, 2, 5, 10, 20, 50, 100))
+        self.wait_time = Histogram(
+            f"{name}_wait_seconds", (0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+        )
+
+    @property
+    def active(self) -> int:
+        """已获得名额的任务数"""
+        return self._active
+
+    @property
+    def queued(self) -> int:
+        """排队等待的任务数"""
+        return len(self._waiters)
+
+    def enqueue(self) -> AdmissionTicket:
+        """
+        申请名额，有空闲时立即获得，否则进入等待队列
+
+        Raises:
+            AdmissionQueueFullError: 等待队列已满
+        """
+        self.queue_length.observe(len(self._waiters))
+        ticket = AdmissionTicket(self)
+        if self._active < self.max_concurrency and not self._waiters:
+            self._grant(ticket)
+            return ticket
+
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            logger.warning(
+                f"🚦 Admission '{self.name}' rejected: "
+                f"{self._active} active, {len(self._waiters)} queued"
+            )
+            raise AdmissionQueueFullError(
+                f"'{self.name}' queue is full "
+                f"({self.max_concurrency} running, {self.max_queue} queued)"
+            )
+
+        self._waiters.append(ticket)
+        return ticket
+
+    def position(self, ticket: AdmissionTicket) -> int:
+        if ticket.granted or ticket.released:
+            return 0
+        return self._waiters.index(ticket) + 1
+
+    def estimate_wait(self, position: int) -> Optional[float]:
+        """按平均占用时长估算排在 position 位置的等待时间"""
+        if position <= 0:
+            return 0.0
+        if self._avg_hold is None:
+            return None
+        return round(position * self._avg_hold / self.max_concurrency, 1)
+
+    def _grant(self, ticket: AdmissionTicket) -> None:
+        now = time.monotonic()
+        ticket.granted_at = now
+        self._active += 1
+        self.admitted += 1
+        self.wait_time.observe(now - ticket.enqueued_at)
+
+    def _release(self, ticket: AdmissionTicket) -> None:
+        if ticket.released:
+            return
+        ticket.released = True
+
+        if ticket.granted_at is not None:
+            self._active -= 1
+            held = time.monotonic() - ticket.granted_at
+            if self._avg_hold is None:
+                self._avg_hold = held
+            else:
+                self._avg_hold += HOLD_TIME_SMOOTHING * (held - self._avg_hold)
+        else:
+            self._waiters.remove(ticket)
+
+        while self._waiters and self._active < self.max_concurrency:
+            self._grant(self._waiters.popleft())
+        self._notify()
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def stats(self) -> dict:
+        """准入统计信息"""
+        return {
+            "name": self.name,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_hold_seconds": self._avg_hold,
+            "queue_length": self.queue_length.snapshot(),
+            "wait_seconds": self.wait_time.snapshot(),
+        }
+
+
+class ByteBudget:
+    """
+    进程内字节预算
+
+    已经收到的数据无法拒绝，因此 reserve 总是成功；
+    新的工作在开始前调用 wait_for_capacity，预算超限时等待已有数据释放
+    """
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self._in_use = 0
+        self._peak = 0
+        self._changed = asyncio.Event()
+        self.waits = 0
+
+    @property
+    def in_use(self) -> int:
+        return self._in_use
+
+    @property
+    def exceeded(self) -> bool:
+        return self._in_use >= self.limit
+
+    def reserve(self, size: int) -> int:
+        """登记 size 字节，返回登记的字节数（用于 release）"""
+        self._in_use += size
+        self._peak = max(self._peak, self._in_use)
+        return size
+
+    def release(self, size: int) -> None:
+        self._in_use -= size
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait_for_capacity(self) -> None:
+        """预算未超限时立即返回，否则等待直到低于上限"""
+        if not self.exceeded:
+            return
+        self.waits += 1
+        logger.warning(
+            f"🚦 Budget '{self.name}' exceeded ({self._in_use}/{self.limit} bytes), waiting"
+        )
+        while self.exceeded:
+            await self._changed.wait()
+
+    def stats(self) -> dict:
+        """预算统计信息"""
+        return {
+            "name": self.name,
+            "limit": self.limit,
+            "in_use": self._in_use,
+            "peak": self._peak,
+            "waits": self.waits,
+        }
+
+
+# ARK 生成名额
+generation_admission = AdmissionController(
+    "generation",
+    max_concurrency=settings.generation_max_concurrency,
+    max_queue=settings.generation_max_queue,
+)
+
+# 处理中的生成图片字节数（base64 + 解码后数据）
+image_bytes_budget = ByteBudget("image_bytes", limit=settings.image_inflight_bytes_limit)
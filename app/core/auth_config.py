@@ -19,6 +19,9 @@ PUBLIC_PATHS: Set[str] = {
     "/health/check", 
     "/health/ping",
     
+    # Prometheus 指标抓取
+    "/metrics",
+    
     # API 文档
     "/docs",
     "/redoc",
@@ -48,6 +51,7 @@ PUBLIC_PATH_PATTERNS: List[str] = [
     r"^/docs.*",      # Swagger 文档相关，匹配 /docs, /docs/, /docs/xxx
     r"^/redoc.*",     # ReDoc 文档相关，匹配 /redoc, /redoc/, /redoc/xxx
     r"^/static/.*",   # 静态文件，匹配 /static/xxx
+    r"^/api/faceflip/images/.*",  # 生成图片的缩放变体（存储桶本身公开，供 <img> 直接引用）
 ]
 
 
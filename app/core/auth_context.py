@@ -0,0 +1,34 @@
+"""请求级认证上下文
+
+AuthMiddleware 验证通过后把结果存到 request.state 中，
+CurrentUser 等依赖优先读取这里的结果，只有中间件未启用（如 api/index.py）时才自行验证，
+保证每个请求最多只校验一次 token
+"""
+
+from typing import Optional
+from starlette.requests import HTTPConnection
+
+
+def set_request_user(request: HTTPConnection, user: dict, token: str) -> None:
+    """记录本次请求的认证结果"""
+    request.state.current_user = user
+    request.state.auth_token = token
+
+
+def get_request_user(request: HTTPConnection, token: Optional[str] = None) -> Optional[dict]:
+    """
+    读取本次请求已验证的用户
+
+    Args:
+        request: 当前请求
+        token: 如果提供，只有当已验证的 token 与之相同时才返回用户
+
+    Returns:
+        用户信息字典，尚未验证时返回 None
+    """
+    user: Optional[dict] = getattr(request.state, "current_user", None)
+    if user is None:
+        return None
+    if token is not None and getattr(request.state, "auth_token", None) != token:
+        return None
+    return user
@@ -0,0 +1,119 @@
+"""进程级客户端注册表
+
+所有 Supabase 客户端均为异步客户端（数据库、认证、存储调用都可以 await，不阻塞事件循环），
+共享同一个带 keep-alive 连接池的 httpx.AsyncClient，
+在 FastAPI lifespan 中创建、关闭；没有 lifespan 的环境（如 api/index.py）首次使用时懒加载
+"""
+
+import logging
+import os
+import threading
+from typing import Optional
+
+import httpx
+from supabase import AsyncClient, AsyncClientOptions
+
+from app.core.config import settings
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class ClientRegistry:
+    """
+    共享客户端注册表
+
+    - supabase: service role 客户端，用于认证、数据库访问
+    - supabase_anon: anon key 客户端，用于图片存储上传
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self._supabase: Optional[AsyncClient] = None
+        self._supabase_anon: Optional[AsyncClient] = None
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        """共享的 HTTP 连接池"""
+        if self._http_client is None:
+            with self._lock:
+                if self._http_client is None:
+                    self._http_client = httpx.AsyncClient(
+                        limits=httpx.Limits(
+                            max_connections=settings.http_pool_max_connections,
+                            max_keepalive_connections=settings.http_pool_max_keepalive,
+                            keepalive_expiry=settings.http_pool_keepalive_expiry,
+                        ),
+                        timeout=settings.http_timeout,
+                        follow_redirects=True,
+                        http2=settings.http2_enabled,
+                    )
+                    logger.info(
+                        f"🔌 HTTP pool created (max_connections={settings.http_pool_max_connections}, "
+                        f"max_keepalive={settings.http_pool_max_keepalive})"
+                    )
+        return self._http_client
+
+    @property
+    def supabase(self) -> AsyncClient:
+        """service role Supabase 客户端"""
+        if self._supabase is None:
+            if not settings.supabase_url:
+                raise ValueError("SUPABASE_URL environment variable not set")
+            if not settings.supabase_service_role_key:
+                raise ValueError("SUPABASE_SERVICE_ROLE_KEY environment variable not set")
+            with self._lock:
+                if self._supabase is None:
+                    self._supabase = self._create_supabase(settings.supabase_service_role_key)
+            logger.info("✅ Supabase client initialized successfully")
+        return self._supabase
+
+    @property
+    def supabase_anon(self) -> AsyncClient:
+        """anon key Supabase 客户端"""
+        if self._supabase_anon is None:
+            supabase_url = settings.supabase_url or os.environ.get("SUPABASE_URL")
+            supabase_key = settings.supabase_key or os.environ.get("SUPABASE_KEY")
+            if not supabase_url or not supabase_key:
+                raise ValueError("SUPABASE_URL 和 SUPABASE_KEY 环境变量未设置")
+            with self._lock:
+                if self._supabase_anon is None:
+                    self._supabase_anon = self._create_supabase(supabase_key, supabase_url)
+            logger.info("✅ Supabase anon client initialized successfully")
+        return self._supabase_anon
+
+    def _create_supabase(self, key: str, url: Optional[str] = None) -> AsyncClient:
+        return AsyncClient(
+            url or settings.supabase_url,
+            key,
+            options=AsyncClientOptions(
+                httpx_client=self.http_client,
+                # 服务端共享客户端不保存会话，也不需要后台刷新 token
+                auto_refresh_token=False,
+                persist_session=False,
+            ),
+        )
+
+    def startup(self) -> None:
+        """预先创建已配置的客户端，避免首个请求承担初始化开销"""
+        for name in ("supabase", "supabase_anon"):
+            try:
+                getattr(self, name)
+            except ValueError as e:
+                logger.warning(f"⚠️  Skipping {name} client: {e}")
+
+    async def shutdown(self) -> None:
+        """关闭连接池"""
+        with self._lock:
+            http_client = self._http_client
+            self._supabase = None
+            self._supabase_anon = None
+            self._http_client = None
+        if http_client is not None:
+            await http_client.aclose()
+        logger.info("🔌 HTTP pool closed")
+
+
+# 全局客户端注册表
+client_registry = ClientRegistry()
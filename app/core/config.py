@@ -22,13 +22,50 @@ class Settings(BaseSettings):
     cors_credentials: bool = True
     cors_methods: list[str] = ["*"]
     cors_headers: list[str] = ["*"]
-    
+    # 浏览器缓存预检（OPTIONS）结果的秒数（Access-Control-Max-Age）
+    cors_max_age: int = 600
+
+    # Logging
+    # 日志记录经内存队列交给后台线程写出，事件循环不直接写 stdout 或磁盘
+    log_json: bool = True  # 控制台输出 JSON（文件日志始终为 JSON）
+    log_queue_size: int = 10000  # 队列满时丢弃新记录而不是阻塞
+    log_max_bytes: int = 10 * 1024 * 1024  # 单个日志文件大小上限，超过后轮转
+    log_backup_count: int = 5
+    log_max_message_chars: int = 2000  # 消息和附加字段的截断长度
+    # 按 logger 名称（含子 logger）采样 WARNING 以下的记录，1 为全部保留
+    log_sample_rates: dict[str, float] = {"app.sse": 0.1}
+
     # Supabase
     supabase_url: str = ""
     supabase_key: str = ""
     supabase_service_role_key: Optional[str] = None
     supabase_storage_bucket: str = "faceflip-images"
-    
+
+    # Supabase JWT 校验
+    # local: 进程内校验签名/过期/audience/issuer；remote: 每次调用 auth.get_user
+    auth_verification_mode: str = "local"
+    # 本地校验无法进行时（未配置密钥、JWKS 不可用）是否回退到 remote 校验
+    auth_remote_fallback: bool = True
+    supabase_jwt_secret: Optional[str] = None  # HS256 项目 JWT 密钥
+    supabase_jwt_audience: str = "authenticated"
+    supabase_jwt_issuer: Optional[str] = None  # 默认 {supabase_url}/auth/v1
+    supabase_jwks_url: Optional[str] = None  # 默认 {supabase_url}/auth/v1/.well-known/jwks.json
+    supabase_jwks_cache_ttl: int = 600  # 秒
+
+    # Token 校验结果缓存（TTL + LRU）
+    auth_cache_enabled: bool = True
+    auth_cache_ttl_seconds: int = 60  # 实际过期时间为 min(token exp, TTL)
+    auth_cache_negative_ttl_seconds: int = 5  # 无效 token 的负缓存时间
+    auth_cache_max_entries: int = 10000
+    auth_cache_max_bytes: int = 8 * 1024 * 1024  # 8MB
+
+    # 共享 HTTP 连接池（Supabase 客户端）
+    http_pool_max_connections: int = 100
+    http_pool_max_keepalive: int = 20
+    http_pool_keepalive_expiry: float = 30.0  # 秒
+    http_timeout: float = 30.0  # 秒
+    http2_enabled: bool = True
+
     # JWT
     secret_key: str = "your-secret-key-change-this-in-production"
     algorithm: str = "HS256"
@@ -48,10 +85,83 @@ class Settings(BaseSettings):
     ark_api_key: Optional[str] = None
     
     # ARK Image Generation
+    ark_base_url: str = "https://ark.cn-beijing.volces.com/api/v3"
+    # 流式生成：每张图片生成后立即推送并开始上传
+    ark_stream: bool = True
+    # 使用 SDK 的异步客户端（AsyncArk）；关闭时同步客户端在专用线程池中执行
+    ark_use_async_client: bool = True
+    # 生成结果返回格式：b64_json（图片随响应返回）或 url（从 ARK 的图片URL流式转存到存储）
+    ark_response_format: str = "b64_json"
+    image_transfer_chunk_size: int = 64 * 1024
+    ark_executor_max_workers: int = 8
+    ark_executor_max_queue: int = 32
+    # 图片解码等 CPU 密集操作的线程池
+    image_executor_max_workers: int = 4
+    image_executor_max_queue: int = 64
+    # 图片转码等 CPU 密集操作的进程池
+    image_process_max_workers: int = 2
+    image_process_max_queue: int = 32
+    # 上传前转码：空字符串表示保持 PNG，可选 webp / avif（仅 b64_json 模式）
+    image_transcode_format: str = ""
+    image_transcode_quality: int = 80
+    image_transcode_keep_original: bool = False  # 同时上传原始 PNG
+    # 上传完成前推送内联缩略图（preview 事件，仅 b64_json 模式）
+    image_preview_enabled: bool = True
+    image_preview_max_edge: int = 256
+    image_preview_max_bytes: int = 16 * 1024  # data URI 的最大长度
+    # 按需缩放的图片变体（磁盘缓存位于 upload_folder 下）
+    image_variant_cache_dir: str = "image-variants"
+    image_variant_cache_max_bytes: int = 512 * 1024 * 1024
+    # 允许的缩放边长：请求的 w / h 向上取整到其中一档，限制匿名请求能触发的渲染组合数
+    image_variant_sizes: list[int] = [64, 128, 256, 512, 1024, 2048]
+    image_variant_quality: int = 80
+    # 进程内处理中的图片字节数上限（base64 + 解码后数据），超出时暂停接收新图片、推迟新的生成
+    image_inflight_bytes_limit: int = 256 * 1024 * 1024
     ark_default_prompt: str = "生成3张女孩和奶牛玩偶在游乐园开心地坐过山车的图片，涵盖早晨、中午、晚上"
     ark_model: str = "doubao-seedream-4-0-250828"
     ark_image_size: str = "2K"
     ark_max_images: int = 3
+
+    # 请求截止时间与各阶段超时（秒），阶段超时不会超过请求剩余时间
+    request_deadline_seconds: float = 300.0
+    auth_timeout_seconds: float = 5.0
+    ark_timeout_seconds: float = 180.0
+    ark_min_budget_seconds: float = 20.0  # 剩余时间不足时不再排队或调用 ARK
+    upload_timeout_seconds: float = 60.0
+    db_timeout_seconds: float = 10.0
+
+    # 上游调用（ARK、存储、认证）的重试与熔断
+    upstream_retry_attempts: int = 3  # 包含首次调用
+    upstream_retry_base_delay: float = 0.2  # 秒，指数退避的基数（随机抖动）
+    upstream_retry_max_delay: float = 5.0
+    circuit_failure_threshold: int = 5  # 连续瞬时错误达到该次数后熔断
+    circuit_reset_seconds: float = 30.0  # 熔断后的冷却时间
+    # 上传耗时超过近期 p95 时对冲上传（相同路径覆盖写入，不少于 upload_hedge_min_delay 秒）
+    upload_hedging_enabled: bool = False
+    upload_hedge_min_delay: float = 1.0
+
+    # 生成任务（与 SSE 连接解耦，支持断点续传）
+    generation_job_ttl_seconds: int = 600  # 已结束任务的保留时间
+    generation_job_max_retained: int = 1000
+    # 所有 SSE 连接断开后等待重连的时间，超时仍无连接的任务被放弃（取消排队、生成和上传）
+    generation_abandon_grace_seconds: float = 10.0
+    # 放弃时已开始 ARK 生成的任务继续完成并写入结果缓存，而不是取消
+    generation_abandon_finish_started: bool = False
+    # 检测 SSE 客户端断开的轮询间隔
+    sse_disconnect_poll_seconds: float = 1.0
+    # ARK 生成并发上限及排队上限，队列满时直接拒绝
+    generation_max_concurrency: int = 4
+    generation_max_queue: int = 20
+    # 生成结果缓存（相同输入和生成参数直接返回已上传的图片）
+    generation_cache_enabled: bool = True
+    generation_cache_backend: str = "memory"  # memory 或 supabase
+    generation_cache_ttl_seconds: int = 86400
+    generation_cache_max_entries: int = 1000  # 仅 memory 后端
+    generation_cache_table: str = "t_generation_cache"  # 仅 supabase 后端
+
+    # 生成图片上传并发
+    upload_concurrency_per_task: int = 3
+    upload_concurrency_global: int = 16
     
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -0,0 +1,95 @@
+"""请求截止时间与分阶段超时
+
+请求进入时（AuthMiddleware）设置截止时间并保存在 contextvar 中，随 asyncio 任务上下文
+传递到认证、排队、ARK 调用、上传和数据库查询（后台生成任务创建时同样继承）。
+每个阶段的超时取「阶段超时」和「剩余时间」中较小者；剩余时间不足以覆盖下一阶段时立即失败，
+不再发起注定超时的调用。没有截止时间的上下文（如后台脚本）只应用阶段超时。
+"""
+
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Optional
+
+from app.core.config import settings
+
+
+class DeadlineExceededError(TimeoutError):
+    """阶段超时或剩余时间不足"""
+
+    def __init__(self, phase: str, message: str):
+        super().__init__(f"{phase}: {message}")
+        self.phase = phase
+
+
+class Deadline:
+    """单个请求的截止时间（monotonic 时钟）"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def budget(self, phase: str, timeout: float, min_seconds: float = 0.0, reserve: float = 0.0) -> float:
+        """
+        计算阶段可用时间
+
+        Args:
+            phase: 阶段名称
+            timeout: 阶段自身的超时
+            min_seconds: 阶段至少需要的时间，剩余时间不足时直接失败
+            reserve: 为后续阶段预留的时间
+
+        Raises:
+            DeadlineExceededError: 剩余时间不足以覆盖该阶段
+        """
+        available = self.remaining() - reserve
+        if available <= 0 or available < min_seconds:
+            raise DeadlineExceededError(
+                phase,
+                f"remaining {max(self.remaining(), 0):.1f}s of {self.seconds:.0f}s deadline is not enough"
+            )
+        return min(timeout, available)
+
+
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar("deadline", default=None)
+
+
+def start_deadline(seconds: Optional[float] = None) -> Deadline:
+    """为当前上下文（及之后创建的任务）设置截止时间"""
+    deadline = Deadline(settings.request_deadline_seconds if seconds is None else seconds)
+    _current_deadline.set(deadline)
+    return deadline
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+@asynccontextmanager
+async def phase_timeout(
+    phase: str,
+    timeout: float = math.inf,
+    min_seconds: float = 0.0,
+    reserve: float = 0.0
+) -> AsyncIterator[None]:
+    """
+    在阶段超时和请求剩余时间内执行代码块
+
+    Raises:
+        DeadlineExceededError: 剩余时间不足，或代码块未在限定时间内完成
+    """
+    deadline = current_deadline()
+    budget = deadline.budget(phase, timeout, min_seconds, reserve) if deadline is not None else timeout
+    timer = asyncio.timeout(None if math.isinf(budget) else budget)
+    try:
+        async with timer:
+            yield
+    except TimeoutError as e:
+        if isinstance(e, DeadlineExceededError) or not timer.expired():
+            raise
+        raise DeadlineExceededError(phase, f"timed out after {budget:.1f}s") from e
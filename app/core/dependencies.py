@@ -2,13 +2,18 @@
 
 import logging
 from typing import Annotated, Optional
-from fastapi import Depends
+from fastapi import Depends, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from supabase import Client, create_client
+from supabase import AsyncClient
 from starlette.exceptions import HTTPException
 
+from app.core.auth_context import get_request_user, set_request_user
+from app.core.clients import client_registry
 from app.core.config import settings
+from app.core.deadline import DeadlineExceededError
+from app.core.resilience import CircuitOpenError, UpstreamUnavailableError
 from app.core.response_code import ResponseCode
+from app.core.token_verifier import token_verifier
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -18,8 +23,8 @@ logger = logging.getLogger(__name__)
 security = HTTPBearer()
 
 
-def get_supabase_client() -> Client:
-    """Get Supabase client instance"""
+def get_supabase_client() -> AsyncClient:
+    """Get the shared Supabase client instance (pooled, see app.core.clients)"""
     if not settings.supabase_url or not settings.supabase_service_role_key:
         logger.error("❌ Supabase configuration missing - URL or service role key not set")
         raise HTTPException(
@@ -28,9 +33,7 @@ def get_supabase_client() -> Client:
         )
     
     try:
-        client = create_client(settings.supabase_url, settings.supabase_service_role_key)
-        logger.debug("✅ Supabase client created successfully")
-        return client
+        return client_registry.supabase
     except Exception as e:
         logger.error(f"❌ Failed to create Supabase client: {type(e).__name__}: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -40,8 +43,8 @@ def get_supabase_client() -> Client:
 
 
 async def verify_jwt_token(
-    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
-    supabase: Annotated[Client, Depends(get_supabase_client)]
+    request: Request,
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)]
 ) -> dict:
     """
     验证前端传来的 JWT token（由 Supabase JS SDK 生成）
@@ -51,33 +54,73 @@ async def verify_jwt_token(
     2. 获得 access_token
     3. 在请求头中携带：Authorization: Bearer <access_token>
     4. 后端验证 token 并返回用户信息
+    
+    默认在进程内校验签名和 claims，见 app.core.token_verifier；
+    如果 AuthMiddleware 已经验证过本次请求的 token，直接复用其结果
+    """
+    return await _verify_credentials(request, credentials, remote=None)
+
+
+async def verify_jwt_token_strict(
+    request: Request,
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)]
+) -> dict:
     """
+    通过 Supabase Auth 远程验证 JWT token
+    
+    本地校验无法感知 token 吊销（登出、封禁、删除用户），
+    对吊销敏感的路由使用此依赖（StrictUser）
+    """
+    return await _verify_credentials(request, credentials, remote=True)
+
+
+async def _verify_credentials(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials,
+    remote: Optional[bool]
+) -> dict:
+    """校验 Bearer 凭证，失败时抛出带业务错误码的 HTTPException"""
+    token = credentials.credentials
+    
+    # 中间件已经用同样的校验方式验证过该 token 时直接复用
+    reusable = not remote or settings.auth_verification_mode == "remote"
+    if reusable:
+        user = get_request_user(request, token)
+        if user is not None:
+            logger.debug("♻️  Reusing authentication result from AuthMiddleware")
+            return user
+    
     try:
-        token = credentials.credentials
         logger.debug(f"🔍 Verifying JWT token (length: {len(token)})")
         
-        # 使用 Supabase 验证 JWT token
-        response = supabase.auth.get_user(token)
+        user = await token_verifier.verify(token, remote=remote)
         
-        if not response or not response.user:
-            logger.warning("⚠️  Token verification failed: invalid response from Supabase")
+        if not user:
+            logger.warning("⚠️  Token verification failed")
             raise HTTPException(
                 status_code=401,
                 detail=f"{ResponseCode.E_TOKEN_NOT_VALID.code}|token not valid or expired"
             )
         
-        logger.info(f"✅ Token verified for user: {response.user.email}")
-        
-        # 返回用户信息
-        return {
-            "id": response.user.id,
-            "email": response.user.email,
-            "user_metadata": response.user.user_metadata or {},
-            "created_at": str(response.user.created_at) if response.user.created_at else None,
-        }
+        logger.info(f"✅ Token verified for user: {user['email']}")
+        if reusable:
+            set_request_user(request, user, token)
+        return user
         
     except HTTPException:
         raise
+    except DeadlineExceededError as e:
+        logger.warning(f"⏱️  Token verification timed out: {e}")
+        raise HTTPException(
+            status_code=504,
+            detail=f"{ResponseCode.E_DEADLINE_EXCEEDED.code}|{str(e)}"
+        )
+    except (CircuitOpenError, UpstreamUnavailableError) as e:
+        logger.warning(f"🚨 Token verification unavailable: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail=f"{ResponseCode.E_SYSTEM_UNAVAILABLE.code}|{str(e)}"
+        )
     except Exception as e:
         logger.error(
             f"❌ Token verification exception: {type(e).__name__}: {str(e)}",
@@ -90,29 +133,29 @@ async def verify_jwt_token(
 
 
 async def get_optional_user(
-    credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer(auto_error=False)),
-    supabase: Client = Depends(get_supabase_client)
+    request: Request,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer(auto_error=False))
 ) -> Optional[dict]:
     """可选的用户认证 - 允许匿名访问"""
     if not credentials:
         logger.debug("🔓 Optional auth: no credentials provided, returning None")
         return None
     
+    token = credentials.credentials
+    user = get_request_user(request, token)
+    if user is not None:
+        return user
+    
     try:
-        token = credentials.credentials
         logger.debug(f"🔍 Optional auth: verifying token (length: {len(token)})")
-        response = supabase.auth.get_user(token)
+        user = await token_verifier.verify(token)
         
-        if response and response.user:
-            logger.info(f"✅ Optional auth: token verified for user {response.user.email}")
-            return {
-                "id": response.user.id,
-                "email": response.user.email,
-                "user_metadata": response.user.user_metadata or {},
-                "created_at": str(response.user.created_at) if response.user.created_at else None,
-            }
+        if user:
+            logger.info(f"✅ Optional auth: token verified for user {user['email']}")
+            set_request_user(request, user, token)
+            return user
         else:
-            logger.warning("⚠️  Optional auth: invalid token response")
+            logger.warning("⚠️  Optional auth: invalid token")
     except Exception as e:
         logger.warning(f"⚠️  Optional auth: token verification failed - {type(e).__name__}: {str(e)}")
     
@@ -120,7 +163,7 @@ async def get_optional_user(
 
 
 # Type aliases for common dependencies
-SupabaseClient = Annotated[Client, Depends(get_supabase_client)]
+SupabaseClient = Annotated[AsyncClient, Depends(get_supabase_client)]
 CurrentUser = Annotated[dict, Depends(verify_jwt_token)]
+StrictUser = Annotated[dict, Depends(verify_jwt_token_strict)]
 OptionalUser = Annotated[Optional[dict], Depends(get_optional_user)]
-
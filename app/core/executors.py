@@ -0,0 +1,172 @@
+"""专用线程池 / 进程池
+
+阻塞调用（如同步 ARK SDK）使用独立命名、有界的线程池，
+避免长时间运行的任务占满事件循环的默认线程池，影响其他阻塞操作；
+图片编码等 CPU 密集任务使用进程池，不占用主进程的 GIL
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable
+
+from app.core.config import settings
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class ExecutorQueueFullError(RuntimeError):
+    """线程池排队任务已达上限"""
+
+
+class BoundedExecutor:
+    """
+    命名、有界的线程池（processes=True 时为进程池）
+
+    - 最多 max_workers 个线程（进程）同时执行
+    - 最多 max_queue 个任务排队等待，超出时立即拒绝（ExecutorQueueFullError）
+    - 提供排队深度、活跃线程数等统计信息
+
+    进程池的任务函数和参数必须可序列化（模块级函数）
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int, processes: bool = False):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.processes = processes
+        self._pool: Executor
+        if processes:
+            # spawn：子进程不继承主进程的线程和事件循环状态
+            self._pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._submitted = 0  # 排队中 + 执行中
+        self._active = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    @property
+    def active(self) -> int:
+        """正在执行的任务数（进程池按已提交任务数估算）"""
+        if self.processes:
+            return min(self._submitted, self.max_workers)
+        return self._active
+
+    @property
+    def queued(self) -> int:
+        """排队等待线程的任务数"""
+        return self._submitted - self._active
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """
+        在线程池中执行阻塞函数并等待结果
+
+        Raises:
+            ExecutorQueueFullError: 排队任务已达上限
+        """
+        return await self.submit(func, *args)
+
+    def submit(self, func: Callable[..., Any], *args: Any) -> "asyncio.Future":
+        """提交阻塞函数，返回可 await 的 Future"""
+        with self._lock:
+            if self._submitted >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise ExecutorQueueFullError(
+                    f"executor '{self.name}' is full "
+                    f"({self.max_workers} running, {self.max_queue} queued)"
+                )
+            self._submitted += 1
+
+        try:
+            if self.processes:
+                future = self._pool.submit(func, *args)
+                future.add_done_callback(self._count_result)
+            else:
+                future = self._pool.submit(self._call, func, args)
+        except BaseException:
+            self._release()
+            raise
+        # 任务完成、失败或在开始前被取消时都会释放名额
+        future.add_done_callback(lambda _: self._release())
+        return asyncio.wrap_future(future)
+
+    def _release(self) -> None:
+        with self._lock:
+            self._submitted -= 1
+
+    def _count_result(self, future) -> None:
+        if future.cancelled():
+            return
+        with self._lock:
+            if future.exception() is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    def _call(self, func: Callable[..., Any], args: tuple) -> Any:
+        with self._lock:
+            self._active += 1
+        try:
+            result = func(*args)
+        except BaseException:
+            with self._lock:
+                self.failed += 1
+            raise
+        else:
+            with self._lock:
+                self.completed += 1
+            return result
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def stats(self) -> dict:
+        """线程池统计信息"""
+        return {
+            "name": self.name,
+            "kind": "process" if self.processes else "thread",
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "queued": self.queued,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self) -> None:
+        """关闭线程池（不等待正在执行的任务）"""
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        logger.info(f"🧵 Executor '{self.name}' shut down")
+
+
+# 同步 ARK SDK 调用专用线程池
+ark_executor = BoundedExecutor(
+    "ark",
+    max_workers=settings.ark_executor_max_workers,
+    max_queue=settings.ark_executor_max_queue,
+)
+
+# 图片解码等 CPU 密集操作专用线程池
+image_executor = BoundedExecutor(
+    "image",
+    max_workers=settings.image_executor_max_workers,
+    max_queue=settings.image_executor_max_queue,
+)
+
+# 图片转码专用进程池
+image_process_pool = BoundedExecutor(
+    "image-process",
+    max_workers=settings.image_process_max_workers,
+    max_queue=settings.image_process_max_queue,
+    processes=True,
+)
@@ -1,12 +1,114 @@
-"""日志配置模块"""
+"""日志配置模块
 
+所有处理器挂在 QueueListener 的后台线程上，根 logger 只挂一个 QueueHandler：
+- 记录在入队前完成采样和截断，队列满时直接丢弃，事件循环不会阻塞在 stdout 或磁盘上
+- 输出为每行一条的 JSON，文件日志按大小轮转
+"""
+
+import atexit
+import copy
+import json
 import logging
+import queue
+import random
 import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional
 
 from app.core.config import settings
 
+# LogRecord 的标准属性，其余属性视为 extra 字段
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+# 当前的后台写日志线程
+_listener: Optional[QueueListener] = None
+
+
+def _truncate(value: str, limit: int) -> str:
+    if len(value) <= limit:
+        return value
+    return f"{value[:limit]}... [truncated {len(value) - limit} chars]"
+
+
+class JsonFormatter(logging.Formatter):
+    """把日志记录格式化为单行 JSON，extra 字段原样输出"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "location": f"{record.filename}:{record.lineno}",
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            payload["exception"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """按 logger 名称采样 WARNING 以下的记录（子 logger 继承父 logger 的采样率）"""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = dict(rates)
+        self.sampled_out = 0
+
+    def rate_for(self, name: str) -> float:
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition(".")[0]
+        return 1.0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate_for(record.name)
+        if rate >= 1 or random.random() < rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class TruncatingQueueHandler(QueueHandler):
+    """
+    入队前合并消息参数、截断过长的消息和 extra 字段并预先格式化异常栈，
+    JSON 序列化和写出都在后台线程完成；队列满时丢弃记录
+    """
+
+    def __init__(self, log_queue: queue.Queue, max_chars: int):
+        super().__init__(log_queue)
+        # 与 self.queue 是同一个队列，保留具体类型以便读取积压长度
+        self.log_queue = log_queue
+        self.max_chars = max_chars
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = _truncate(record.getMessage(), self.max_chars)
+        record.args = None
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and isinstance(value, str):
+                setattr(record, key, _truncate(value, self.max_chars))
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
 
 def setup_logging(
     log_level: Optional[str] = None,
@@ -15,73 +117,96 @@ def setup_logging(
 ):
     """
     配置应用日志系统
-    
+
     Args:
         log_level: 日志级别 (DEBUG, INFO, WARNING, ERROR, CRITICAL)
         log_file: 日志文件路径（可选）
         enable_file_logging: 是否启用文件日志
     """
+    global _listener
+
     # 确定日志级别
     if log_level is None:
         log_level = "DEBUG" if settings.debug else "INFO"
-    
+
     # 转换为大写
     log_level = log_level.upper()
-    
-    # 日志格式
+
+    # 日志格式（log_json=false 时控制台使用，便于本地阅读）
     log_format = (
         "%(asctime)s - %(name)s - %(levelname)s - "
         "%(message)s"
     )
-    
+
     # 详细日志格式（包含文件名和行号）
     detailed_format = (
         "%(asctime)s - %(name)s - %(levelname)s - "
         "[%(filename)s:%(lineno)d] - %(message)s"
     )
-    
+
     # 使用详细格式如果是 DEBUG 模式
     format_string = detailed_format if log_level == "DEBUG" else log_format
-    
+
     # 创建格式化器
-    formatter = logging.Formatter(
+    json_formatter = JsonFormatter()
+    text_formatter = logging.Formatter(
         format_string,
         datefmt="%Y-%m-%d %H:%M:%S"
     )
-    
+
+    # 重复配置时先停止旧的后台线程（会写完队列中剩余的记录）
+    shutdown_logging()
+
     # 配置根日志记录器
     root_logger = logging.getLogger()
     root_logger.setLevel(log_level)
-    
+
     # 清除现有的处理器
     root_logger.handlers.clear()
-    
+
     # 控制台处理器
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setLevel(log_level)
-    console_handler.setFormatter(formatter)
-    root_logger.addHandler(console_handler)
-    
-    # 文件处理器（如果启用）
+    console_handler.setFormatter(json_formatter if settings.log_json else text_formatter)
+    handlers: List[logging.Handler] = [console_handler]
+
+    # 文件处理器（如果启用），按大小轮转
     if enable_file_logging:
         if log_file is None:
             # 默认日志文件路径
             log_dir = Path("logs")
             log_dir.mkdir(exist_ok=True)
             log_file = log_dir / "app.log"
-        
-        file_handler = logging.FileHandler(log_file, encoding="utf-8")
+
+        file_handler = RotatingFileHandler(
+            log_file,
+            maxBytes=settings.log_max_bytes,
+            backupCount=settings.log_backup_count,
+            encoding="utf-8"
+        )
         file_handler.setLevel(log_level)
-        file_handler.setFormatter(formatter)
-        root_logger.addHandler(file_handler)
-        
+        file_handler.setFormatter(json_formatter)
+        handlers.append(file_handler)
+
         # 错误日志单独记录
         error_log_file = Path(log_file).parent / "error.log"
-        error_handler = logging.FileHandler(error_log_file, encoding="utf-8")
+        error_handler = RotatingFileHandler(
+            error_log_file,
+            maxBytes=settings.log_max_bytes,
+            backupCount=settings.log_backup_count,
+            encoding="utf-8"
+        )
         error_handler.setLevel(logging.ERROR)
-        error_handler.setFormatter(formatter)
-        root_logger.addHandler(error_handler)
-    
+        error_handler.setFormatter(json_formatter)
+        handlers.append(error_handler)
+
+    # 根 logger 只挂队列处理器，实际写出由后台线程完成
+    queue_handler = TruncatingQueueHandler(queue.Queue(settings.log_queue_size), settings.log_max_message_chars)
+    queue_handler.addFilter(SamplingFilter(settings.log_sample_rates))
+    root_logger.addHandler(queue_handler)
+    _listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
     # 配置第三方库的日志级别
     # 避免第三方库的日志过多
     logging.getLogger("uvicorn").setLevel(logging.INFO)
@@ -90,25 +215,49 @@ def setup_logging(
     logging.getLogger("httpx").setLevel(logging.WARNING)
     logging.getLogger("httpcore").setLevel(logging.WARNING)
     logging.getLogger("supabase").setLevel(logging.WARNING)
-    
+
     # 记录日志配置完成
     logger = logging.getLogger(__name__)
     logger.info(f"📋 Logging configured - Level: {log_level}")
     if enable_file_logging:
         logger.info(f"📁 Log file: {log_file}")
-    
+
     return root_logger
 
 
+def shutdown_logging() -> None:
+    """停止后台写日志线程，写完队列中剩余的记录"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def logging_stats() -> dict:
+    """队列积压、因队列满丢弃和被采样丢弃的记录数"""
+    stats = {"queued": 0, "dropped": 0, "sampled_out": 0}
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, TruncatingQueueHandler):
+            stats["queued"] += handler.log_queue.qsize()
+            stats["dropped"] += handler.dropped
+            stats["sampled_out"] += sum(
+                f.sampled_out for f in handler.filters if isinstance(f, SamplingFilter)
+            )
+    return stats
+
+
+# 进程退出时写完队列中剩余的日志
+atexit.register(shutdown_logging)
+
+
 def get_logger(name: str) -> logging.Logger:
     """
     获取日志记录器
-    
+
     Args:
         name: 日志记录器名称（通常使用 __name__）
-    
+
     Returns:
         logging.Logger: 日志记录器实例
     """
     return logging.getLogger(name)
-
@@ -0,0 +1,245 @@
+"""进程内指标
+
+轻量的直方图实现，用于统计排队长度、等待时间等分布；
+以及按 Prometheus 文本格式导出的指标注册表（见 /metrics）：
+
+- 计数器和仪表只在事件循环线程中更新，不加锁
+- 带标签的指标在模块导入时预先绑定标签（labels() 返回的子指标可以保存下来重复使用），
+  热路径上只有一次属性加法或一次直方图 observe
+- 队列深度、熔断状态等已有统计在抓取时通过回调读取，不增加热路径开销
+"""
+
+import bisect
+import math
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+# 默认的耗时分桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class Histogram:
+    """
+    固定分桶直方图（累计计数，与 Prometheus 的 le 语义一致）
+
+    只在事件循环线程中更新和读取，不加锁
+    """
+
+    def __init__(self, name: str, buckets: Sequence[float]):
+        self.name = name
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # 最后一个桶为 +Inf
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value: float) -> None:
+        """记录一个观测值"""
+        self._counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sum += value
+        self._count += 1
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        按分桶线性插值估算分位数（与 Prometheus histogram_quantile 相同），没有观测值时返回 None
+        """
+        counts = list(self._counts)
+        observed = self._count
+        if observed == 0:
+            return None
+
+        rank = q * observed
+        running = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, counts):
+            if count and running + count >= rank:
+                return lower + (bound - lower) * (rank - running) / count
+            running += count
+            lower = bound
+        # 落在 +Inf 桶中时返回最大的有限边界
+        return self.buckets[-1]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """返回累计分桶计数、总和与观测次数"""
+        counts = list(self._counts)
+        total, observed = self._sum, self._count
+
+        cumulative: Dict[str, int] = {}
+        running = 0
+        for bound, count in zip(list(self.buckets) + [float("inf")], counts):
+            running += count
+            cumulative["+Inf" if bound == float("inf") else f"{bound:g}"] = running
+        return {"buckets": cumulative, "sum": total, "count": observed}
+
+
+class Counter:
+    """单调递增计数器（只在事件循环线程中更新，不加锁）"""
+
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+
+class Gauge:
+    """可增可减的仪表（只在事件循环线程中更新，不加锁）"""
+
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class MetricFamily:
+    """同名、同标签维度的一组指标"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        kind: str,
+        labelnames: Sequence[str] = (),
+        factory: Optional[Callable[[], Any]] = None,
+        collect: Optional[Callable[[], Mapping[Tuple[str, ...], Any]]] = None
+    ):
+        """
+        Args:
+            kind: counter / gauge / histogram
+            factory: 创建子指标（Counter / Gauge / Histogram）
+            collect: 抓取时回调，返回 {标签值元组: 数值或 Histogram}，用于导出已有的统计
+        """
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self._factory = factory
+        self._collect = collect
+        self._children: Dict[Tuple[str, ...], Any] = {}
+
+    def labels(self, *values: str) -> Any:
+        """
+        返回标签值对应的子指标（不存在时创建）
+
+        在模块中预先绑定常用的标签组合，热路径上直接使用返回的子指标
+        """
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            if self._factory is None:
+                raise ValueError(f"{self.name} is exported by a collector and has no child metrics")
+            child = self._children[values] = self._factory()
+        return child
+
+    def children(self) -> Mapping[Tuple[str, ...], Any]:
+        if self._collect is not None:
+            return self._collect()
+        return dict(self._children)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels_text(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class MetricsRegistry:
+    """指标注册表，按 Prometheus 文本格式（0.0.4）导出"""
+
+    def __init__(self) -> None:
+        self._families: Dict[str, MetricFamily] = {}
+
+    def _register(self, family: MetricFamily) -> MetricFamily:
+        if family.name in self._families:
+            raise ValueError(f"metric {family.name} already registered")
+        self._families[family.name] = family
+        return family
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> MetricFamily:
+        return self._register(MetricFamily(name, documentation, "counter", labelnames, Counter))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> MetricFamily:
+        return self._register(MetricFamily(name, documentation, "gauge", labelnames, Gauge))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> MetricFamily:
+        return self._register(
+            MetricFamily(name, documentation, "histogram", labelnames, lambda: Histogram(name, buckets))
+        )
+
+    def collector(
+        self,
+        name: str,
+        documentation: str,
+        kind: str,
+        labelnames: Sequence[str],
+        collect: Callable[[], Mapping[Tuple[str, ...], Any]]
+    ) -> MetricFamily:
+        """注册抓取时才读取的指标，collect 返回 {标签值元组: 数值或 Histogram}"""
+        return self._register(MetricFamily(name, documentation, kind, labelnames, collect=collect))
+
+    def unregister(self, name: str) -> None:
+        self._families.pop(name, None)
+
+    def render(self) -> str:
+        """导出所有指标"""
+        lines: List[str] = []
+        for family in self._families.values():
+            lines.append(f"# HELP {family.name} {family.documentation}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            lines.extend(self._samples(family))
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _samples(family: MetricFamily) -> Iterator[str]:
+        names = family.labelnames
+        for values, child in family.children().items():
+            if isinstance(child, Histogram):
+                snapshot = child.snapshot()
+                for bound, count in snapshot["buckets"].items():
+                    labels = _labels_text(names, values, f'le="{bound}"')
+                    yield f"{family.name}_bucket{labels} {count}"
+                labels = _labels_text(names, values)
+                yield f"{family.name}_sum{labels} {_number(snapshot['sum'])}"
+                yield f"{family.name}_count{labels} {snapshot['count']}"
+            else:
+                value = child.value if isinstance(child, (Counter, Gauge)) else child
+                yield f"{family.name}{_labels_text(names, values)} {_number(value)}"
+
+
+# 全局指标注册表
+metrics_registry = MetricsRegistry()
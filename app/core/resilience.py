@@ -0,0 +1,312 @@
+"""上游调用的容错：重试、对冲请求与熔断
+
+- 只重试瞬时错误（连接失败、超时、5xx、408、429），退避时间为带完全随机抖动的指数退避，
+  且不会超过请求剩余时间（见 app.core.deadline）
+- 对冲：调用耗时超过近期 p95 时再发起一次相同的调用，采用先成功的结果（调用必须幂等）
+- 熔断：连续瞬时错误达到阈值后打开，期间直接失败而不是继续排队等待注定失败的调用；
+  冷却时间过后放行一次试探调用，成功则恢复
+"""
+
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+import httpx
+from volcenginesdkarkruntime._exceptions import ArkAPIConnectionError
+
+from app.core.config import settings
+from app.core.deadline import DeadlineExceededError, current_deadline
+from app.core.metrics import Histogram
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 计算对冲延迟所需的最少样本数
+HEDGE_MIN_SAMPLES = 20
+
+
+class CircuitOpenError(Exception):
+    """上游熔断中，调用直接失败"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"upstream '{name}' is unavailable, retry after {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class UpstreamUnavailableError(Exception):
+    """上游调用在重试后仍然失败（与上游明确拒绝请求区分开，调用方应返回可重试的系统错误）"""
+
+    def __init__(self, name: str, error: BaseException):
+        super().__init__(f"upstream '{name}' failed: {type(error).__name__}: {error}")
+        self.name = name
+
+
+def _status_of(error: BaseException) -> Optional[int]:
+    """从各 SDK 的异常中取出 HTTP 状态码"""
+    response = getattr(error, "response", None)
+    for status in (
+        getattr(error, "status_code", None),
+        getattr(error, "status", None),
+        getattr(response, "status_code", None),
+    ):
+        if status is None:
+            continue
+        try:
+            return int(status)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def is_transient(error: BaseException) -> bool:
+    """是否为值得重试、计入熔断的瞬时错误"""
+    if isinstance(error, (DeadlineExceededError, CircuitOpenError)):
+        return False
+    if isinstance(error, (httpx.TransportError, ArkAPIConnectionError, ConnectionError)):
+        return True
+    status = _status_of(error)
+    return status is not None and (status >= 500 or status in (408, 429))
+
+
+def is_rejection(error: BaseException) -> bool:
+    """上游是否明确拒绝了请求（4xx，不含 408、429），而不是暂时不可用"""
+    status = _status_of(error)
+    return status is not None and 400 <= status < 500 and not is_transient(error)
+
+
+class CircuitBreaker:
+    """连续失败计数熔断器：closed -> open -> half_open -> closed"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.opened = 0
+        self.rejected = 0
+        # 半开状态下试探调用的开始时间（None 表示没有进行中的试探）
+        self._probe_started: Optional[float] = None
+
+    @property
+    def available(self) -> bool:
+        """是否可能放行调用（不占用半开状态的试探名额）"""
+        return self.state != "open" or time.monotonic() - self.opened_at >= settings.circuit_reset_seconds
+
+    def allow(self) -> None:
+        """
+        检查是否放行调用
+
+        Raises:
+            CircuitOpenError: 熔断中，或半开状态下已有试探调用在进行
+        """
+        if self.state == "closed":
+            return
+        now = time.monotonic()
+        elapsed = now - self.opened_at
+        if self.state == "open" and elapsed >= settings.circuit_reset_seconds:
+            self.state = "half_open"
+            logger.info(f"🔌 Circuit '{self.name}' half-open, probing upstream")
+        if self.state == "half_open" and (
+            # 试探调用被取消而没有结果时，冷却时间过后允许新的试探
+            self._probe_started is None or now - self._probe_started >= settings.circuit_reset_seconds
+        ):
+            self._probe_started = now
+            return
+        self.rejected += 1
+        raise CircuitOpenError(self.name, max(settings.circuit_reset_seconds - elapsed, 0))
+
+    def record_success(self) -> None:
+        if self.state != "closed":
+            logger.info(f"✅ Circuit '{self.name}' closed, upstream recovered")
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._probe_started = None
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        self._probe_started = None
+        if self.state == "half_open" or (
+            self.state == "closed" and self.consecutive_failures >= settings.circuit_failure_threshold
+        ):
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.opened += 1
+            logger.warning(
+                f"🚨 Circuit '{self.name}' opened after {self.consecutive_failures} consecutive failures"
+            )
+
+    def stats(self) -> dict:
+        """熔断器状态"""
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+class Upstream:
+    """单个上游服务的重试、对冲与熔断"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.breaker = CircuitBreaker(name)
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        # 成功调用的耗时分布（秒），同时用于计算对冲延迟
+        self.latency = Histogram(
+            f"{name}_latency_seconds", (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+        )
+
+    def check(self) -> None:
+        """放行一次调用并计数，熔断中直接失败（CircuitOpenError）"""
+        self.breaker.allow()
+        self.calls += 1
+
+    def ensure_available(self) -> None:
+        """
+        提交依赖该上游的新任务前检查，熔断中直接失败，不占用试探名额
+
+        Raises:
+            CircuitOpenError: 熔断中
+        """
+        if not self.breaker.available:
+            elapsed = time.monotonic() - self.breaker.opened_at
+            raise CircuitOpenError(self.name, max(settings.circuit_reset_seconds - elapsed, 0))
+
+    def record(self, error: Optional[BaseException] = None, seconds: Optional[float] = None) -> None:
+        """记录一次调用结果；非瞬时错误（如 4xx）说明上游可用，不计入熔断"""
+        if isinstance(error, DeadlineExceededError):
+            # 时间预算用完不代表上游不可用
+            return
+        if error is None or not is_transient(error):
+            self.breaker.record_success()
+            if error is None and seconds is not None:
+                self.latency.observe(seconds)
+        else:
+            self.failures += 1
+            self.breaker.record_failure()
+
+    def should_retry(self, error: BaseException, attempt: int) -> bool:
+        """第 attempt 次（从 0 开始）调用失败后是否重试"""
+        return (
+            is_transient(error)
+            and attempt + 1 < settings.upstream_retry_attempts
+            and self.breaker.state == "closed"
+        )
+
+    async def backoff(self, attempt: int) -> None:
+        """
+        带完全随机抖动的指数退避
+
+        Raises:
+            DeadlineExceededError: 请求剩余时间不足以等待后重试
+        """
+        delay = random.uniform(
+            0, min(settings.upstream_retry_max_delay, settings.upstream_retry_base_delay * 2 ** attempt)
+        )
+        deadline = current_deadline()
+        if deadline is not None and deadline.remaining() <= delay:
+            raise DeadlineExceededError(self.name, "no time left to retry")
+        self.retries += 1
+        logger.warning(f"🔁 Retrying {self.name} call (attempt {attempt + 2}) in {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+    def hedge_delay(self) -> Optional[float]:
+        """对冲延迟：近期成功调用耗时的 p95（不少于 upload_hedge_min_delay），样本不足时不对冲"""
+        p95 = self.latency.quantile(0.95)
+        if self.latency.count < HEDGE_MIN_SAMPLES or p95 is None:
+            return None
+        return max(p95, settings.upload_hedge_min_delay)
+
+    async def call(
+        self,
+        func: Callable[..., Awaitable[T]],
+        *args: Any,
+        hedge: bool = False,
+        **kwargs: Any
+    ) -> T:
+        """
+        调用上游，瞬时错误时重试
+
+        Args:
+            func: 幂等的异步调用
+            hedge: 超过 p95 耗时后是否发起对冲调用
+
+        Raises:
+            CircuitOpenError: 熔断中
+            最后一次调用的异常
+        """
+        attempt = 0
+        while True:
+            self.check()
+            started = time.monotonic()
+            try:
+                delay = self.hedge_delay() if hedge else None
+                if delay is None:
+                    result = await func(*args, **kwargs)
+                else:
+                    result = await self._hedged(delay, func, *args, **kwargs)
+            except Exception as e:
+                self.record(e)
+                if not self.should_retry(e, attempt):
+                    raise
+                await self.backoff(attempt)
+                attempt += 1
+                continue
+            self.record(seconds=time.monotonic() - started)
+            return result
+
+    async def _hedged(self, delay: float, func: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any) -> T:
+        """首个调用超过 delay 秒未完成时发起第二个调用，返回先成功的结果并取消另一个"""
+        primary = asyncio.ensure_future(func(*args, **kwargs))
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                self.hedges += 1
+                tasks.append(asyncio.ensure_future(func(*args, **kwargs)))
+
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = error or task.exception()
+            # 所有调用都失败时才会走到这里
+            assert error is not None
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> dict:
+        """调用、重试、对冲统计与熔断器状态"""
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "circuit": self.breaker.stats(),
+            "latency_seconds": self.latency.snapshot(),
+        }
+
+
+# 各上游的容错实例
+ark_upstream = Upstream("ark")
+storage_upstream = Upstream("storage")
+auth_upstream = Upstream("auth")
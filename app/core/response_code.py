@@ -12,6 +12,8 @@ class ResponseCode(Enum):
     # 系统错误 (500, 11xxx)
     E_SYSTEM_BUSY = (500, "system busy")
     E_SYSTEM_UNAVAILABLE = (11002, "service is unavailable")
+    E_GENERATION_QUEUE_FULL = (11003, "generation queue is full, retry later")
+    E_DEADLINE_EXCEEDED = (11004, "request deadline exceeded")
     
     # 参数错误 (12xxx)
     E_INVALID_PARAM = (12001, "param invalid")
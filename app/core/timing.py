@@ -0,0 +1,87 @@
+"""请求分阶段耗时
+
+请求进入时（AuthMiddleware）创建耗时记录并保存在 contextvar 中，认证、处理函数、ARK 生成、
+解码和上传等阶段把耗时累加到当前记录上（后台生成任务创建自己的记录）。
+普通响应通过 Server-Timing 响应头返回（浏览器开发者工具的 Timing 面板可直接查看），
+生成任务在结束事件之前推送 timing 事件并写一条结构化日志。
+
+同一阶段可能执行多次或并发执行（如多张图片同时上传），耗时为各次之和，并记录次数。
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+
+class RequestTimings:
+    """单个请求（或生成任务）的分阶段耗时"""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        # 阶段 -> [累计秒数, 次数]
+        self.phases: Dict[str, list] = {}
+
+    def add(self, phase: str, seconds: float) -> None:
+        entry = self.phases.get(phase)
+        if entry is None:
+            self.phases[phase] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        """Server-Timing 响应头（毫秒），最后一项为总耗时"""
+        metrics = []
+        for phase, (seconds, count) in self.phases.items():
+            metric = f"{phase};dur={seconds * 1000:.1f}"
+            if count > 1:
+                metric += f';desc="x{count}"'
+            metrics.append(metric)
+        metrics.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(metrics)
+
+    def as_dict(self) -> dict:
+        """各阶段耗时（毫秒）与次数，用于 timing 事件和日志"""
+        return {
+            "total_ms": round(self.elapsed() * 1000, 1),
+            "phases": {
+                phase: {"ms": round(seconds * 1000, 1), "count": count}
+                for phase, (seconds, count) in self.phases.items()
+            },
+        }
+
+
+_current_timings: ContextVar[Optional[RequestTimings]] = ContextVar("timings", default=None)
+
+
+def start_timing(timings: Optional[RequestTimings] = None) -> RequestTimings:
+    """为当前上下文（及之后创建的任务）设置耗时记录，默认新建"""
+    if timings is None:
+        timings = RequestTimings()
+    _current_timings.set(timings)
+    return timings
+
+
+def current_timings() -> Optional[RequestTimings]:
+    return _current_timings.get()
+
+
+def record_phase(phase: str, seconds: float) -> None:
+    """把阶段耗时累加到当前记录，没有记录的上下文（如后台脚本）忽略"""
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add(phase, seconds)
+
+
+@contextmanager
+def timed_phase(phase: str) -> Iterator[None]:
+    """记录代码块的耗时（包括异常退出）"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(phase, time.perf_counter() - started)
@@ -0,0 +1,181 @@
+"""Token 校验结果缓存
+
+- TTL + LRU：条目在 min(token exp, TTL) 时过期，按条目数和估算内存双重限额淘汰
+- single-flight：同一 token 的并发未命中只触发一次校验，其余请求等待同一结果
+- 负缓存：校验失败的 token 在短时间内直接拒绝，避免无效 token 洪泛打到 Supabase；
+  loader 抛出的异常（如 Supabase 不可用）不缓存，只传给同一批等待者
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional, cast
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+# 每个条目除用户数据外的固定开销估算（key、元组、OrderedDict 节点）
+ENTRY_OVERHEAD_BYTES = 200
+
+# 发起校验的请求被取消时交给等待者的标记，等待者重新查找缓存或成为新的发起者
+_LEADER_CANCELLED = object()
+
+
+class TokenCache:
+    """token -> 用户信息 的有界缓存"""
+
+    def __init__(
+        self,
+        ttl_seconds: float,
+        negative_ttl_seconds: float,
+        max_entries: int,
+        max_bytes: int
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        # key -> (user 或 None, 过期时间(monotonic), 估算字节数)
+        self._entries: "OrderedDict[str, tuple[Optional[dict], float, int]]" = OrderedDict()
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._bytes = 0
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def make_key(token: str, namespace: str = "") -> str:
+        """缓存 key 使用 token 的摘要，不在内存中保留原始 token"""
+        return hashlib.sha256(f"{namespace}:{token}".encode()).hexdigest()
+
+    async def get_or_load(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Optional[dict]]],
+        expires_at: Optional[float] = None
+    ) -> Optional[dict]:
+        """
+        读取缓存，未命中时调用 loader 校验并写入缓存
+
+        Args:
+            key: 缓存 key（见 make_key）
+            loader: 实际的校验函数
+            expires_at: token 自身的过期时间（unix 时间戳），验证通过的条目不会活得比它更久
+
+        Returns:
+            用户信息字典，token 无效时返回 None（写入负缓存）
+
+        Raises:
+            loader 的异常（不缓存）
+        """
+        while True:
+            found, user = self._lookup(key)
+            if found:
+                return user
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            self.coalesced += 1
+            result = await asyncio.shield(inflight)
+            if result is not _LEADER_CANCELLED:
+                return cast(Optional[dict], result)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            user = await loader()
+        except asyncio.CancelledError:
+            # 发起者被取消（如客户端断开）与 token 是否有效无关，不能把取消传给其他等待者
+            future.set_result(_LEADER_CANCELLED)
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # 没有等待者时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+        self._store(key, user, expires_at)
+        future.set_result(user)
+        return user
+
+    def _lookup(self, key: str) -> tuple[bool, Optional[dict]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+
+        user, expires_at, size = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            return False, None
+
+        self._entries.move_to_end(key)
+        if user is None:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return True, user
+
+    def _store(self, key: str, user: Optional[dict], expires_at: Optional[float]) -> None:
+        ttl = self.ttl_seconds if user is not None else self.negative_ttl_seconds
+        if user is not None and expires_at is not None:
+            # 只有验证通过的条目受 token 过期时间限制，已过期 token 的拒绝结果照常缓存
+            ttl = min(ttl, expires_at - time.time())
+        if ttl <= 0:
+            return
+
+        size = ENTRY_OVERHEAD_BYTES + (len(json.dumps(user, default=str)) if user else 0)
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (user, time.monotonic() + ttl, size)
+        self._bytes += size
+
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def invalidate(self, key: str) -> None:
+        """删除单个条目"""
+        if key in self._entries:
+            self._remove(key)
+
+    def clear(self) -> None:
+        """清空缓存（不重置计数器）"""
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        """缓存统计信息"""
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,321 @@
+"""Supabase JWT 校验
+
+支持两种校验方式：
+- local: 在进程内校验签名（HS256 项目密钥或 JWKS 中的非对称公钥）、过期时间、audience 和 issuer，
+  不产生任何网络请求（JWKS 文档按 TTL 缓存）
+- remote: 调用 supabase.auth.get_user(token)，能感知登出、封禁等吊销操作，
+  仅建议在对吊销敏感的路由上使用
+"""
+
+import asyncio
+import logging
+import time
+from typing import List, Optional, Union
+
+from jose import JWTError, jwt
+
+from app.core.clients import client_registry
+from app.core.config import settings
+from app.core.deadline import DeadlineExceededError, phase_timeout
+from app.core.metrics import metrics_registry
+from app.core.timing import record_phase
+from app.core.resilience import CircuitOpenError, UpstreamUnavailableError, auth_upstream, is_rejection
+from app.core.token_cache import TokenCache
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+# JWKS 中找不到 kid 时，两次强制刷新之间的最小间隔（秒），避免伪造 kid 刷爆 JWKS 接口
+JWKS_MIN_REFRESH_INTERVAL = 30
+
+# 拉取 JWKS 的超时时间（秒）
+JWKS_FETCH_TIMEOUT = 5.0
+
+# 项目 JWT 密钥（SUPABASE_JWT_SECRET）签名使用的算法
+PROJECT_SECRET_ALGORITHM = "HS256"
+
+auth_verify_duration_seconds = metrics_registry.histogram(
+    "auth_verify_duration_seconds", "Token verification latency (including cache hits)", ("mode",)
+)
+auth_verifications_total = metrics_registry.counter(
+    "auth_verifications_total", "Token verifications by outcome", ("mode", "outcome")
+)
+# 预先绑定标签：{mode: (耗时直方图, {outcome: 计数器})}
+_AUTH_METRICS = {
+    mode: (
+        auth_verify_duration_seconds.labels(mode),
+        {outcome: auth_verifications_total.labels(mode, outcome) for outcome in ("valid", "invalid", "error")},
+    )
+    for mode in ("local", "remote")
+}
+
+
+class LocalVerificationUnavailableError(Exception):
+    """本地校验条件不满足（未配置密钥或 JWKS 不可用）"""
+
+
+def user_from_claims(claims: dict) -> dict:
+    """
+    从 JWT claims 构建用户信息字典
+
+    与 supabase.auth.get_user 返回的结构保持一致；
+    access token 中不包含 created_at，因此该字段为 None
+    """
+    return {
+        "id": claims.get("sub"),
+        "email": claims.get("email"),
+        "user_metadata": claims.get("user_metadata") or {},
+        "created_at": None,
+    }
+
+
+def token_expiry(token: str) -> Optional[float]:
+    """读取 token 的 exp（不校验签名，仅用于限制缓存时间）"""
+    try:
+        exp = jwt.get_unverified_claims(token).get("exp")
+        return float(exp) if exp is not None else None
+    except (JWTError, TypeError, ValueError):
+        return None
+
+
+def user_from_response(response) -> Optional[dict]:
+    """从 supabase.auth.get_user 的响应构建用户信息字典"""
+    if not response or not response.user:
+        return None
+    return {
+        "id": response.user.id,
+        "email": response.user.email,
+        "user_metadata": response.user.user_metadata or {},
+        "created_at": str(response.user.created_at) if response.user.created_at else None,
+    }
+
+
+class TokenVerifier:
+    """
+    Supabase access token 校验器
+
+    中间件和依赖注入共用同一个实例（见模块底部的 token_verifier）
+    """
+
+    def __init__(self) -> None:
+        self._jwks: dict = {}
+        self._jwks_fetched_at: float = 0.0
+        self._jwks_lock = asyncio.Lock()
+        self.cache = TokenCache(
+            ttl_seconds=settings.auth_cache_ttl_seconds,
+            negative_ttl_seconds=settings.auth_cache_negative_ttl_seconds,
+            max_entries=settings.auth_cache_max_entries,
+            max_bytes=settings.auth_cache_max_bytes,
+        )
+
+    # ---------- 配置 ----------
+
+    @property
+    def issuer(self) -> Optional[str]:
+        if settings.supabase_jwt_issuer:
+            return settings.supabase_jwt_issuer
+        if settings.supabase_url:
+            return f"{settings.supabase_url.rstrip('/')}/auth/v1"
+        return None
+
+    @property
+    def jwks_url(self) -> Optional[str]:
+        if settings.supabase_jwks_url:
+            return settings.supabase_jwks_url
+        if settings.supabase_url:
+            return f"{settings.supabase_url.rstrip('/')}/auth/v1/.well-known/jwks.json"
+        return None
+
+    # ---------- 对外接口 ----------
+
+    async def verify(self, token: str, remote: Optional[bool] = None) -> Optional[dict]:
+        """
+        校验 token 并返回用户信息
+
+        Args:
+            token: JWT access token
+            remote: 是否强制使用 remote 校验；None 表示按 settings.auth_verification_mode
+
+        Returns:
+            用户信息字典，校验失败返回 None
+
+        Raises:
+            DeadlineExceededError: 校验超过 auth_timeout_seconds 或请求剩余时间
+            CircuitOpenError / UpstreamUnavailableError: Supabase Auth 不可用（不代表 token 无效）
+        """
+        if remote is None:
+            remote = settings.auth_verification_mode == "remote"
+
+        latency, outcomes = _AUTH_METRICS["remote" if remote else "local"]
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            async with phase_timeout("auth", settings.auth_timeout_seconds):
+                if not settings.auth_cache_enabled:
+                    user = await self._verify_uncached(token, remote)
+                else:
+                    user = await self.cache.get_or_load(
+                        TokenCache.make_key(token, "remote" if remote else "local"),
+                        lambda: self._verify_uncached(token, remote),
+                        expires_at=token_expiry(token),
+                    )
+            outcome = "valid" if user else "invalid"
+            return user
+        finally:
+            elapsed = time.perf_counter() - started
+            latency.observe(elapsed)
+            outcomes[outcome].inc()
+            record_phase("auth", elapsed)
+
+    async def _verify_uncached(self, token: str, remote: bool) -> Optional[dict]:
+        if not remote:
+            try:
+                return await self.verify_local(token)
+            except LocalVerificationUnavailableError as e:
+                if not settings.auth_remote_fallback:
+                    # 无法校验不代表 token 无效，不能写入负缓存
+                    logger.error(f"❌ Local token verification unavailable: {e}")
+                    raise UpstreamUnavailableError(auth_upstream.name, e) from e
+                logger.warning(f"⚠️  Local token verification unavailable, falling back to remote: {e}")
+
+        return await self.verify_remote(token)
+
+    async def verify_local(self, token: str) -> Optional[dict]:
+        """
+        进程内校验 token
+
+        Raises:
+            LocalVerificationUnavailableError: 没有可用的校验密钥
+        """
+        try:
+            header = jwt.get_unverified_header(token)
+        except JWTError as e:
+            logger.warning(f"⚠️  Malformed token: {e}")
+            return None
+
+        # 接受的算法由密钥决定，不信任 token 头部：项目密钥只接受 HS256，JWKS 公钥只接受该公钥声明的 alg
+        alg = header.get("alg")
+        signing_key: Union[str, dict]
+        algorithm: Optional[str]
+        if alg == PROJECT_SECRET_ALGORITHM:
+            if not settings.supabase_jwt_secret:
+                raise LocalVerificationUnavailableError("SUPABASE_JWT_SECRET not set")
+            signing_key = settings.supabase_jwt_secret
+            algorithm = PROJECT_SECRET_ALGORITHM
+        elif not alg or alg == "none" or alg.startswith("HS"):
+            logger.warning(f"⚠️  Token signing algorithm not accepted: {alg}")
+            return None
+        else:
+            kid = header.get("kid")
+            if not kid:
+                logger.warning("⚠️  Token without kid rejected")
+                return None
+            public_jwk = await self._get_signing_key(kid)
+            if public_jwk is None:
+                logger.warning(f"⚠️  No JWKS key matches kid={kid}")
+                return None
+            algorithm = public_jwk.get("alg")
+            if algorithm != alg:
+                logger.warning(f"⚠️  Token alg {alg} does not match JWKS key alg {algorithm} (kid={kid})")
+                return None
+            signing_key = public_jwk
+
+        try:
+            claims = jwt.decode(
+                token,
+                signing_key,
+                algorithms=[algorithm],
+                audience=settings.supabase_jwt_audience,
+                issuer=self.issuer,
+                options={"require_exp": True, "require_sub": True},
+            )
+        except JWTError as e:
+            logger.warning(f"⚠️  Token verification failed: {type(e).__name__}: {e}")
+            return None
+
+        user = user_from_claims(claims)
+        logger.debug(f"✅ Token verified locally for user: {user['email']}")
+        return user
+
+    async def verify_remote(self, token: str) -> Optional[dict]:
+        """
+        调用 Supabase Auth 校验 token（可感知吊销），瞬时错误时重试
+
+        只有 Supabase 明确拒绝（4xx）时返回 None，其余错误不能当作 token 无效
+
+        Raises:
+            CircuitOpenError: Supabase Auth 熔断中
+            UpstreamUnavailableError: 重试后仍然失败（连接错误、超时、5xx 等）
+        """
+        try:
+            supabase = client_registry.supabase
+            user = user_from_response(await auth_upstream.call(supabase.auth.get_user, token))
+            if user:
+                logger.info(f"✅ Token verified successfully for user: {user['email']}")
+                return user
+            logger.warning("⚠️  Token verification failed: invalid response from Supabase")
+        except (CircuitOpenError, DeadlineExceededError):
+            raise
+        except Exception as e:
+            if not is_rejection(e):
+                logger.error(f"❌ Supabase Auth unavailable: {type(e).__name__}: {str(e)}", exc_info=True)
+                raise UpstreamUnavailableError(auth_upstream.name, e) from e
+            logger.warning(
+                f"⚠️  Token rejected by Supabase: {type(e).__name__}: {str(e)}\n"
+                f"Token preview: {token[:20]}...{token[-20:] if len(token) > 40 else ''}"
+            )
+        return None
+
+    # ---------- JWKS ----------
+
+    async def _get_signing_key(self, kid: str) -> Optional[dict]:
+        """从缓存的 JWKS 中查找签名公钥，缓存过期或 kid 未知时刷新"""
+        now = time.monotonic()
+        age = now - self._jwks_fetched_at
+        if not self._jwks or age > settings.supabase_jwks_cache_ttl:
+            await self._refresh_jwks()
+        elif self._find_key(kid) is None and age > JWKS_MIN_REFRESH_INTERVAL:
+            # 可能发生了密钥轮换
+            await self._refresh_jwks()
+        return self._find_key(kid)
+
+    def _find_key(self, kid: str) -> Optional[dict]:
+        keys: List[dict] = self._jwks.get("keys", [])
+        for key in keys:
+            if key.get("kid") == kid:
+                return key
+        return None
+
+    async def _refresh_jwks(self) -> None:
+        """刷新 JWKS，并发的刷新只发起一次请求"""
+        fetched_at = self._jwks_fetched_at
+        async with self._jwks_lock:
+            if self._jwks_fetched_at != fetched_at:
+                # 等待期间已被其他请求刷新
+                return
+            await self._fetch_jwks()
+
+    async def _fetch_jwks(self) -> None:
+        url = self.jwks_url
+        if not url:
+            raise LocalVerificationUnavailableError("SUPABASE_URL not set, cannot locate JWKS")
+        try:
+            response = await client_registry.http_client.get(url, timeout=JWKS_FETCH_TIMEOUT)
+            response.raise_for_status()
+            jwks = response.json()
+        except Exception as e:
+            if self._jwks:
+                # 保留旧的 JWKS 继续使用
+                logger.warning(f"⚠️  Failed to refresh JWKS, keeping cached keys: {e}")
+                self._jwks_fetched_at = time.monotonic()
+                return
+            raise LocalVerificationUnavailableError(f"failed to fetch JWKS: {e}")
+
+        self._jwks = jwks
+        self._jwks_fetched_at = time.monotonic()
+        logger.info(f"🔑 JWKS refreshed: {len(jwks.get('keys', []))} keys")
+
+
+# 全局校验器实例
+token_verifier = TokenVerifier()
@@ -7,14 +7,20 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException
 
+from app.core.clients import client_registry
 from app.core.config import settings
+from app.core.executors import ark_executor, image_executor, image_process_pool
 from app.core.logging_config import setup_logging
 from app.core.response import success
 from app.api.routes import api_router
+from app.api.endpoints import metrics
+from app.services.generation_jobs import generation_job_manager
+from app.services.image_generation_service import image_generation_service
 from app.middleware.auth import AuthMiddleware
 from app.middleware.logging import LoggingMiddleware
+from app.middleware.metrics import MetricsMiddleware
 from app.middleware.error_handler import (
-    error_handler_middleware,
+    ErrorHandlerMiddleware,
     validation_exception_handler,
     http_exception_handler
 )
@@ -39,11 +45,20 @@ async def lifespan(app: FastAPI):
     logger.info(f"🔐 Global auth: enabled")
     logger.info("=" * 60)
     
+    # 创建共享的 Supabase 客户端和连接池
+    client_registry.startup()
+    
     yield
     
     # Shutdown
     logger.info("=" * 60)
     logger.info(f"👋 Shutting down {settings.app_name}")
+    await generation_job_manager.shutdown()
+    await client_registry.shutdown()
+    await image_generation_service.close()
+    ark_executor.shutdown()
+    image_executor.shutdown()
+    image_process_pool.shutdown()
     logger.info("=" * 60)
 
 
@@ -58,23 +73,26 @@ app = FastAPI(
 )
 
 
+# Custom middlewares
+# 注意：中间件的添加顺序很重要，执行顺序是反向的（后添加的先执行）
+# 执行顺序：CORS -> Metrics -> Error Handler -> Auth -> Logging
+app.add_middleware(LoggingMiddleware)
+app.add_middleware(AuthMiddleware, enable=True)  # 启用全局认证，类似 Spring 拦截器
+app.add_middleware(ErrorHandlerMiddleware)
+app.add_middleware(MetricsMiddleware)  # 在错误处理之外，统计的是最终返回的状态码
+
 # CORS middleware
+# 最后添加，位于最外层：预检请求（OPTIONS）直接在这里应答，不经过错误处理、认证和日志中间件；
+# 认证失败等错误响应也会带上 CORS 头，浏览器才能读取错误信息
 app.add_middleware(
     CORSMiddleware,
     allow_origins=settings.cors_origins,
     allow_credentials=settings.cors_credentials,
     allow_methods=settings.cors_methods,
     allow_headers=settings.cors_headers,
+    max_age=settings.cors_max_age,
 )
 
-
-# Custom middlewares
-# 注意：中间件的添加顺序很重要，执行顺序是反向的（后添加的先执行）
-# 执行顺序：Logging -> Auth -> Error Handler
-app.add_middleware(LoggingMiddleware)
-app.add_middleware(AuthMiddleware, enable=True)  # 启用全局认证，类似 Spring 拦截器
-app.middleware("http")(error_handler_middleware)
-
 # Exception handlers
 app.add_exception_handler(RequestValidationError, validation_exception_handler)
 app.add_exception_handler(HTTPException, http_exception_handler)
@@ -83,6 +101,9 @@ app.add_exception_handler(HTTPException, http_exception_handler)
 # Include API routes
 app.include_router(api_router, prefix="/api")
 
+# Prometheus 指标
+app.include_router(metrics.router)
+
 
 # Root endpoint
 @app.get("/")
@@ -2,8 +2,9 @@
 
 from app.middleware.auth import AuthMiddleware, get_current_user_from_request
 from app.middleware.logging import LoggingMiddleware
+from app.middleware.metrics import MetricsMiddleware
 from app.middleware.error_handler import (
-    error_handler_middleware,
+    ErrorHandlerMiddleware,
     validation_exception_handler,
     http_exception_handler
 )
@@ -12,7 +13,8 @@ __all__ = [
     "AuthMiddleware",
     "get_current_user_from_request",
     "LoggingMiddleware",
-    "error_handler_middleware",
+    "MetricsMiddleware",
+    "ErrorHandlerMiddleware",
     "validation_exception_handler",
     "http_exception_handler",
 ]
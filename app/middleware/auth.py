@@ -2,23 +2,25 @@
 
 import logging
 import re
-import traceback
-from typing import List, Optional, Set
+from typing import Optional
 from fastapi import Request
-from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
-from supabase import Client, create_client
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
-from app.core.config import settings
 from app.core.response_code import ResponseCode
 from app.core.response import error
 from app.core import auth_config
+from app.core.auth_context import get_request_user, set_request_user
+from app.core.deadline import DeadlineExceededError, start_deadline
+from app.core.resilience import CircuitOpenError, UpstreamUnavailableError
+from app.core.timing import start_timing
+from app.core.token_verifier import token_verifier
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
 
-class AuthMiddleware(BaseHTTPMiddleware):
+class AuthMiddleware:
     """
     全局认证中间件
     
@@ -26,44 +28,25 @@ class AuthMiddleware(BaseHTTPMiddleware):
     只有在白名单中的路径才不需要认证
     
     白名单配置在 app.core.auth_config 中维护
+    
+    纯 ASGI 实现：认证通过后直接调用下游应用，响应（包括 SSE 流）不经过额外的任务和内存队列
     """
     
-    def __init__(self, app, enable: bool = True):
+    def __init__(self, app: ASGIApp, enable: bool = True):
         """
         初始化认证中间件
         
         Args:
-            app: FastAPI 应用实例
+            app: 下游 ASGI 应用
             enable: 是否启用全局认证（默认启用）
         """
-        super().__init__(app)
+        self.app = app
         self.enable = enable
-        self.supabase_client: Optional[Client] = None
         # 从配置文件加载白名单
         self.public_paths = auth_config.PUBLIC_PATHS
         self.public_path_patterns = auth_config.PUBLIC_PATH_PATTERNS
         self._compiled_patterns = [re.compile(pattern) for pattern in self.public_path_patterns]
     
-    def _get_supabase_client(self) -> Client:
-        """获取 Supabase 客户端（懒加载）"""
-        if not self.supabase_client:
-            if not settings.supabase_url:
-                logger.error("❌ SUPABASE_URL not set")
-                raise Exception("SUPABASE_URL environment variable not set")
-            if not settings.supabase_service_role_key:
-                logger.error("❌ SUPABASE_SERVICE_ROLE_KEY not set")
-                raise Exception("SUPABASE_SERVICE_ROLE_KEY environment variable not set")
-            try:
-                self.supabase_client = create_client(
-                    settings.supabase_url, 
-                    settings.supabase_service_role_key
-                )
-                logger.info("✅ Supabase client initialized successfully")
-            except Exception as e:
-                logger.error(f"❌ Failed to create Supabase client: {e}", exc_info=True)
-                raise
-        return self.supabase_client
-    
     def _is_public_path(self, path: str) -> bool:
         """
         判断路径是否在白名单中
@@ -95,98 +78,123 @@ class AuthMiddleware(BaseHTTPMiddleware):
         Returns:
             用户信息字典，验证失败返回 None
         """
-        try:
-            supabase = self._get_supabase_client()
-            response = supabase.auth.get_user(token)
-            
-            if response and response.user:
-                logger.info(f"✅ Token verified successfully for user: {response.user.email}")
-                return {
-                    "id": response.user.id,
-                    "email": response.user.email,
-                    "user_metadata": response.user.user_metadata or {},
-                    "created_at": str(response.user.created_at) if response.user.created_at else None,
-                }
-            else:
-                logger.warning(f"⚠️  Token verification failed: invalid response from Supabase")
-        except Exception as e:
-            logger.error(
-                f"❌ Token verification exception: {type(e).__name__}: {str(e)}\n"
-                f"Token preview: {token[:20]}...{token[-20:] if len(token) > 40 else ''}",
-                exc_info=True
-            )
-        
-        return None
+        return await token_verifier.verify(token)
     
-    async def dispatch(self, request: Request, call_next):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         """
         中间件主逻辑 - 拦截所有请求进行认证检查
         
         类似于 Spring 的 HandlerInterceptor.preHandle()
         """
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        request = Request(scope)
         path = request.url.path
         method = request.method
         
+        # 请求截止时间从这里开始计算，随上下文传递给认证、生成、上传和数据库查询
+        start_deadline()
+        # 分阶段耗时同样从这里开始记录（Server-Timing 响应头）
+        timings = start_timing()
+        
+        response_started = False
+        
+        async def send_wrapper(message: Message) -> None:
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+        
         try:
-            # 如果未启用全局认证，直接放行
-            if not self.enable:
-                logger.debug(f"🔓 Global auth disabled - {method} {path}")
-                return await call_next(request)
-            
-            # 检查是否是公开路径
-            if self._is_public_path(path):
-                logger.debug(f"🔓 Public path - {method} {path}")
-                return await call_next(request)
-            
-            # 从请求头获取 token
-            authorization = request.headers.get("Authorization")
-            
-            if not authorization:
-                logger.warning(f"⚠️  Missing authorization header - {method} {path}")
-                return error(
-                    code=ResponseCode.UNAUTHORIZED,
-                    msg="missing authorization header"
-                )
-            
-            # 验证 Bearer token 格式
-            parts = authorization.split()
-            if len(parts) != 2 or parts[0].lower() != "bearer":
-                logger.warning(
-                    f"⚠️  Invalid authorization header format - {method} {path}\n"
-                    f"Header: {authorization[:50]}..."
-                )
-                return error(
-                    code=ResponseCode.UNAUTHORIZED,
-                    msg="invalid authorization header format"
-                )
-            
-            token = parts[1]
-            
-            # 验证 token
-            user = await self._verify_token(token)
-            if not user:
-                logger.warning(f"⚠️  Token verification failed - {method} {path}")
-                return error(
-                    code=ResponseCode.E_TOKEN_NOT_VALID,
-                    msg="token not valid or expired"
-                )
-            
-            # 将用户信息存储到 request.state 中，供后续使用
-            request.state.current_user = user
-            logger.info(f"🔐 Authenticated user {user['email']} - {method} {path}")
-            
-            # 放行请求
-            return await call_next(request)
-            
+            response = await self._authenticate(request, method, path)
+            if response is None:
+                # 放行请求
+                await self.app(scope, receive, send_wrapper)
+                return
         except Exception as e:
-            logger.error(
-                f"❌ Auth middleware error for {method} {path}: {type(e).__name__}: {str(e)}",
-                exc_info=True
+            if response_started:
+                # 响应已经开始发送，无法再返回错误响应
+                raise
+            response = self._error_response(e, method, path)
+        
+        # 被拦截的请求不经过日志中间件，在这里补上 Server-Timing
+        response.headers["Server-Timing"] = timings.server_timing()
+        await response(scope, receive, send)
+    
+    async def _authenticate(self, request: Request, method: str, path: str) -> Optional[Response]:
+        """
+        检查请求的认证信息
+        
+        Returns:
+            认证失败时的错误响应；放行时返回 None
+        """
+        # 如果未启用全局认证，直接放行
+        if not self.enable:
+            logger.debug(f"🔓 Global auth disabled - {method} {path}")
+            return None
+        
+        # 检查是否是公开路径
+        if self._is_public_path(path):
+            logger.debug(f"🔓 Public path - {method} {path}")
+            return None
+        
+        # 从请求头获取 token
+        authorization = request.headers.get("Authorization")
+        
+        if not authorization:
+            logger.warning(f"⚠️  Missing authorization header - {method} {path}")
+            return error(
+                code=ResponseCode.UNAUTHORIZED,
+                msg="missing authorization header"
+            )
+        
+        # 验证 Bearer token 格式
+        parts = authorization.split()
+        if len(parts) != 2 or parts[0].lower() != "bearer":
+            logger.warning(
+                f"⚠️  Invalid authorization header format - {method} {path}\n"
+                f"Header: {authorization[:50]}..."
+            )
+            return error(
+                code=ResponseCode.UNAUTHORIZED,
+                msg="invalid authorization header format"
             )
+        
+        token = parts[1]
+        
+        # 验证 token
+        user = await self._verify_token(token)
+        if not user:
+            logger.warning(f"⚠️  Token verification failed - {method} {path}")
             return error(
-                code=ResponseCode.E_SYSTEM_BUSY,
-                msg=f"authentication error: {str(e)}"
+                code=ResponseCode.E_TOKEN_NOT_VALID,
+                msg="token not valid or expired"
             )
+        
+        # 将用户信息存储到 request.state 中（即 scope["state"]），供后续使用（CurrentUser 依赖直接复用）
+        set_request_user(request, user, token)
+        logger.info(f"🔐 Authenticated user {user['email']} - {method} {path}")
+        return None
+    
+    @staticmethod
+    def _error_response(e: Exception, method: str, path: str) -> Response:
+        """把认证或下游处理中的异常转换为错误响应"""
+        if isinstance(e, DeadlineExceededError):
+            logger.warning(f"⏱️  Auth timed out - {method} {path}: {e}")
+            return error(code=ResponseCode.E_DEADLINE_EXCEEDED, msg=str(e))
+        if isinstance(e, (CircuitOpenError, UpstreamUnavailableError)):
+            logger.warning(f"🚨 Auth upstream unavailable - {method} {path}: {e}")
+            return error(code=ResponseCode.E_SYSTEM_UNAVAILABLE, msg=str(e))
+        logger.error(
+            f"❌ Auth middleware error for {method} {path}: {type(e).__name__}: {str(e)}",
+            exc_info=True
+        )
+        return error(
+            code=ResponseCode.E_SYSTEM_BUSY,
+            msg=f"authentication error: {str(e)}"
+        )
 
 
 # 便捷函数：从 request.state 获取当前用户
@@ -203,5 +211,5 @@ def get_current_user_from_request(request: Request) -> Optional[dict]:
             user = get_current_user_from_request(request)
             return success(data=user)
     """
-    return getattr(request.state, "current_user", None)
+    return get_request_user(request)
 
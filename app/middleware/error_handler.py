@@ -6,7 +6,9 @@ from fastapi import Request
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from app.core.deadline import DeadlineExceededError
 from app.core.response_code import ResponseCode
 from app.core.response import error
 
@@ -14,30 +16,59 @@ from app.core.response import error
 logger = logging.getLogger(__name__)
 
 
-async def error_handler_middleware(request: Request, call_next):
-    """全局错误处理中间件 - 捕获所有异常"""
-    try:
-        return await call_next(request)
-    except Exception as exc:
-        # 记录详细的错误日志
-        logger.error(
-            f"❌ Unhandled exception in {request.method} {request.url.path}\n"
-            f"Exception type: {type(exc).__name__}\n"
-            f"Exception message: {str(exc)}\n"
-            f"Traceback:\n{''.join(traceback.format_tb(exc.__traceback__))}",
-            exc_info=True,
-            extra={
-                "method": request.method,
-                "path": request.url.path,
-                "query_params": str(request.query_params),
-                "client_host": request.client.host if request.client else "unknown"
-            }
-        )
+class ErrorHandlerMiddleware:
+    """全局错误处理中间件 - 捕获所有异常（纯 ASGI 实现）"""
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        response_started = False
+        
+        async def send_wrapper(message: Message) -> None:
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
         
-        return error(
-            code=ResponseCode.E_SYSTEM_BUSY,
-            msg=f"system error: {str(exc)}"
-        )
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as exc:
+            if response_started:
+                # 响应已经开始发送（如 SSE 流中途出错），只能交给服务器断开连接
+                raise
+            
+            request = Request(scope)
+            if isinstance(exc, DeadlineExceededError):
+                logger.warning(f"⏱️  Deadline exceeded in {request.method} {request.url.path}: {exc}")
+                response = error(code=ResponseCode.E_DEADLINE_EXCEEDED, msg=str(exc))
+                await response(scope, receive, send)
+                return
+            
+            # 记录详细的错误日志
+            logger.error(
+                f"❌ Unhandled exception in {request.method} {request.url.path}\n"
+                f"Exception type: {type(exc).__name__}\n"
+                f"Exception message: {str(exc)}\n"
+                f"Traceback:\n{''.join(traceback.format_tb(exc.__traceback__))}",
+                exc_info=True,
+                extra={
+                    "method": request.method,
+                    "path": request.url.path,
+                    "query_params": str(request.query_params),
+                    "client_host": request.client.host if request.client else "unknown"
+                }
+            )
+            
+            response = error(
+                code=ResponseCode.E_SYSTEM_BUSY,
+                msg=f"system error: {str(exc)}"
+            )
+            await response(scope, receive, send)
 
 
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
@@ -1,39 +1,66 @@
 """Logging middleware"""
 
+import logging
 import time
-from fastapi import Request
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.types import ASGIApp
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from app.core.timing import current_timings
+
+
+# 访问日志（通过队列写出，不阻塞事件循环）
+logger = logging.getLogger("app.access")
+
+
+class LoggingMiddleware:
+    """Middleware for logging HTTP requests (pure ASGI, response chunks are passed through untouched)"""
 
-class LoggingMiddleware(BaseHTTPMiddleware):
-    """Middleware for logging HTTP requests"""
-    
     def __init__(self, app: ASGIApp):
-        super().__init__(app)
-    
-    async def dispatch(self, request: Request, call_next):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         """Log request and response"""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
         start_time = time.time()
-        
+        handler_started = time.perf_counter()
+        method, path = scope["method"], scope["path"]
+        timings = current_timings()
+
         # Log request
-        print(f"📥 {request.method} {request.url.path}")
-        
-        # Process request
-        response = await call_next(request)
-        
-        # Calculate processing time
-        process_time = time.time() - start_time
-        
-        # Log response
-        print(
-            f"📤 {request.method} {request.url.path} "
-            f"- Status: {response.status_code} "
-            f"- Time: {process_time:.3f}s"
-        )
-        
-        # Add custom header
-        response.headers["X-Process-Time"] = str(process_time)
-        
-        return response
+        logger.debug(f"📥 {method} {path}", extra={"method": method, "path": path})
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                # Calculate processing time (until response headers are sent)
+                process_time = time.time() - start_time
+                headers = MutableHeaders(scope=message)
+                extra = {}
+                if timings is not None:
+                    # Per-phase breakdown (auth recorded by the token verifier, handler measured here)
+                    timings.add("handler", time.perf_counter() - handler_started)
+                    headers["Server-Timing"] = timings.server_timing()
+                    extra["timing"] = timings.as_dict()
 
+                # Log response
+                logger.info(
+                    f"📤 {method} {path} "
+                    f"- Status: {message['status']} "
+                    f"- Time: {process_time:.3f}s",
+                    extra={
+                        "method": method,
+                        "path": path,
+                        "status": message["status"],
+                        "duration": round(process_time, 6),
+                        **extra,
+                    }
+                )
+
+                # Add custom header
+                headers["X-Process-Time"] = str(process_time)
+            await send(message)
+
+        # Process request
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,103 @@
+"""Metrics middleware"""
+
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.metrics import Histogram, metrics_registry
+
+http_request_duration_seconds = metrics_registry.histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template, until the response body is complete",
+    ("method", "route", "status"),
+)
+http_requests_in_flight = metrics_registry.gauge(
+    "http_requests_in_flight", "HTTP requests currently being processed"
+).labels()
+
+# 没有匹配到路由的请求（404、扫描）统一使用同一个标签，避免标签基数失控
+UNMATCHED_ROUTE = "unmatched"
+# 非标准的请求方法统一使用同一个标签
+OTHER_METHOD = "OTHER"
+STANDARD_METHODS = frozenset(("GET", "HEAD", "POST", "PUT", "DELETE", "CONNECT", "OPTIONS", "TRACE", "PATCH"))
+# 缓存的路由模板数量上限（路由对象按应用生命周期存在，正常情况下远小于该值）
+MAX_CACHED_ROUTES = 1024
+
+
+class MetricsMiddleware:
+    """按路由模板统计请求耗时（纯 ASGI）"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        # (method, route, status) -> 预先绑定的直方图
+        self._histograms: Dict[Tuple[str, str, str], Histogram] = {}
+        # 路由对象 -> 完整的路由模板
+        self._templates: Dict[Any, str] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_flight.dec()
+            method = scope["method"]
+            if method not in STANDARD_METHODS:
+                method = OTHER_METHOD
+            key = (method, self._template(scope), str(status))
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = http_request_duration_seconds.labels(*key)
+            histogram.observe(time.perf_counter() - started)
+
+    def _template(self, scope: Scope) -> str:
+        route = scope.get("route")
+        if route is None:
+            return UNMATCHED_ROUTE
+        try:
+            template = self._templates.get(route)
+        except TypeError:
+            # 不可哈希的路由对象不缓存
+            return _route_template(scope)
+        if template is None:
+            template = _route_template(scope)
+            if len(self._templates) < MAX_CACHED_ROUTES:
+                self._templates[route] = template
+        return template
+
+
+def _route_template(scope: Scope) -> str:
+    """
+    取请求匹配的路由模板（如 /api/faceflip/tasks/{task_id}/events）
+
+    路由器把匹配的路由写入 scope["route"]；子路由器中的路由模板可能不含 include_router 的前缀，
+    这里用实际路径减去按路径参数还原的模板部分得到前缀。
+    请求在到达路由器之前被拦截（认证失败）或没有匹配的路由时返回 unmatched
+    """
+    route = scope.get("route")
+    template: Optional[str] = getattr(route, "path", None)
+    if template is None:
+        return UNMATCHED_ROUTE
+    try:
+        rendered: str = getattr(route, "path_format", template).format(
+            **{name: str(value) for name, value in scope.get("path_params", {}).items()}
+        )
+    except (KeyError, IndexError, ValueError):
+        return template
+    path: str = scope["path"]
+    if path.endswith(rendered):
+        return path[:len(path) - len(rendered)] + template
+    return template
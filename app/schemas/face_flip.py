@@ -15,12 +15,15 @@ class ImageGenerationRequest(BaseModel):
     """图像生成请求模型"""
     urls: List[str]  # 输入图片URL列表
     task_id: str     # 任务ID
+    use_cache: bool = True  # 是否允许使用生成结果缓存
 
 
 class GeneratedImage(BaseModel):
     """生成的图片信息"""
     url: str
     size: str
+    sha256: Optional[str] = None  # 图片内容哈希（url 模式转存时计算）
+    original_url: Optional[str] = None  # 转码时同时上传的原始 PNG
 
 
 class ImageGenerationResponse(BaseModel):
@@ -28,9 +31,11 @@ class ImageGenerationResponse(BaseModel):
     urls: List[str]              # 生成前URL列表
     generated_images: List[GeneratedImage]  # 生成后图片列表
     task_id: str                 # 任务ID
+    failed_count: int = 0        # 生成或上传失败的图片数
 
 
 class SSEEvent(BaseModel):
     """SSE事件模型"""
-    event: str  # start, process, error, done
-    data: Optional[dict] = None
\ No newline at end of file
+    event: str  # start, queued, process, upload_start, image_generated, preview, image_uploaded, timing, error, done
+    data: Optional[dict] = None
+    id: Optional[int] = None  # 任务事件日志中的序号，用于 Last-Event-ID 断点续传
\ No newline at end of file
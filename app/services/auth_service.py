@@ -6,7 +6,11 @@
 
 import logging
 from typing import Optional
-from supabase import Client
+from supabase import AsyncClient
+
+from app.core.clients import client_registry
+from app.core.config import settings
+from app.core.deadline import DeadlineExceededError, phase_timeout
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -21,8 +25,9 @@ class AuthService:
     - 获取用户信息
     """
     
-    def __init__(self, supabase_client: Client):
-        self.supabase = supabase_client
+    def __init__(self, supabase_client: Optional[AsyncClient] = None):
+        # 默认使用进程共享的连接池客户端
+        self.supabase = supabase_client or client_registry.supabase
     
     async def verify_token(self, token: str) -> Optional[dict]:
         """
@@ -36,7 +41,8 @@ class AuthService:
         """
         try:
             logger.debug(f"🔍 [AuthService] Verifying token (length: {len(token)})")
-            response = self.supabase.auth.get_user(token)
+            async with phase_timeout("auth", settings.auth_timeout_seconds):
+                response = await self.supabase.auth.get_user(token)
             
             if response and response.user:
                 logger.info(f"✅ [AuthService] Token verified successfully for user: {response.user.email}")
@@ -50,6 +56,8 @@ class AuthService:
                 logger.warning("⚠️  [AuthService] Token verification failed: invalid response")
             
             return None
+        except DeadlineExceededError:
+            raise
         except Exception as e:
             logger.error(
                 f"❌ [AuthService] Token verification error: {type(e).__name__}: {str(e)}",
@@ -70,7 +78,8 @@ class AuthService:
         try:
             logger.debug(f"🔍 [AuthService] Getting user by ID: {user_id}")
             # 这需要使用 service_role_key 的客户端
-            response = self.supabase.auth.admin.get_user_by_id(user_id)
+            async with phase_timeout("auth", settings.auth_timeout_seconds):
+                response = await self.supabase.auth.admin.get_user_by_id(user_id)
             
             if response and response.user:
                 logger.info(f"✅ [AuthService] User found: {response.user.email}")
@@ -84,6 +93,8 @@ class AuthService:
                 logger.warning(f"⚠️  [AuthService] User not found: {user_id}")
             
             return None
+        except DeadlineExceededError:
+            raise
         except Exception as e:
             logger.error(
                 f"❌ [AuthService] Get user error for ID {user_id}: {type(e).__name__}: {str(e)}",
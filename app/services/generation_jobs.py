@@ -0,0 +1,452 @@
+"""图像生成任务管理
+
+生成任务与 SSE 连接解耦：任务在后台运行，所有事件按顺序写入带递增 id 的事件日志，
+客户端断开后可以通过 Last-Event-ID 从断点重放并继续接收实时事件，无需重新生成。
+task_id（按用户区分）同时作为幂等键：重复提交时附加到运行中的任务，或直接重放已完成任务的 done 结果。
+已结束的任务在 TTL 到期后淘汰，保留的任务总数有上限。
+所有 SSE 连接断开且在宽限期内没有重连的任务被放弃：取消排队、生成和上传并归还名额。
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import AsyncGenerator, Callable, List, Optional, Set, Tuple
+
+from app.core.admission import AdmissionController, AdmissionQueueFullError, AdmissionTicket, generation_admission
+from app.core.config import settings
+from app.core.deadline import DeadlineExceededError, phase_timeout
+from app.core.resilience import CircuitOpenError, ark_upstream, storage_upstream
+from app.core.response_code import ResponseCode
+from app.core.timing import RequestTimings, start_timing, timed_phase
+from app.schemas.face_flip import GeneratedImage, ImageGenerationResponse, SSEEvent
+from app.services.image_generation_service import ImageGenerationService, image_generation_service
+from app.services.result_cache import GenerationResultCache, generation_result_cache
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+# 结束任务的事件类型
+TERMINAL_EVENTS = {"done", "error"}
+
+
+class GenerationJobConflictError(ValueError):
+    """同一 task_id 已被参数不同的请求使用"""
+
+
+class GenerationJob:
+    """单个生成任务及其事件日志"""
+
+    def __init__(self, task_id: str, user_id: str, urls: List[str], prompt: Optional[str] = None):
+        self.task_id = task_id
+        self.user_id = user_id
+        self.urls = list(urls)
+        self.prompt = prompt
+        self.events: List[SSEEvent] = []
+        self.created_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self.use_cache = False
+        # ARK 生成开始时间和耗时（秒），用于统计被放弃任务浪费的生成时间
+        self.ark_started_at: Optional[float] = None
+        self.ark_seconds: Optional[float] = None
+        # 分阶段耗时，在结束事件（done / error）之前以 timing 事件推送
+        self.timings: Optional[RequestTimings] = None
+        self._timing_sent = False
+        # 当前订阅事件流的连接数，降为 0 时回调 on_idle
+        self.subscribers = 0
+        self.abandoned = False
+        self.on_idle: Optional[Callable[["GenerationJob"], None]] = None
+        self.abandon_timer: Optional[asyncio.TimerHandle] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    @property
+    def status(self) -> str:
+        if not self.finished:
+            return "running"
+        if self.events and self.events[-1].event in TERMINAL_EVENTS:
+            return self.events[-1].event
+        return "abandoned"
+
+    def matches(self, urls: List[str], prompt: Optional[str]) -> bool:
+        """重复提交的参数是否与原任务一致"""
+        return self.urls == list(urls) and self.prompt == prompt
+
+    def append(self, event: SSEEvent) -> SSEEvent:
+        """追加事件并分配 id（从 1 开始递增）"""
+        if event.event in TERMINAL_EVENTS:
+            self._append_timing()
+        event.id = len(self.events) + 1
+        self.events.append(event)
+        self._notify()
+        return event
+
+    def _append_timing(self) -> None:
+        """
+        推送 timing 事件并写一条结构化日志
+
+        放在结束事件之前而不是之后：收到 done 就关闭连接的客户端也能收到，任务状态仍由最后一个事件决定
+        """
+        if self.timings is None or self._timing_sent:
+            return
+        self._timing_sent = True
+        timing = self.timings.as_dict()
+        logger.info(
+            f"⏱️ Generation job {self.task_id} timing: {timing['total_ms']}ms",
+            extra={"task_id": self.task_id, "timing": timing}
+        )
+        self.events.append(SSEEvent(
+            id=len(self.events) + 1,
+            event="timing",
+            data={"task_id": self.task_id, **timing}
+        ))
+
+    def finish(self) -> None:
+        if self.finished_at is None:
+            self.finished_at = time.monotonic()
+            self._notify()
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def subscribe(self, last_event_id: int = 0) -> AsyncGenerator[SSEEvent, None]:
+        """
+        先重放 id 大于 last_event_id 的历史事件，然后持续推送新事件，任务结束后停止
+        """
+        position = max(last_event_id, 0)
+        self.subscribers += 1
+        try:
+            while True:
+                changed = self._changed
+                while position < len(self.events):
+                    yield self.events[position]
+                    position += 1
+                if self.finished:
+                    return
+                await changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.finished and self.on_idle is not None:
+                self.on_idle(self)
+
+    def attach(self) -> AsyncGenerator[SSEEvent, None]:
+        """
+        重复提交时附加到任务：运行中从头重放并继续接收实时事件，已成功完成时只重放 done 事件
+        """
+        if self.status == "done":
+            return self.subscribe(len(self.events) - 1)
+        return self.subscribe()
+
+
+class GenerationJobManager:
+    """进程内生成任务管理器，任务按 (user_id, task_id) 区分"""
+
+    def __init__(
+        self,
+        service: ImageGenerationService,
+        admission: AdmissionController,
+        cache: Optional[GenerationResultCache] = None
+    ):
+        self.service = service
+        self.admission = admission
+        self.cache = cache
+        self._jobs: "OrderedDict[Tuple[str, str], GenerationJob]" = OrderedDict()
+        # 持有运行中任务的强引用，避免被替换记录的任务被垃圾回收
+        self._running: Set[asyncio.Task] = set()
+        # 被放弃的任务数、其中继续完成并写入缓存的任务数，以及被放弃任务已消耗的 ARK 生成时间
+        self.abandoned = 0
+        self.abandoned_finished = 0
+        self.wasted_ark_seconds = 0.0
+
+    def get(self, user_id: str, task_id: str) -> Optional[GenerationJob]:
+        """获取任务，不存在或已淘汰时返回 None"""
+        self._evict()
+        return self._jobs.get((user_id, task_id))
+
+    async def start(
+        self,
+        task_id: str,
+        user_id: str,
+        urls: List[str],
+        user_email: Optional[str] = None,
+        prompt: Optional[str] = None,
+        use_cache: bool = True
+    ) -> GenerationJob:
+        """
+        在后台启动生成任务
+
+        同一用户重复提交相同 task_id 时，运行中或已成功完成的任务直接返回，不会再次调用 ARK；
+        失败或中断的任务重新生成。先查询结果缓存，未命中时才申请生成名额
+
+        Raises:
+            GenerationJobConflictError: task_id 已被参数不同的请求使用
+            AdmissionQueueFullError: 生成名额的等待队列已满
+        """
+        self._evict()
+        key = (user_id, task_id)
+        existing = self._jobs.get(key)
+        if existing is not None and existing.status in ("running", "done"):
+            if not existing.matches(urls, prompt):
+                raise GenerationJobConflictError(f"task_id '{task_id}' already used with different parameters")
+            logger.info(f"♻️ Reusing generation job {task_id} ({existing.status})")
+            return existing
+
+        job = GenerationJob(task_id, user_id, urls, prompt)
+        job.use_cache = use_cache and self.cache is not None and self.cache.enabled
+        job.timings = RequestTimings()
+        job.on_idle = self._schedule_abandon
+        # 查询缓存前先登记任务，期间重复提交的请求附加到该任务
+        self._jobs.pop(key, None)
+        self._jobs[key] = job
+
+        # 命中结果缓存的请求不需要生成名额，等待队列已满时也能直接返回
+        cached_images = None
+        if job.use_cache:
+            assert self.cache is not None
+            lookup_started = time.perf_counter()
+            cached_images = await self.cache.get(urls, prompt)
+            job.timings.add("cache", time.perf_counter() - lookup_started)
+
+        ticket = None
+        if cached_images is None:
+            try:
+                ticket = self.admission.enqueue()
+            except AdmissionQueueFullError:
+                # 恢复原来的记录，已附加到该任务的连接随之结束
+                if self._jobs.get(key) is job:
+                    del self._jobs[key]
+                    if existing is not None:
+                        self._jobs[key] = existing
+                job.finish()
+                raise
+
+        job.task = asyncio.create_task(self._run(job, ticket, cached_images, urls, user_email, prompt))
+        self._running.add(job.task)
+        job.task.add_done_callback(self._running.discard)
+        return job
+
+    async def _run(
+        self,
+        job: GenerationJob,
+        ticket: Optional[AdmissionTicket],
+        cached_images: Optional[List[GeneratedImage]],
+        urls: List[str],
+        user_email: Optional[str],
+        prompt: Optional[str]
+    ) -> None:
+        """执行生成流程，把所有事件写入任务的事件日志（命中结果缓存时没有 ticket）"""
+        # 任务在自己的上下文副本中运行，耗时记录不会写到提交请求的记录上
+        start_timing(job.timings)
+        try:
+            # 发送开始事件，包含用户信息
+            job.append(SSEEvent(
+                event="start",
+                data={
+                    "task_id": job.task_id,
+                    "user_id": job.user_id,
+                    "user_email": user_email,
+                    "message": "开始生成图像..."
+                }
+            ))
+
+            # 命中结果缓存时直接返回之前上传的图片
+            if cached_images is not None:
+                response_data = ImageGenerationResponse(
+                    urls=urls,
+                    generated_images=cached_images,
+                    task_id=job.task_id
+                )
+                job.append(SSEEvent(
+                    event="done",
+                    data={**response_data.model_dump(), "cached": True}
+                ))
+                return
+
+            # 未命中缓存时 start 已经申请了名额
+            assert ticket is not None
+
+            # ARK 或存储熔断中时直接失败，不再排队等待注定失败的生成
+            ark_upstream.ensure_available()
+            storage_upstream.ensure_available()
+
+            # 等待生成名额，排队期间推送排队位置和预估等待时间
+            # 剩余时间不足以完成一次 ARK 生成时停止排队
+            with timed_phase("queue"):
+                async with phase_timeout("queue", reserve=settings.ark_min_budget_seconds):
+                    async for position in ticket.wait():
+                        job.append(SSEEvent(
+                            event="queued",
+                            data={
+                                "task_id": job.task_id,
+                                "position": position,
+                                "estimated_wait_seconds": ticket.estimated_wait,
+                                "message": f"排队中，前面还有 {position - 1} 个任务"
+                            }
+                        ))
+
+            # 调用图像生成服务，ARK 生成结束后立即归还名额（上传不占用名额）
+            ark_started_at = job.ark_started_at = time.monotonic()
+
+            def on_generation_done() -> None:
+                job.ark_seconds = time.monotonic() - ark_started_at
+                ticket.release()
+
+            generated_images = None
+            generated_count = 0
+            failed_count = 0
+            async for event in self.service.generate_images_stream(
+                urls=urls,
+                task_id=job.task_id,
+                user_id=job.user_id,
+                prompt=prompt,
+                on_generation_done=on_generation_done
+            ):
+                job.append(event)
+                if event.event == "image_generated":
+                    generated_count += 1
+                elif event.event == "done" and event.data is not None:
+                    generated_images = event.data.get("generated_images")
+                    failed_count = event.data.get("failed_count", 0)
+
+            # 先结束事件流，再写入结果缓存
+            job.finish()
+            # 只缓存完整的结果：部分图片生成或上传失败时，相同请求应重新生成
+            if (
+                job.use_cache
+                and generated_images
+                and not failed_count
+                and len(generated_images) == generated_count
+            ):
+                assert self.cache is not None
+                await self.cache.put(urls, prompt, generated_images, job.ark_seconds or 0.0)
+
+        except asyncio.CancelledError:
+            if job.abandoned and job.ark_started_at is not None:
+                # 已完成或进行到一半的 ARK 生成结果被丢弃
+                wasted = job.ark_seconds
+                if wasted is None:
+                    wasted = time.monotonic() - job.ark_started_at
+                self.wasted_ark_seconds += wasted
+            raise
+
+        except DeadlineExceededError as e:
+            logger.warning(f"⏱️ Generation job {job.task_id} timed out: {e}")
+            job.append(SSEEvent(
+                event="error",
+                data={
+                    "task_id": job.task_id,
+                    "user_id": job.user_id,
+                    "user_email": user_email,
+                    "code": ResponseCode.E_DEADLINE_EXCEEDED.code,
+                    "phase": e.phase,
+                    "error": str(e),
+                    "message": "图像生成超时"
+                }
+            ))
+        except CircuitOpenError as e:
+            logger.warning(f"🚨 Generation job {job.task_id} rejected: {e}")
+            job.append(SSEEvent(
+                event="error",
+                data={
+                    "task_id": job.task_id,
+                    "user_id": job.user_id,
+                    "user_email": user_email,
+                    "code": ResponseCode.E_SYSTEM_UNAVAILABLE.code,
+                    "upstream": e.name,
+                    "retry_after": e.retry_after,
+                    "error": str(e),
+                    "message": "图像生成服务暂不可用"
+                }
+            ))
+        except Exception as e:
+            logger.error(f"❌ Generation job {job.task_id} failed: {type(e).__name__}: {e}", exc_info=True)
+            # 发送错误事件
+            job.append(SSEEvent(
+                event="error",
+                data={
+                    "task_id": job.task_id,
+                    "user_id": job.user_id,
+                    "user_email": user_email,
+                    "error": str(e),
+                    "message": "图像生成过程中发生错误"
+                }
+            ))
+        finally:
+            if ticket is not None:
+                ticket.release()
+            job.finish()
+
+    def _schedule_abandon(self, job: GenerationJob) -> None:
+        """任务失去所有连接后开始计时，宽限期内重连则保留"""
+        if job.abandon_timer is not None:
+            job.abandon_timer.cancel()
+        job.abandon_timer = asyncio.get_running_loop().call_later(
+            settings.generation_abandon_grace_seconds,
+            self._abandon_if_idle,
+            job
+        )
+
+    def _abandon_if_idle(self, job: GenerationJob) -> None:
+        """放弃宽限期结束后仍没有连接的任务"""
+        job.abandon_timer = None
+        if job.subscribers or job.finished or job.abandoned or job.task is None:
+            return
+        job.abandoned = True
+        self.abandoned += 1
+        if settings.generation_abandon_finish_started and job.ark_started_at is not None and job.use_cache:
+            # ARK 已经开始生成：继续完成并写入结果缓存，相同请求再次提交时直接命中
+            self.abandoned_finished += 1
+            logger.info(f"👋 Generation job {job.task_id} abandoned, finishing into result cache")
+            return
+        logger.info(f"👋 Generation job {job.task_id} abandoned, cancelling")
+        job.task.cancel()
+
+    def _evict(self) -> None:
+        """淘汰 TTL 到期的已结束任务；超过数量上限时优先淘汰最早的已结束任务"""
+        now = time.monotonic()
+        for key, job in list(self._jobs.items()):
+            if job.finished_at is not None and now - job.finished_at > settings.generation_job_ttl_seconds:
+                del self._jobs[key]
+
+        overflow = len(self._jobs) - settings.generation_job_max_retained
+        if overflow > 0:
+            for key, job in list(self._jobs.items()):
+                if overflow <= 0:
+                    break
+                if job.finished:
+                    del self._jobs[key]
+                    overflow -= 1
+
+    def stats(self) -> dict:
+        """任务统计信息"""
+        running = sum(1 for job in self._jobs.values() if not job.finished)
+        return {
+            "jobs": len(self._jobs),
+            "running": running,
+            "finished": len(self._jobs) - running,
+            "abandoned": self.abandoned,
+            "abandoned_finished": self.abandoned_finished,
+            "wasted_ark_seconds": self.wasted_ark_seconds,
+        }
+
+    async def shutdown(self) -> None:
+        """取消所有运行中的任务"""
+        tasks = list(self._running)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._jobs.clear()
+
+
+# 创建任务管理器实例
+generation_job_manager = GenerationJobManager(
+    image_generation_service,
+    generation_admission,
+    generation_result_cache
+)
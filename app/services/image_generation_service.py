@@ -2,16 +2,64 @@
 
 import os
 import asyncio
+import logging
 import base64
+import hashlib
+import threading
+import time
 import uuid
 from datetime import datetime, timezone
-from typing import List, AsyncGenerator, Optional
-from volcenginesdkarkruntime import Ark
+from typing import Any, AsyncIterator, Callable, Dict, List, AsyncGenerator, Optional, Tuple
+from volcenginesdkarkruntime import Ark, AsyncArk
 from volcenginesdkarkruntime.types.images.images import SequentialImageGenerationOptions
-from supabase import create_client, Client
+from supabase import AsyncClient
 
+from app.core.admission import image_bytes_budget
+from app.core.clients import client_registry
 from app.core.config import settings
+from app.core.deadline import DeadlineExceededError, phase_timeout
+from app.core.executors import ark_executor, image_executor, image_process_pool
+from app.core.metrics import Histogram, metrics_registry
+from app.core.resilience import CircuitOpenError, ark_upstream, storage_upstream
+from app.core.response_code import ResponseCode
+from app.core.timing import record_phase, timed_phase
 from app.schemas.face_flip import GeneratedImage, ImageGenerationResponse, SSEEvent
+from app.utils import image_codec
+
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+ark_call_duration_seconds = metrics_registry.histogram(
+    "ark_call_duration_seconds", "ARK image generation call latency, including retries of the same call", ("outcome",)
+)
+ark_images_generated_total = metrics_registry.counter(
+    "ark_images_generated_total", "Images returned by ARK"
+).labels()
+ark_images_per_call = metrics_registry.histogram(
+    "ark_images_per_call", "Images returned per successful ARK call", buckets=(1, 2, 3, 4, 6, 8, 12, 15)
+).labels()
+image_upload_duration_seconds = metrics_registry.histogram(
+    "image_upload_duration_seconds", "Per-image upload latency, including transcoding and retries", ("outcome",)
+)
+storage_upload_bytes = metrics_registry.histogram(
+    "storage_upload_bytes",
+    "Bytes per object written to storage",
+    buckets=(64 * 1024, 256 * 1024, 1024 ** 2, 2 * 1024 ** 2, 4 * 1024 ** 2, 8 * 1024 ** 2, 16 * 1024 ** 2, 32 * 1024 ** 2),
+).labels()
+# 预先绑定标签
+_ARK_CALL_SECONDS = {outcome: ark_call_duration_seconds.labels(outcome) for outcome in ("success", "error")}
+_UPLOAD_SECONDS = {outcome: image_upload_duration_seconds.labels(outcome) for outcome in ("success", "error")}
+
+# ARK 流式图像生成的事件类型
+ARK_IMAGE_SUCCEEDED = "image_generation.partial_succeeded"
+ARK_IMAGE_FAILED = "image_generation.partial_failed"
+
+# 流式结果队列的结束标记
+_STREAM_END = object()
+
+# ARK 流式生成中单张图片失败的标记
+_IMAGE_FAILED = object()
 
 
 class ImageGenerationService:
@@ -20,34 +68,52 @@ class ImageGenerationService:
     def __init__(self):
         """初始化服务"""
         self._ark_client = None
-        self._supabase_client = None
+        self._ark_async_client = None
+        # 进程内所有任务共享的上传并发上限
+        self._global_upload_semaphore = asyncio.Semaphore(settings.upload_concurrency_global)
+        # 转码统计
+        self._transcode_totals = {"images": 0, "original_bytes": 0, "encoded_bytes": 0}
+        self._transcode_encode_seconds = Histogram(
+            "image_transcode_seconds", (0.05, 0.1, 0.25, 0.5, 1, 2, 5)
+        )
     
     @property
-    def ark_client(self):
+    def ark_client(self) -> Ark:
         """延迟初始化ARK客户端"""
         if self._ark_client is None:
-            api_key = settings.ark_api_key or os.environ.get("ARK_API_KEY")
-            if not api_key:
-                raise ValueError("ARK_API_KEY 环境变量未设置")
-            
             self._ark_client = Ark(
-                base_url="https://ark.cn-beijing.volces.com/api/v3",
-                api_key=api_key,
+                base_url=settings.ark_base_url,
+                api_key=self._ark_api_key(),
+                timeout=settings.ark_timeout_seconds,
+                # 重试统一由 ark_upstream 处理（带抖动退避和熔断）
+                max_retries=0,
             )
         return self._ark_client
     
     @property
-    def supabase_client(self) -> Client:
-        """延迟初始化Supabase客户端"""
-        if self._supabase_client is None:
-            supabase_url = settings.supabase_url or os.environ.get("SUPABASE_URL")
-            supabase_key = settings.supabase_key or os.environ.get("SUPABASE_KEY")
-            
-            if not supabase_url or not supabase_key:
-                raise ValueError("SUPABASE_URL 和 SUPABASE_KEY 环境变量未设置")
-            
-            self._supabase_client = create_client(supabase_url, supabase_key)
-        return self._supabase_client
+    def ark_async_client(self) -> AsyncArk:
+        """延迟初始化ARK异步客户端"""
+        if self._ark_async_client is None:
+            self._ark_async_client = AsyncArk(
+                base_url=settings.ark_base_url,
+                api_key=self._ark_api_key(),
+                timeout=settings.ark_timeout_seconds,
+                # 重试统一由 ark_upstream 处理（带抖动退避和熔断）
+                max_retries=0,
+            )
+        return self._ark_async_client
+    
+    @staticmethod
+    def _ark_api_key() -> str:
+        api_key = settings.ark_api_key or os.environ.get("ARK_API_KEY")
+        if not api_key:
+            raise ValueError("ARK_API_KEY 环境变量未设置")
+        return api_key
+    
+    @property
+    def supabase_client(self) -> AsyncClient:
+        """共享的Supabase客户端（anon key，连接池见 app.core.clients）"""
+        return client_registry.supabase_anon
     
     async def _upload_base64_to_supabase(self, base64_data: str, filename: str, user_id: str) -> str:
         """
@@ -62,42 +128,306 @@ class ImageGenerationService:
             str: Supabase存储的公开URL
         """
         try:
-            # 解码base64数据
-            image_data = base64.b64decode(base64_data)
+            # 在线程池中解码base64数据，避免阻塞事件循环
+            with timed_phase("decode"):
+                image_data = await image_executor.run(base64.b64decode, base64_data)
             
-            # 生成存储路径：/userId/utc_date/uuid.png
-            utc_date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-            file_path = f"{user_id}/{utc_date}/{filename}"
+            return await self._upload_bytes_to_supabase(
+                image_data,
+                self._storage_path(user_id, filename),
+                "image/png"
+            )
             
-            # 上传到Supabase存储
-            bucket_name = settings.supabase_storage_bucket
-            result = self.supabase_client.storage.from_(bucket_name).upload(
-                file_path,
+        except Exception as e:
+            raise Exception(f"上传到Supabase失败: {str(e)}")
+    
+    async def _upload_bytes_to_supabase(self, image_data: bytes, file_path: str, content_type: str) -> str:
+        """
+        上传图片数据到Supabase存储
+        
+        瞬时错误时重试；开启 upload_hedging_enabled 时，耗时超过近期 p95 的上传会再发起一次
+        
+        Returns:
+            str: Supabase存储的公开URL
+        """
+        with timed_phase("upload"):
+            await storage_upstream.call(
+                self._put_object,
                 image_data,
-                file_options={"content-type": "image/png"}
+                file_path,
+                content_type,
+                hedge=settings.upload_hedging_enabled
             )
             
-            # 检查上传结果 - Supabase Python SDK返回的是UploadResponse对象
-            if hasattr(result, 'error') and result.error:
-                raise Exception(f"上传失败: {result.error}")
+            # 获取公开URL
+            bucket_name = settings.supabase_storage_bucket
+            public_url = await self.supabase_client.storage.from_(bucket_name).get_public_url(file_path)
+        return public_url
+    
+    async def _put_object(self, image_data: bytes, file_path: str, content_type: str) -> None:
+        """
+        单次上传（覆盖写入：路径为 uuid，重试和对冲上传写入相同内容，可以安全重复）
+        """
+        bucket_name = settings.supabase_storage_bucket
+        result = await self.supabase_client.storage.from_(bucket_name).upload(
+            file_path,
+            image_data,
+            file_options={"content-type": content_type, "upsert": "true"}
+        )
+        
+        # 检查上传结果 - Supabase Python SDK返回的是UploadResponse对象
+        if hasattr(result, 'error') and result.error:
+            raise Exception(f"上传失败: {result.error}")
+        
+        # 验证上传是否成功
+        if not hasattr(result, 'path') or not result.path:
+            raise Exception("上传失败: 未返回文件路径")
+        storage_upload_bytes.observe(len(image_data))
+    
+    async def _transcode_and_upload(
+        self,
+        base64_data: str,
+        file_stem: str,
+        user_id: str
+    ) -> Tuple[str, Optional[str], Dict[str, Any]]:
+        """
+        在进程池中把图片转码为 settings.image_transcode_format 后上传，可选同时上传原始 PNG
+        
+        Args:
+            base64_data: base64编码的PNG数据
+            file_stem: 不含扩展名的文件名
+            user_id: 用户ID
             
-            # 验证上传是否成功
-            if not hasattr(result, 'path') or not result.path:
-                raise Exception("上传失败: 未返回文件路径")
+        Returns:
+            (转码后图片的公开URL, 原始PNG的公开URL或None, 转码记录)
+        """
+        try:
+            fmt = settings.image_transcode_format
+            with timed_phase("decode"):
+                image_data = await image_executor.run(base64.b64decode, base64_data)
+            with timed_phase("transcode"):
+                encoded, encode_seconds = await image_process_pool.run(
+                    image_codec.transcode,
+                    image_data,
+                    fmt,
+                    settings.image_transcode_quality
+                )
             
-            # 获取公开URL
-            public_url = self.supabase_client.storage.from_(bucket_name).get_public_url(file_path)
-            return public_url
+            uploads = [self._upload_bytes_to_supabase(
+                encoded,
+                self._storage_path(user_id, f"{file_stem}.{image_codec.extension(fmt)}"),
+                image_codec.content_type(fmt)
+            )]
+            if settings.image_transcode_keep_original:
+                uploads.append(self._upload_bytes_to_supabase(
+                    image_data,
+                    self._storage_path(user_id, f"{file_stem}.png"),
+                    "image/png"
+                ))
+            urls = await asyncio.gather(*uploads)
+            
+            record = self._record_transcode(fmt, len(image_data), len(encoded), encode_seconds)
+            return urls[0], (urls[1] if len(urls) > 1 else None), record
             
         except Exception as e:
-            raise Exception(f"上传到Supabase失败: {str(e)}")
+            raise Exception(f"转码上传到Supabase失败: {str(e)}")
+    
+    def _record_transcode(
+        self,
+        fmt: str,
+        original_bytes: int,
+        encoded_bytes: int,
+        encode_seconds: float
+    ) -> Dict[str, Any]:
+        """记录单张图片的转码结果并累计统计"""
+        self._transcode_totals["images"] += 1
+        self._transcode_totals["original_bytes"] += original_bytes
+        self._transcode_totals["encoded_bytes"] += encoded_bytes
+        self._transcode_encode_seconds.observe(encode_seconds)
+        return {
+            "format": fmt,
+            "original_bytes": original_bytes,
+            "encoded_bytes": encoded_bytes,
+            "bytes_saved": original_bytes - encoded_bytes,
+            "encode_ms": round(encode_seconds * 1000, 1),
+        }
+    
+    def transcode_stats(self) -> Dict[str, Any]:
+        """转码统计：节省的字节数和编码耗时分布"""
+        totals = self._transcode_totals
+        return {
+            "format": settings.image_transcode_format or None,
+            "quality": settings.image_transcode_quality,
+            **totals,
+            "bytes_saved": totals["original_bytes"] - totals["encoded_bytes"],
+            "encode_seconds": self._transcode_encode_seconds.snapshot(),
+        }
+    
+    async def _stream_url_to_supabase(self, source_url: str, filename: str, user_id: str) -> Tuple[str, str]:
+        """
+        把 ARK 返回的图片 URL 按固定大小分块流式转存到Supabase存储
+        
+        边下载边上传（chunked 传输），同时计算 SHA-256，
+        每张图片只缓冲一个分块，峰值内存与图片大小无关
+        
+        Args:
+            source_url: ARK 返回的图片URL
+            filename: 文件名
+            user_id: 用户ID
+            
+        Returns:
+            (Supabase存储的公开URL, 图片的 SHA-256)
+        """
+        try:
+            file_path = self._storage_path(user_id, filename)
+            with timed_phase("upload"):
+                # 瞬时错误时从头重新转存（覆盖写入）
+                sha256 = await storage_upstream.call(self._transfer_url, source_url, file_path)
+                
+                bucket_name = settings.supabase_storage_bucket
+                public_url = await self.supabase_client.storage.from_(bucket_name).get_public_url(file_path)
+            return public_url, sha256
+            
+        except Exception as e:
+            raise Exception(f"转存到Supabase失败: {str(e)}")
+    
+    async def _transfer_url(self, source_url: str, file_path: str) -> str:
+        """
+        单次流式转存
+        
+        Returns:
+            图片的 SHA-256
+        """
+        http_client = client_registry.http_client
+        supabase_client = self.supabase_client
+        bucket_name = settings.supabase_storage_bucket
+        digest = hashlib.sha256()
+        transferred = 0
+        
+        async with http_client.stream("GET", source_url) as source:
+            source.raise_for_status()
+            
+            async def chunks():
+                nonlocal transferred
+                async for chunk in source.aiter_bytes(settings.image_transfer_chunk_size):
+                    digest.update(chunk)
+                    transferred += len(chunk)
+                    yield chunk
+            
+            # 直接调用 Storage REST 接口：SDK 的 upload 只接受完整的 bytes
+            response = await http_client.post(
+                f"{supabase_client.storage_url}object/{bucket_name}/{file_path}",
+                content=chunks(),
+                headers={
+                    **supabase_client.options.headers,
+                    "content-type": source.headers.get("content-type", "image/png"),
+                    "x-upsert": "true",
+                }
+            )
+            response.raise_for_status()
+        
+        storage_upload_bytes.observe(transferred)
+        return digest.hexdigest()
+    
+    @staticmethod
+    def _storage_path(user_id: str, filename: str) -> str:
+        """生成存储路径：/userId/utc_date/uuid.png"""
+        utc_date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        return f"{user_id}/{utc_date}/{filename}"
+    
+    async def _make_preview(self, index: int, base64_data: str) -> Tuple[int, Optional[str]]:
+        """
+        在进程池中生成内联缩略图
+        
+        Returns:
+            (图片序号, data URI)，失败或超出大小上限时为 None
+        """
+        try:
+            data_uri = await image_process_pool.run(
+                image_codec.preview_data_uri,
+                base64_data,
+                settings.image_preview_max_edge,
+                settings.image_preview_max_bytes
+            )
+            return index, data_uri
+        except Exception as e:
+            logger.warning(f"⚠️  Preview for image {index+1} failed: {str(e)}")
+            return index, None
+    
+    async def _upload_generated_image(
+        self,
+        index: int,
+        image_data: str,
+        size: str,
+        user_id: str,
+        task_semaphore: asyncio.Semaphore,
+        from_url: bool = False
+    ) -> Tuple[int, Optional[GeneratedImage], Optional[Dict[str, Any]]]:
+        """
+        上传单张生成的图片，受单任务和全局并发上限约束
+        
+        base64 数据只由本协程持有，上传结束后随协程一起释放
+        
+        Args:
+            image_data: base64 数据；from_url 为 True 时为 ARK 返回的图片URL
+        
+        Returns:
+            (图片序号, 上传结果, 转码记录)，上传失败时结果为 None，未转码时转码记录为 None
+        """
+        started = time.perf_counter()
+        try:
+            original_url = None
+            transcode = None
+            async with task_semaphore, self._global_upload_semaphore, \
+                    phase_timeout("upload", settings.upload_timeout_seconds):
+                # 生成唯一文件名
+                file_stem = str(uuid.uuid4())
+                filename = f"{file_stem}.png"
+                
+                if from_url:
+                    # 从 ARK 的图片URL流式转存到Supabase
+                    supabase_url, sha256 = await self._stream_url_to_supabase(
+                        image_data,
+                        filename,
+                        user_id
+                    )
+                elif settings.image_transcode_format:
+                    # 转码为 WebP/AVIF 后上传
+                    supabase_url, original_url, transcode = await self._transcode_and_upload(
+                        image_data,
+                        file_stem,
+                        user_id
+                    )
+                    sha256 = None
+                else:
+                    # 上传base64图片到Supabase
+                    supabase_url = await self._upload_base64_to_supabase(
+                        image_data,
+                        filename,
+                        user_id
+                    )
+                    sha256 = None
+            generated_image = GeneratedImage(
+                url=supabase_url,
+                size=size,
+                sha256=sha256,
+                original_url=original_url
+            )
+            _UPLOAD_SECONDS["success"].observe(time.perf_counter() - started)
+            return index, generated_image, transcode
+        except Exception as e:
+            _UPLOAD_SECONDS["error"].observe(time.perf_counter() - started)
+            # 如果上传失败，记录错误但继续处理其他图片
+            logger.error(f"❌ Upload of image {index+1} failed: {str(e)}")
+            return index, None, None
     
     async def generate_images_stream(
         self, 
         urls: List[str], 
         task_id: str,
         user_id: str,
-        prompt: Optional[str] = None
+        prompt: Optional[str] = None,
+        on_generation_done: Optional[Callable[[], None]] = None
     ) -> AsyncGenerator[SSEEvent, None]:
         """
         流式生成图像
@@ -107,6 +437,7 @@ class ImageGenerationService:
             task_id: 任务ID
             user_id: 用户ID
             prompt: 生成提示词，如果为None则使用环境变量配置的默认值
+            on_generation_done: ARK 生成结束（成功、失败或取消）时的回调，用于尽早归还生成名额
             
         Yields:
             SSEEvent: SSE事件
@@ -128,51 +459,151 @@ class ImageGenerationService:
                 data={"task_id": task_id, "message": "正在调用ARK模型生成图像..."}
             )
             
-            # 在线程池中执行同步的ARK API调用
-            loop = asyncio.get_event_loop()
-            images_response = await loop.run_in_executor(
-                None,
-                self._call_ark_api,
-                urls,
-                prompt
-            )
+            # ARK 每生成一张图片就立即开始上传，同时继续接收后续图片
+            # 每张图片上传完成后立即推送事件
+            task_semaphore = asyncio.Semaphore(settings.upload_concurrency_per_task)
+            from_url = settings.ark_response_format == "url"
+            preview = settings.image_preview_enabled and not from_url
+            pipeline: asyncio.Queue = asyncio.Queue()
+            upload_tasks: List[asyncio.Task] = []
+            preview_tasks: List[asyncio.Task] = []
             
-            # 发送上传开始事件
-            yield SSEEvent(
-                event="upload_start",
-                data={"task_id": task_id, "message": "开始上传生成的图片到存储..."}
-            )
-            
-            # 处理响应并上传到Supabase
-            generated_images = []
-            for i, image in enumerate(images_response.data):
+            async def produce():
                 try:
-                    # 生成唯一文件名
-                    filename = f"{uuid.uuid4()}.png"
+                    # 处理中的图片字节数超限时推迟生成，已开始的生成暂停接收下一张图片
+                    await image_bytes_budget.wait_for_capacity()
+                    # 剩余时间不足以完成一次生成时直接失败，不再调用 ARK
+                    async with phase_timeout(
+                        "ark",
+                        settings.ark_timeout_seconds,
+                        min_seconds=settings.ark_min_budget_seconds
+                    ):
+                        async for index, image in self._iter_ark_images(urls, prompt):
+                            if image is _IMAGE_FAILED:
+                                pipeline.put_nowait(("failed", None))
+                                continue
+                            if from_url:
+                                image_data, size = image.url, image.size
+                                # 流式转存只缓冲一个分块
+                                reserved = image_bytes_budget.reserve(settings.image_transfer_chunk_size)
+                            else:
+                                image_data, size = image.b64_json, image.size
+                                # base64 字符串 + 解码后数据，上传结束（或取消）时释放
+                                reserved = image_bytes_budget.reserve(len(image_data) + len(image_data) * 3 // 4)
+                            del image
+                            upload_task = asyncio.create_task(
+                                self._upload_generated_image(
+                                    index, image_data, size, user_id, task_semaphore, from_url
+                                )
+                            )
+                            upload_tasks.append(upload_task)
+                            pipeline.put_nowait(("generated", (index, size)))
+                            if preview:
+                                # 缩略图与上传并行生成
+                                preview_task = asyncio.create_task(self._make_preview(index, image_data))
+                                preview_tasks.append(preview_task)
+                                preview_task.add_done_callback(
+                                    lambda t: pipeline.put_nowait(("preview", t))
+                                )
+                            del image_data
+                            upload_task.add_done_callback(
+                                lambda t, reserved=reserved: image_bytes_budget.release(reserved)
+                            )
+                            upload_task.add_done_callback(
+                                lambda t: pipeline.put_nowait(("uploaded", t))
+                            )
+                            await image_bytes_budget.wait_for_capacity()
+                    pipeline.put_nowait(("generation_done", None))
+                except Exception as e:
+                    pipeline.put_nowait(("generation_failed", e))
+                finally:
+                    if on_generation_done is not None:
+                        on_generation_done()
+            
+            producer = asyncio.create_task(produce())
+            uploaded: Dict[int, GeneratedImage] = {}
+            generated_count = 0
+            failed_count = 0
+            pending_uploads = 0
+            generation_done = False
+            try:
+                while not generation_done or pending_uploads:
+                    # 请求截止时间到达时停止等待，未完成的生成和上传在 finally 中取消
+                    async with phase_timeout("generation"):
+                        kind, payload = await pipeline.get()
                     
-                    # 上传base64图片到Supabase
-                    supabase_url = await self._upload_base64_to_supabase(
-                        image.b64_json, 
-                        filename,
-                        user_id
-                    )
+                    if kind == "generated":
+                        index, size = payload
+                        if generated_count == 0:
+                            # 发送上传开始事件
+                            yield SSEEvent(
+                                event="upload_start",
+                                data={"task_id": task_id, "message": "开始上传生成的图片到存储..."}
+                            )
+                        generated_count += 1
+                        pending_uploads += 1
+                        yield SSEEvent(
+                            event="image_generated",
+                            data={"task_id": task_id, "index": index, "size": size}
+                        )
                     
-                    generated_images.append(GeneratedImage(
-                        url=supabase_url,
-                        size=image.size
-                    ))
+                    elif kind == "uploaded":
+                        pending_uploads -= 1
+                        index, generated_image, transcode = payload.result()
+                        if generated_image is None:
+                            # 上传失败的图片跳过
+                            failed_count += 1
+                            continue
+                        uploaded[index] = generated_image
+                        data = {
+                            "task_id": task_id,
+                            "index": index,
+                            **generated_image.model_dump()
+                        }
+                        if transcode is not None:
+                            data["transcode"] = transcode
+                        yield SSEEvent(event="image_uploaded", data=data)
                     
-                except Exception as e:
-                    # 如果上传失败，记录错误但继续处理其他图片
-                    print(f"上传图片 {i+1} 失败: {str(e)}")
-                    # 可以选择跳过失败的图片或者使用原始URL
-                    continue
+                    elif kind == "preview":
+                        if payload.cancelled():
+                            continue
+                        index, data_uri = payload.result()
+                        # 原图已上传完成时不再推送缩略图
+                        if data_uri is None or index in uploaded:
+                            continue
+                        yield SSEEvent(
+                            event="preview",
+                            data={"task_id": task_id, "index": index, "data_uri": data_uri}
+                        )
+                    
+                    elif kind == "failed":
+                        failed_count += 1
+                    
+                    elif kind == "generation_done":
+                        generation_done = True
+                    
+                    elif kind == "generation_failed":
+                        if generated_count == 0:
+                            raise payload
+                        # 已经生成的图片照常上传并返回
+                        logger.warning(f"⚠️  ARK generation stopped after {generated_count} images: {str(payload)}")
+                        failed_count += 1
+                        generation_done = True
+            finally:
+                # 客户端断开或出错时取消尚未完成的生成和上传
+                producer.cancel()
+                for background_task in upload_tasks + preview_tasks:
+                    background_task.cancel()
+            
+            # done 事件中的图片保持生成顺序
+            generated_images = [uploaded[index] for index in sorted(uploaded)]
             
             # 构建响应数据
             response_data = ImageGenerationResponse(
                 urls=urls,
                 generated_images=generated_images,
-                task_id=task_id
+                task_id=task_id,
+                failed_count=failed_count
             )
             
             # 发送完成事件
@@ -181,6 +612,31 @@ class ImageGenerationService:
                 data=response_data.dict()
             )
             
+        except DeadlineExceededError as e:
+            # 超时或剩余时间不足，发送带错误码和超时阶段的错误事件
+            yield SSEEvent(
+                event="error",
+                data={
+                    "task_id": task_id,
+                    "code": ResponseCode.E_DEADLINE_EXCEEDED.code,
+                    "phase": e.phase,
+                    "error": str(e),
+                    "message": "图像生成超时"
+                }
+            )
+        except CircuitOpenError as e:
+            # 上游熔断中
+            yield SSEEvent(
+                event="error",
+                data={
+                    "task_id": task_id,
+                    "code": ResponseCode.E_SYSTEM_UNAVAILABLE.code,
+                    "upstream": e.name,
+                    "retry_after": e.retry_after,
+                    "error": str(e),
+                    "message": "图像生成服务暂不可用"
+                }
+            )
         except Exception as e:
             # 发送错误事件
             yield SSEEvent(
@@ -192,27 +648,203 @@ class ImageGenerationService:
                 }
             )
     
-    def _call_ark_api(self, urls: List[str], prompt: str):
+    async def _iter_ark_images(self, urls: List[str], prompt: str) -> AsyncIterator[Tuple[int, Any]]:
         """
-        调用ARK API生成图像
+        按生成顺序产出 ARK 生成的图片
         
-        Args:
-            urls: 输入图片URL列表
-            prompt: 生成提示词
+        流式模式（settings.ark_stream）下每张图片生成后立即产出；
+        否则等待整批生成完成后依次产出
+        
+        产出第一张图片之前的瞬时错误按 ark_upstream 的策略重试；已经产出图片后不再重试，
+        避免重复生成；熔断中直接失败
+        
+        Yields:
+            (图片序号, 图片对象)，图片对象包含 b64_json（或 url）和 size；
+            单张图片生成失败时图片对象为 _IMAGE_FAILED，不占用序号
+        """
+        index = 0
+        attempt = 0
+        call_started = time.perf_counter()
+        while True:
+            ark_upstream.check()
+            started = time.monotonic()
+            if settings.ark_use_async_client:
+                images = self._iter_ark_images_async(urls, prompt)
+            else:
+                images = self._iter_ark_images_sync(urls, prompt)
             
-        Returns:
-            imagesResponse: ARK API响应
+            try:
+                async for image in images:
+                    if image is _IMAGE_FAILED:
+                        yield index, image
+                        continue
+                    ark_images_generated_total.inc()
+                    yield index, image
+                    # 等待下一张图片期间不再持有上一张图片的数据
+                    image = None
+                    index += 1
+            except Exception as e:
+                ark_upstream.record(e)
+                if index > 0 or not ark_upstream.should_retry(e, attempt):
+                    elapsed = time.perf_counter() - call_started
+                    _ARK_CALL_SECONDS["error"].observe(elapsed)
+                    record_phase("ark", elapsed)
+                    raise
+                await ark_upstream.backoff(attempt)
+                attempt += 1
+                continue
+            ark_upstream.record(seconds=time.monotonic() - started)
+            elapsed = time.perf_counter() - call_started
+            _ARK_CALL_SECONDS["success"].observe(elapsed)
+            record_phase("ark", elapsed)
+            ark_images_per_call.observe(index)
+            return
+    
+    async def _iter_ark_images_async(self, urls: List[str], prompt: str) -> AsyncIterator[Any]:
+        """使用 AsyncArk 调用 ARK API"""
+        if not settings.ark_stream:
+            images_response = await self.ark_async_client.images.generate(
+                **self._ark_request(urls, prompt)
+            )
+            async for image in self._drain_images(images_response):
+                yield image
+            return
+        
+        stream = await self.ark_async_client.images.generate(
+            **self._ark_request(urls, prompt, stream=True)
+        )
+        try:
+            async for event in stream:
+                image = self._image_from_stream_event(event)
+                event = None
+                if image is not None:
+                    yield image
+                    image = None
+        finally:
+            await stream.close()
+    
+    async def _iter_ark_images_sync(self, urls: List[str], prompt: str) -> AsyncIterator[Any]:
+        """在专用线程池中使用同步 Ark 客户端调用 ARK API"""
+        if not settings.ark_stream:
+            images_response = await ark_executor.run(self._call_ark_api, urls, prompt)
+            async for image in self._drain_images(images_response):
+                yield image
+            return
+        
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+        consumer = ark_executor.submit(
+            self._consume_ark_stream,
+            urls,
+            prompt,
+            loop,
+            queue,
+            stop
+        )
+        try:
+            while True:
+                image = await queue.get()
+                if image is _STREAM_END:
+                    break
+                yield image
+                image = None
+            # 抛出流式调用中的异常
+            await consumer
+        finally:
+            stop.set()
+    
+    @staticmethod
+    async def _drain_images(images_response) -> AsyncIterator[Any]:
         """
-        return self.ark_client.images.generate(
+        依次取出整批响应中的图片，取出后不再由响应对象持有，
+        每张图片的 base64 数据在其上传完成后即可释放
+        """
+        images = images_response.data
+        images_response.data = []
+        images.reverse()
+        while images:
+            yield images.pop()
+    
+    def _image_from_stream_event(self, event) -> Optional[Any]:
+        """从 ARK 流式事件中取出生成成功的图片，单张图片失败时返回 _IMAGE_FAILED，其他事件返回 None"""
+        event_type = getattr(event, "type", "")
+        if event_type == ARK_IMAGE_SUCCEEDED and (getattr(event, "b64_json", None) or getattr(event, "url", None)):
+            return event
+        if event_type == ARK_IMAGE_FAILED:
+            error = getattr(event, "error", None)
+            logger.warning(f"⚠️  ARK failed to generate one image: {getattr(error, 'message', error)}")
+            return _IMAGE_FAILED
+        return None
+    
+    def _consume_ark_stream(
+        self,
+        urls: List[str],
+        prompt: str,
+        loop: asyncio.AbstractEventLoop,
+        queue: asyncio.Queue,
+        stop: threading.Event
+    ) -> None:
+        """
+        在工作线程中读取 ARK 流式响应，把每张生成成功的图片投递到事件循环的队列中
+        """
+        def deliver(item):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+        
+        try:
+            stream = self._call_ark_api(urls, prompt, stream=True)
+            try:
+                for event in stream:
+                    if stop.is_set():
+                        break
+                    image = self._image_from_stream_event(event)
+                    if image is not None:
+                        deliver(image)
+            finally:
+                stream.close()
+        finally:
+            deliver(_STREAM_END)
+    
+    def _ark_request(self, urls: List[str], prompt: str, stream: bool = False) -> dict:
+        """构建 images.generate 的请求参数"""
+        return dict(
             model=settings.ark_model,
             prompt=prompt,
             image=urls,
             size=settings.ark_image_size,
             sequential_image_generation="auto",
             sequential_image_generation_options=SequentialImageGenerationOptions(max_images=settings.ark_max_images),
-            response_format="b64_json",  # 改为返回base64格式
-            watermark=True
+            response_format=settings.ark_response_format,
+            watermark=True,
+            stream=stream
         )
+    
+    def _call_ark_api(self, urls: List[str], prompt: str, stream: bool = False):
+        """
+        调用ARK API生成图像（同步客户端，在 ark_executor 中执行）
+        
+        Args:
+            urls: 输入图片URL列表
+            prompt: 生成提示词
+            stream: 是否使用流式响应（每张图片生成后立即返回）
+            
+        Returns:
+            imagesResponse: ARK API响应；stream=True 时为事件流
+        """
+        return self.ark_client.images.generate(**self._ark_request(urls, prompt, stream))
+    
+    async def close(self) -> None:
+        """关闭 ARK 客户端"""
+        if self._ark_async_client is not None:
+            await self._ark_async_client.close()
+            self._ark_async_client = None
+        if self._ark_client is not None:
+            self._ark_client.close()
+            self._ark_client = None
 
 
 # 创建服务实例
@@ -0,0 +1,298 @@
+"""按需缩放的图片变体
+
+从存储读取已上传的图片，在进程池中缩放并重新编码，结果缓存在本地磁盘（按总大小 LRU 淘汰）。
+同一变体的并发请求只渲染一次。
+
+存储中的生成图片以 uuid 命名、不会被覆盖，因此变体的 ETag 直接由路径和参数计算，
+If-None-Match 命中时无需读取磁盘或存储。
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, cast
+
+from storage3.exceptions import StorageApiError
+
+from app.core.clients import client_registry
+from app.core.config import settings
+from app.core.executors import image_executor, image_process_pool
+from app.utils import image_codec
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 允许的存储路径：userId/date/file.ext，不允许 .. 和绝对路径
+STORAGE_PATH_PATTERN = re.compile(r"^[\w\-]+(/[\w\-]+)*/[\w\-]+\.(png|webp|avif|jpg|jpeg)$")
+
+# 变体支持的输出格式
+VARIANT_FORMATS = ("webp", "avif", "jpeg", "png")
+
+# 发起渲染的请求被取消时交给等待者的标记
+_LEADER_CANCELLED = object()
+
+
+def snap_edge(value: Optional[int]) -> Optional[int]:
+    """
+    把请求的边长向上取整到 settings.image_variant_sizes 中的一档
+
+    Raises:
+        ValueError: 超过最大档位
+    """
+    if value is None:
+        return None
+    for size in sorted(settings.image_variant_sizes):
+        if value <= size:
+            return size
+    raise ValueError(f"edge {value} exceeds {max(settings.image_variant_sizes)}")
+
+
+class ImageNotFoundError(LookupError):
+    """存储中不存在该图片"""
+
+
+class DiskLRUCache:
+    """
+    按总字节数限制的磁盘 LRU 缓存
+
+    文件名即缓存键，首次使用时按修改时间重建索引；文件写入使用临时文件 + 原子替换。
+    所有文件系统操作都在线程池中执行，不阻塞事件循环
+    """
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+
+    async def _load(self) -> None:
+        if self._loaded:
+            return
+        async with self._load_lock:
+            if self._loaded:
+                return
+            for name, size in await image_executor.run(self._scan, self.directory):
+                self._entries[name] = size
+                self._bytes += size
+            self._loaded = True
+        await self._evict()
+
+    @staticmethod
+    def _scan(directory: Path) -> List[Tuple[str, int]]:
+        """按修改时间从旧到新列出已缓存的文件及大小"""
+        directory.mkdir(parents=True, exist_ok=True)
+        files = []
+        for path in directory.iterdir():
+            if path.name.endswith(".tmp"):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if path.is_file():
+                files.append((stat.st_mtime, path.name, stat.st_size))
+        return [(name, size) for _, name, size in sorted(files)]
+
+    def path(self, key: str) -> Path:
+        return self.directory / key
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """命中时返回文件内容并标记为最近使用"""
+        await self._load()
+        if key not in self._entries:
+            self.misses += 1
+            return None
+        try:
+            data: bytes = await image_executor.run(self.path(key).read_bytes)
+        except FileNotFoundError:
+            # 文件已被删除（或读取前刚好被淘汰）
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)
+            self.misses += 1
+            return None
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        self.hits += 1
+        return data
+
+    async def put(self, key: str, data: bytes) -> None:
+        """写入缓存，超出总大小时淘汰最久未使用的文件"""
+        await self._load()
+        path = self.path(key)
+        await image_executor.run(self._write, path, data)
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)
+        self._entries[key] = len(data)
+        self._bytes += len(data)
+        await self._evict(keep=key)
+
+    @staticmethod
+    def _write(path: Path, data: bytes) -> None:
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    async def _evict(self, keep: Optional[str] = None) -> None:
+        # 先从索引中移除，再在线程池中删除文件
+        victims = []
+        while self._bytes > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            if key == keep:
+                break
+            self._bytes -= self._entries.pop(key)
+            self.evictions += 1
+            victims.append(self.path(key))
+        if victims:
+            await image_executor.run(self._unlink, victims)
+
+    @staticmethod
+    def _unlink(paths: List[Path]) -> None:
+        for path in paths:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        """缓存统计信息"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class ImageVariantService:
+    """图片变体服务"""
+
+    def __init__(self, cache: Optional[DiskLRUCache] = None):
+        self._cache = cache
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.renders = 0
+        self.coalesced = 0
+
+    @property
+    def cache(self) -> DiskLRUCache:
+        if self._cache is None:
+            self._cache = DiskLRUCache(
+                Path(settings.upload_folder) / settings.image_variant_cache_dir,
+                settings.image_variant_cache_max_bytes
+            )
+        return self._cache
+
+    @staticmethod
+    def variant_key(path: str, width: Optional[int], height: Optional[int], fmt: str) -> str:
+        """变体的缓存键（同时用作 ETag）"""
+        raw = f"{path}|{width or 0}|{height or 0}|{fmt}|{settings.image_variant_quality}"
+        return f"{hashlib.sha256(raw.encode('utf-8')).hexdigest()}.{image_codec.extension(fmt)}"
+
+    @staticmethod
+    def etag(key: str) -> str:
+        return f'"{key.split(".", 1)[0][:32]}"'
+
+    async def get_variant(
+        self,
+        path: str,
+        width: Optional[int],
+        height: Optional[int],
+        fmt: str
+    ) -> bytes:
+        """
+        获取变体图片数据，未缓存时渲染（同一变体的并发请求共享一次渲染）
+
+        Raises:
+            ImageNotFoundError: 存储中不存在该图片
+        """
+        key = self.variant_key(path, width, height, fmt)
+        while True:
+            cached = await self.cache.get(key)
+            if cached is not None:
+                return cached
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            self.coalesced += 1
+            result = await asyncio.shield(inflight)
+            if result is not _LEADER_CANCELLED:
+                return cast(bytes, result)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._render(key, path, width, height, fmt)
+        except asyncio.CancelledError:
+            # 发起渲染的请求被取消（如客户端断开）时，其他等待者重新查找缓存或接替渲染
+            future.set_result(_LEADER_CANCELLED)
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 没有其他等待者时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _render(
+        self,
+        key: str,
+        path: str,
+        width: Optional[int],
+        height: Optional[int],
+        fmt: str
+    ) -> bytes:
+        source = await self._download(path)
+        encoded: bytes = await image_process_pool.run(
+            image_codec.resize,
+            source,
+            width,
+            height,
+            fmt,
+            settings.image_variant_quality
+        )
+        del source
+        self.renders += 1
+        await self.cache.put(key, encoded)
+        return encoded
+
+    async def _download(self, path: str) -> bytes:
+        """从存储下载原图"""
+        try:
+            return await client_registry.supabase_anon.storage.from_(
+                settings.supabase_storage_bucket
+            ).download(path)
+        except StorageApiError as e:
+            # Storage 对不存在的对象返回 statusCode 404（HTTP 状态码可能是 400）
+            if str(e.status) == "404" or str(e.code).lower() in ("not_found", "nosuchkey"):
+                raise ImageNotFoundError(path) from e
+            raise
+
+    def stats(self) -> dict:
+        """渲染与磁盘缓存统计信息"""
+        return {
+            "renders": self.renders,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+            "cache": self.cache.stats(),
+        }
+
+
+# 创建图片变体服务实例
+image_variant_service = ImageVariantService()
@@ -0,0 +1,171 @@
+"""生成结果缓存
+
+按 (输入图片URL, prompt, ark_model, ark_image_size, ark_max_images) 的哈希缓存已上传的生成结果，
+相同输入和生成参数的请求直接返回之前上传的图片 URL，不再调用 ARK 和上传存储。
+
+存储后端：
+- memory: 进程内 LRU（默认）
+- supabase: Supabase 表，多实例共享，表结构见 docs/IMAGE_GENERATION_API.md
+"""
+
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple, cast
+
+from app.core.clients import client_registry
+from app.core.config import settings
+from app.core.deadline import phase_timeout
+from app.schemas.face_flip import GeneratedImage
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class MemoryResultStore:
+    """进程内 LRU 存储"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[List[dict], float, float]]" = OrderedDict()
+
+    async def get(self, key: str, ttl_seconds: int) -> Optional[Tuple[List[dict], float]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        images, ark_seconds, stored_at = entry
+        if time.monotonic() - stored_at > ttl_seconds:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return images, ark_seconds
+
+    async def put(self, key: str, images: List[dict], ark_seconds: float) -> None:
+        self._entries[key] = (images, ark_seconds, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SupabaseResultStore:
+    """Supabase 表存储"""
+
+    def __init__(self, table: str):
+        self.table = table
+
+    async def get(self, key: str, ttl_seconds: int) -> Optional[Tuple[List[dict], float]]:
+        not_before = datetime.now(timezone.utc) - timedelta(seconds=ttl_seconds)
+        async with phase_timeout("db", settings.db_timeout_seconds):
+            res = await (
+                client_registry.supabase.table(self.table)
+                .select("generated_images, ark_seconds")
+                .eq("cache_key", key)
+                .gte("created_at", not_before.isoformat())
+                .limit(1)
+                .execute()
+            )
+        if not res.data:
+            return None
+        row = cast(Dict[str, Any], res.data[0])
+        return row["generated_images"], float(row.get("ark_seconds") or 0.0)
+
+    async def put(self, key: str, images: List[dict], ark_seconds: float) -> None:
+        async with phase_timeout("db", settings.db_timeout_seconds):
+            await client_registry.supabase.table(self.table).upsert({
+                "cache_key": key,
+                "generated_images": images,
+                "ark_seconds": ark_seconds,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            }).execute()
+
+
+class GenerationResultCache:
+    """生成结果缓存，读写失败时按未命中处理，不影响生成"""
+
+    def __init__(self, store=None):
+        self._store = store
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.ark_seconds_saved = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.generation_cache_enabled
+
+    @property
+    def store(self):
+        if self._store is None:
+            if settings.generation_cache_backend == "supabase":
+                self._store = SupabaseResultStore(settings.generation_cache_table)
+            else:
+                self._store = MemoryResultStore(settings.generation_cache_max_entries)
+        return self._store
+
+    @staticmethod
+    def make_key(urls: List[str], prompt: Optional[str]) -> str:
+        """根据输入和生成参数计算缓存键"""
+        payload = {
+            "urls": list(urls),
+            "prompt": prompt if prompt is not None else settings.ark_default_prompt,
+            "model": settings.ark_model,
+            "size": settings.ark_image_size,
+            "max_images": settings.ark_max_images,
+        }
+        encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    async def get(self, urls: List[str], prompt: Optional[str]) -> Optional[List[GeneratedImage]]:
+        """查询缓存，命中时返回之前上传的图片"""
+        try:
+            entry = await self.store.get(self.make_key(urls, prompt), settings.generation_cache_ttl_seconds)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"⚠️ Generation cache lookup failed: {type(e).__name__}: {e}")
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        images, ark_seconds = entry
+        self.hits += 1
+        self.ark_seconds_saved += ark_seconds
+        return [GeneratedImage(**image) for image in images]
+
+    async def put(
+        self,
+        urls: List[str],
+        prompt: Optional[str],
+        images: List[dict],
+        ark_seconds: float
+    ) -> None:
+        """保存生成结果及本次 ARK 耗时"""
+        try:
+            await self.store.put(self.make_key(urls, prompt), images, ark_seconds)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"⚠️ Generation cache store failed: {type(e).__name__}: {e}")
+
+    def stats(self) -> dict:
+        """缓存统计信息"""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "backend": settings.generation_cache_backend,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "ark_seconds_saved": round(self.ark_seconds_saved, 3),
+        }
+
+
+# 创建结果缓存实例
+generation_result_cache = GenerationResultCache()
@@ -2,8 +2,11 @@
 
 import logging
 from typing import Optional
-from supabase import Client
+from supabase import AsyncClient
 
+from app.core.clients import client_registry
+from app.core.config import settings
+from app.core.deadline import DeadlineExceededError, phase_timeout
 from app.models.user import User
 from app.schemas.user import UserUpdateRequest
 
@@ -14,14 +17,16 @@ logger = logging.getLogger(__name__)
 class UserService:
     """User service for business logic"""
     
-    def __init__(self, supabase_client: Client):
-        self.supabase = supabase_client
+    def __init__(self, supabase_client: Optional[AsyncClient] = None):
+        # 默认使用进程共享的连接池客户端
+        self.supabase = supabase_client or client_registry.supabase
     
     async def get_user_by_id(self, user_id: str) -> Optional[User]:
         """Get user by ID"""
         try:
             logger.debug(f"🔍 [UserService] Getting user by ID: {user_id}")
-            response = self.supabase.from_("users").select("*").eq("id", user_id).execute()
+            async with phase_timeout("db", settings.db_timeout_seconds):
+                response = await self.supabase.from_("users").select("*").eq("id", user_id).execute()
             
             if response.data and len(response.data) > 0:
                 logger.info(f"✅ [UserService] User found: {user_id}")
@@ -30,6 +35,9 @@ class UserService:
                 logger.warning(f"⚠️  [UserService] User not found: {user_id}")
             
             return None
+        except DeadlineExceededError:
+            # 超时不是"用户不存在"或"更新失败"，交给错误处理返回 E_DEADLINE_EXCEEDED
+            raise
         except Exception as e:
             logger.error(
                 f"❌ [UserService] Error getting user {user_id}: {type(e).__name__}: {str(e)}",
@@ -43,7 +51,8 @@ class UserService:
             data_dict = update_data.model_dump(exclude_unset=True)
             logger.debug(f"🔄 [UserService] Updating user {user_id} with data: {list(data_dict.keys())}")
             
-            response = self.supabase.from_("users").update(data_dict).eq("id", user_id).execute()
+            async with phase_timeout("db", settings.db_timeout_seconds):
+                response = await self.supabase.from_("users").update(data_dict).eq("id", user_id).execute()
             
             if response.data and len(response.data) > 0:
                 logger.info(f"✅ [UserService] User updated successfully: {user_id}")
@@ -52,6 +61,9 @@ class UserService:
                 logger.warning(f"⚠️  [UserService] User update failed: {user_id}")
             
             return None
+        except DeadlineExceededError:
+            # 超时不是"用户不存在"或"更新失败"，交给错误处理返回 E_DEADLINE_EXCEEDED
+            raise
         except Exception as e:
             logger.error(
                 f"❌ [UserService] Error updating user {user_id}: {type(e).__name__}: {str(e)}",
@@ -63,9 +75,13 @@ class UserService:
         """Delete user (soft delete)"""
         try:
             logger.info(f"🗑️  [UserService] Soft deleting user: {user_id}")
-            self.supabase.from_("users").update({"is_active": False}).eq("id", user_id).execute()
+            async with phase_timeout("db", settings.db_timeout_seconds):
+                await self.supabase.from_("users").update({"is_active": False}).eq("id", user_id).execute()
             logger.info(f"✅ [UserService] User soft deleted successfully: {user_id}")
             return True
+        except DeadlineExceededError:
+            # 超时不是"用户不存在"或"更新失败"，交给错误处理返回 E_DEADLINE_EXCEEDED
+            raise
         except Exception as e:
             logger.error(
                 f"❌ [UserService] Error deleting user {user_id}: {type(e).__name__}: {str(e)}",
@@ -1,5 +1,6 @@
 """File handling utilities"""
 
+import logging
 import os
 import uuid
 from typing import Optional
@@ -8,6 +9,9 @@ from fastapi import UploadFile, HTTPException, status
 
 from app.core.config import settings
 
+# 配置日志
+logger = logging.getLogger(__name__)
+
 
 async def save_upload_file(file: UploadFile, folder: str = "uploads") -> str:
     """Save uploaded file to disk"""
@@ -58,7 +62,7 @@ def delete_file(file_path: str) -> bool:
             return True
         return False
     except Exception as e:
-        print(f"Error deleting file: {e}")
+        logger.error(f"❌ Error deleting file: {e}")
         return False
 
 
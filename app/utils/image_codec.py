@@ -0,0 +1,91 @@
+"""Image encoding utilities
+
+纯函数，在进程池中执行（参数和返回值都是可序列化的 bytes / 基本类型）
+"""
+
+import base64
+import io
+import time
+from typing import Optional, Tuple
+
+from PIL import Image
+
+# 支持的输出格式 -> (Pillow 格式名, content-type, 文件扩展名)
+IMAGE_FORMATS = {
+    "png": ("PNG", "image/png", "png"),
+    "webp": ("WEBP", "image/webp", "webp"),
+    "avif": ("AVIF", "image/avif", "avif"),
+    "jpeg": ("JPEG", "image/jpeg", "jpg"),
+}
+
+# 缩略图依次尝试的编码质量
+PREVIEW_QUALITIES = (50, 30, 15)
+
+
+def content_type(fmt: str) -> str:
+    """格式对应的 content-type"""
+    return IMAGE_FORMATS[fmt][1]
+
+
+def extension(fmt: str) -> str:
+    """格式对应的文件扩展名"""
+    return IMAGE_FORMATS[fmt][2]
+
+
+def _encode(image: Image.Image, fmt: str, quality: int) -> bytes:
+    pil_format = IMAGE_FORMATS[fmt][0]
+    if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    if pil_format == "PNG":
+        image.save(buffer, format=pil_format, optimize=True)
+    else:
+        image.save(buffer, format=pil_format, quality=quality)
+    return buffer.getvalue()
+
+
+def transcode(data: bytes, fmt: str, quality: int) -> Tuple[bytes, float]:
+    """
+    把图片重新编码为指定格式
+
+    Returns:
+        (编码后的数据, 编码耗时秒数)
+    """
+    started = time.perf_counter()
+    with Image.open(io.BytesIO(data)) as image:
+        encoded = _encode(image, fmt, quality)
+    return encoded, time.perf_counter() - started
+
+
+def resize(data: bytes, width: Optional[int], height: Optional[int], fmt: str, quality: int) -> bytes:
+    """
+    等比缩放到 width x height 以内（只给一边时按该边缩放，不放大）并重新编码
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+    box = (width or image.width, height or image.height)
+    if box[0] < image.width or box[1] < image.height:
+        image.thumbnail(box, Image.Resampling.LANCZOS)
+    return _encode(image, fmt, quality)
+
+
+def preview_data_uri(base64_data: str, max_edge: int, max_bytes: int, fmt: str = "webp") -> Optional[str]:
+    """
+    从 base64 图片生成内联缩略图（data URI）
+
+    逐步降低质量和尺寸，直到整个 data URI 不超过 max_bytes；无法满足时返回 None
+    """
+    data = base64.b64decode(base64_data)
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+    edge = max_edge
+    while edge >= 16:
+        thumbnail = image.copy()
+        thumbnail.thumbnail((edge, edge))
+        for quality in PREVIEW_QUALITIES:
+            encoded = base64.b64encode(_encode(thumbnail, fmt, quality)).decode("ascii")
+            data_uri = f"data:{content_type(fmt)};base64,{encoded}"
+            if len(data_uri) <= max_bytes:
+                return data_uri
+        edge = edge * 3 // 4
+    return None
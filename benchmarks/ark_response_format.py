@@ -0,0 +1,136 @@
+"""ARK 返回格式基准测试：b64_json vs url
+
+使用本地假 ARK 接口和假 Supabase Storage（httpx.MockTransport，不访问网络），
+分别以两种模式生成并上传同样的图片，比较耗时和峰值内存（tracemalloc）。
+
+用法：
+    python -m benchmarks.ark_response_format --images 3 --size-mb 6
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import time
+import tracemalloc
+
+import httpx
+from volcenginesdkarkruntime import AsyncArk
+
+from app.core.clients import ClientRegistry
+from app.core.config import settings
+from app.services import image_generation_service as image_module
+from app.services.image_generation_service import ImageGenerationService
+
+ARK_BASE_URL = "http://fake-ark.local/api/v3"
+PROVIDER_CHUNK = 64 * 1024
+
+
+class StreamingMockTransport(httpx.AsyncBaseTransport):
+    """与 httpx.MockTransport 相同，但不预先读取请求体，避免把上传内容整体缓冲进内存"""
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self.handler(request)
+
+
+def fake_provider(images: list, b64_payload: bytes, url_payload: bytes):
+    """假 ARK 接口 + 假图片下载 + 假 Storage 上传（上传内容只计数不保存）"""
+    received = {"bytes": 0}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if path == "/api/v3/images/generations":
+            body = json.loads(request.content)
+            payload = b64_payload if body["response_format"] == "b64_json" else url_payload
+            return httpx.Response(200, headers={"content-type": "application/json"}, content=payload)
+        if path.startswith("/images/"):
+            data = images[int(path.rsplit("/", 1)[-1].split(".")[0])]
+
+            async def body():
+                view = memoryview(data)
+                for start in range(0, len(data), PROVIDER_CHUNK):
+                    yield bytes(view[start:start + PROVIDER_CHUNK])
+
+            return httpx.Response(200, headers={"content-type": "image/png"}, content=body())
+        if path.startswith("/storage/v1/object/"):
+            async for chunk in request.stream:
+                received["bytes"] += len(chunk)
+            return httpx.Response(200, json={"Key": path})
+        return httpx.Response(404, json={})
+
+    return handler, received
+
+
+async def run_mode(mode: str, images: list, b64_payload: bytes, url_payload: bytes) -> dict:
+    settings.ark_response_format = mode
+    handler, received = fake_provider(images, b64_payload, url_payload)
+    transport = StreamingMockTransport(handler)
+
+    registry = ClientRegistry()
+    registry._http_client = httpx.AsyncClient(transport=transport)
+    image_module.client_registry = registry
+    service = ImageGenerationService()
+    service._ark_async_client = AsyncArk(
+        base_url=ARK_BASE_URL,
+        api_key="bench-key",
+        http_client=httpx.AsyncClient(transport=transport),
+    )
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    events = [event async for event in service.generate_images_stream(["https://in.example.com/a.png"], "bench", "bench-user")]
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    await registry.shutdown()
+    await service.close()
+
+    done = events[-1]
+    assert done.event == "done", done.data
+    return {
+        "mode": mode,
+        "seconds": elapsed,
+        "peak_mb": peak / 1024 / 1024,
+        "uploaded_mb": received["bytes"] / 1024 / 1024,
+        "images": len(done.data["generated_images"]),
+    }
+
+
+async def main(image_count: int, size_mb: float) -> None:
+    settings.supabase_url = "https://project.supabase.co"
+    settings.supabase_key = "bench-anon-key"
+    settings.ark_stream = False
+    settings.ark_use_async_client = True
+
+    size = int(size_mb * 1024 * 1024)
+    images = [os.urandom(size) for _ in range(image_count)]
+    b64_payload = json.dumps({
+        "model": settings.ark_model,
+        "created": 0,
+        "data": [{"b64_json": base64.b64encode(data).decode(), "size": "2048x2048"} for data in images],
+    }).encode()
+    url_payload = json.dumps({
+        "model": settings.ark_model,
+        "created": 0,
+        "data": [{"url": f"http://fake-ark.local/images/{i}.png", "size": "2048x2048"} for i in range(image_count)],
+    }).encode()
+
+    print(f"{image_count} images x {size_mb} MB")
+    print(f"{'mode':<10}{'seconds':>10}{'peak MB':>10}{'uploaded MB':>14}")
+    for mode in ("b64_json", "url"):
+        result = await run_mode(mode, images, b64_payload, url_payload)
+        print(f"{result['mode']:<10}{result['seconds']:>10.3f}{result['peak_mb']:>10.1f}{result['uploaded_mb']:>14.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=3)
+    parser.add_argument("--size-mb", type=float, default=6.0)
+    args = parser.parse_args()
+    asyncio.run(main(args.images, args.size_mb))
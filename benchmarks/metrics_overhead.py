@@ -0,0 +1,86 @@
+"""指标开销微基准测试
+
+测量热路径上指标操作的耗时：
+- 预先绑定标签的计数器 inc、直方图 observe、按标签查找子指标
+- MetricsMiddleware 每个请求增加的耗时（直接调用 ASGI 应用，不经过 HTTP 客户端）
+- 导出 /metrics 文本的耗时
+
+用法：
+    python -m benchmarks.metrics_overhead --iterations 200000 --requests 50000
+"""
+
+import argparse
+import asyncio
+import time
+import timeit
+
+from fastapi.routing import APIRoute
+
+from app.core.metrics import MetricsRegistry
+from app.middleware.metrics import MetricsMiddleware
+
+ROUTE = APIRoute("/api/faceflip/tasks/{task_id}/events", endpoint=lambda: None)
+
+
+async def inner_app(scope, receive, send):
+    """模拟路由器写入 scope 后返回一个空响应"""
+    scope["route"] = ROUTE
+    scope["path_params"] = {"task_id": "task-1"}
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def send(message):
+    pass
+
+
+async def per_request_seconds(app, requests: int) -> float:
+    started = time.perf_counter()
+    for _ in range(requests):
+        scope = {"type": "http", "method": "GET", "path": "/api/faceflip/tasks/task-1/events"}
+        await app(scope, receive, send)
+    return (time.perf_counter() - started) / requests
+
+
+def ns_per_op(stmt, iterations: int) -> float:
+    return min(timeit.repeat(stmt, number=iterations, repeat=5)) / iterations * 1e9
+
+
+async def main(iterations: int, requests: int) -> None:
+    registry = MetricsRegistry()
+    counter = registry.counter("bench_total", "bench", ("outcome",))
+    histogram = registry.histogram("bench_seconds", "bench", ("outcome",))
+    bound_counter = counter.labels("success")
+    bound_histogram = histogram.labels("success")
+
+    print(f"{'operation':<32}{'ns/op':>10}")
+    for name, stmt in (
+        ("counter.inc (pre-bound)", lambda: bound_counter.inc()),
+        ("histogram.observe (pre-bound)", lambda: bound_histogram.observe(0.042)),
+        ("counter.labels(...).inc", lambda: counter.labels("success").inc()),
+    ):
+        print(f"{name:<32}{ns_per_op(stmt, iterations):>10.1f}")
+
+    bare = await per_request_seconds(inner_app, requests)
+    instrumented = await per_request_seconds(MetricsMiddleware(inner_app), requests)
+    print(f"{'MetricsMiddleware per request':<32}{(instrumented - bare) * 1e9:>10.1f}")
+
+    for index in range(50):
+        registry.histogram(f"bench_{index}_seconds", "bench", ("route",)).labels("/").observe(0.1)
+    started = time.perf_counter()
+    text = registry.render()
+    elapsed = time.perf_counter() - started
+    name = f"render ({len(text.splitlines())} lines)"
+    print(f"{name:<32}{elapsed * 1e9:>10.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200000)
+    parser.add_argument("--requests", type=int, default=50000)
+    args = parser.parse_args()
+    asyncio.run(main(args.iterations, args.requests))
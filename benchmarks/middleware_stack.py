@@ -0,0 +1,182 @@
+"""中间件栈基准测试：BaseHTTPMiddleware vs 纯 ASGI
+
+在同一组路由上分别挂载三套中间件（与 app.main 相同的顺序：Error Handler -> Auth -> Logging）：
+- bare：不挂中间件，作为基线
+- legacy：原先基于 BaseHTTPMiddleware / app.middleware("http") 的实现（在本文件中保留一份等价副本）
+- asgi：app.middleware 中的纯 ASGI 实现
+
+通过 httpx.ASGITransport 在进程内发请求（不经过网络和服务器），比较：
+- 公开接口和需认证接口的每秒请求数
+- SSE 流每个分块相对基线多出的耗时
+
+用法：
+    python -m benchmarks.middleware_stack --requests 2000 --concurrency 20 --chunks 2000
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import logging
+import time
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from app.core.auth_context import set_request_user
+from app.core.response import error
+from app.core.response_code import ResponseCode
+from app.core.token_verifier import token_verifier
+from app.middleware import AuthMiddleware, ErrorHandlerMiddleware, LoggingMiddleware
+
+AUTH_HEADERS = {"Authorization": "Bearer bench-token"}
+USER = {"id": "bench-user", "email": "bench@example.com"}
+
+
+class LegacyLoggingMiddleware(BaseHTTPMiddleware):
+    """原 LoggingMiddleware"""
+
+    async def dispatch(self, request: Request, call_next):
+        start_time = time.time()
+        print(f"📥 {request.method} {request.url.path}")
+        response = await call_next(request)
+        process_time = time.time() - start_time
+        print(
+            f"📤 {request.method} {request.url.path} "
+            f"- Status: {response.status_code} "
+            f"- Time: {process_time:.3f}s"
+        )
+        response.headers["X-Process-Time"] = str(process_time)
+        return response
+
+
+class LegacyAuthMiddleware(BaseHTTPMiddleware):
+    """原 AuthMiddleware 的请求路径（白名单判断、Bearer 解析、写入 request.state）"""
+
+    def __init__(self, app, enable: bool = True):
+        super().__init__(app)
+        self.checker = AuthMiddleware(app, enable=enable)
+
+    async def dispatch(self, request: Request, call_next):
+        try:
+            if self.checker._is_public_path(request.url.path):
+                return await call_next(request)
+            authorization = request.headers.get("Authorization")
+            if not authorization:
+                return error(code=ResponseCode.UNAUTHORIZED, msg="missing authorization header")
+            parts = authorization.split()
+            if len(parts) != 2 or parts[0].lower() != "bearer":
+                return error(code=ResponseCode.UNAUTHORIZED, msg="invalid authorization header format")
+            user = await self.checker._verify_token(parts[1])
+            if not user:
+                return error(code=ResponseCode.E_TOKEN_NOT_VALID, msg="token not valid or expired")
+            set_request_user(request, user, parts[1])
+            return await call_next(request)
+        except Exception as e:
+            return error(code=ResponseCode.E_SYSTEM_BUSY, msg=f"authentication error: {str(e)}")
+
+
+async def legacy_error_handler_middleware(request: Request, call_next):
+    """原函数式 error_handler_middleware"""
+    try:
+        return await call_next(request)
+    except Exception as exc:
+        return error(code=ResponseCode.E_SYSTEM_BUSY, msg=f"system error: {str(exc)}")
+
+
+def build_app(stack: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    @app.get("/api/me")
+    async def me(request: Request):
+        return {"id": getattr(request.state, "current_user", USER)["id"]}
+
+    @app.get("/api/stream")
+    async def stream(chunks: int):
+        async def events():
+            for index in range(chunks):
+                yield f"event: process\ndata: {index}\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    if stack == "legacy":
+        app.add_middleware(LegacyLoggingMiddleware)
+        app.add_middleware(LegacyAuthMiddleware, enable=True)
+        app.middleware("http")(legacy_error_handler_middleware)
+    elif stack == "asgi":
+        app.add_middleware(LoggingMiddleware)
+        app.add_middleware(AuthMiddleware, enable=True)
+        app.add_middleware(ErrorHandlerMiddleware)
+    return app
+
+
+async def requests_per_second(client: httpx.AsyncClient, path: str, total: int, concurrency: int) -> float:
+    async def worker(count: int) -> None:
+        for _ in range(count):
+            response = await client.get(path, headers=AUTH_HEADERS)
+            response.raise_for_status()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(total // concurrency) for _ in range(concurrency)))
+    return (total // concurrency * concurrency) / (time.perf_counter() - started)
+
+
+async def stream_seconds(client: httpx.AsyncClient, chunks: int) -> float:
+    started = time.perf_counter()
+    async with client.stream("GET", "/api/stream", params={"chunks": chunks}, headers=AUTH_HEADERS) as response:
+        async for _ in response.aiter_raw():
+            pass
+    return time.perf_counter() - started
+
+
+async def run_stack(stack: str, total: int, concurrency: int, chunks: int) -> dict:
+    app = build_app(stack)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench.local") as client:
+        # 预热
+        await requests_per_second(client, "/health", concurrency, concurrency)
+        return {
+            "stack": stack,
+            "public_rps": await requests_per_second(client, "/health", total, concurrency),
+            "auth_rps": await requests_per_second(client, "/api/me", total, concurrency),
+            "stream_seconds": min([await stream_seconds(client, chunks) for _ in range(3)]),
+        }
+
+
+async def main(total: int, concurrency: int, chunks: int) -> None:
+    async def fake_verify(token, remote=None):
+        return dict(USER)
+
+    token_verifier.verify = fake_verify
+    logging.disable(logging.CRITICAL)
+
+    results = []
+    # 原日志中间件使用 print，测试期间丢弃输出
+    with contextlib.redirect_stdout(io.StringIO()):
+        for stack in ("bare", "legacy", "asgi"):
+            results.append(await run_stack(stack, total, concurrency, chunks))
+
+    baseline = results[0]["stream_seconds"]
+    print(f"{total} requests x {concurrency} concurrent, SSE stream of {chunks} chunks")
+    print(f"{'stack':<8}{'public req/s':>14}{'auth req/s':>12}{'stream s':>10}{'µs/chunk':>10}")
+    for result in results:
+        overhead = (result["stream_seconds"] - baseline) / chunks * 1e6
+        print(
+            f"{result['stack']:<8}{result['public_rps']:>14.0f}{result['auth_rps']:>12.0f}"
+            f"{result['stream_seconds']:>10.3f}{overhead:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--chunks", type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency, args.chunks))
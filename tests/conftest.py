@@ -3,7 +3,38 @@
 import pytest
 from fastapi.testclient import TestClient
 
+from app.core import resilience
+from app.core.executors import BoundedExecutor
+from app.core.token_verifier import token_verifier
 from app.main import app
+from app.services import image_generation_service as image_module
+from app.services import image_variants
+
+USER = {
+    "id": "user-1",
+    "email": "test@example.com",
+    "user_metadata": {},
+    "created_at": None,
+}
+AUTH_HEADERS = {"Authorization": "Bearer test-token"}
+
+
+@pytest.fixture(autouse=True)
+def thread_image_process_pool(monkeypatch):
+    """图片编码改用线程池执行，避免测试中启动子进程"""
+    pool = BoundedExecutor("test-image-process", max_workers=2, max_queue=32)
+    monkeypatch.setattr(image_module, "image_process_pool", pool)
+    monkeypatch.setattr(image_variants, "image_process_pool", pool)
+    yield pool
+    pool.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def reset_upstreams():
+    """每个测试使用全新的重试统计和熔断器状态"""
+    for upstream in (resilience.ark_upstream, resilience.storage_upstream, resilience.auth_upstream):
+        upstream.__init__(upstream.name)
+    yield
 
 
 @pytest.fixture
@@ -12,6 +43,19 @@ def client():
     return TestClient(app)
 
 
+@pytest.fixture
+def verifier_calls(monkeypatch):
+    """Replace the shared verifier with a stub that counts invocations"""
+    calls = []
+
+    async def fake_verify(token, remote=None):
+        calls.append((token, remote))
+        return dict(USER) if token == "test-token" else None
+
+    monkeypatch.setattr(token_verifier, "verify", fake_verify)
+    return calls
+
+
 @pytest.fixture
 def test_user_data():
     """Test user data fixture"""
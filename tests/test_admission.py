@@ -0,0 +1,76 @@
+"""Generation admission control tests"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.admission import AdmissionController, AdmissionQueueFullError, generation_admission
+from app.core.token_verifier import token_verifier
+from app.services.generation_jobs import GenerationJobManager
+from tests.test_generation_jobs import FakeGenerationService, drain
+
+
+@pytest.mark.asyncio
+async def test_queue_positions_and_rejection():
+    controller = AdmissionController("test", max_concurrency=1, max_queue=2)
+
+    first = controller.enqueue()
+    second = controller.enqueue()
+    third = controller.enqueue()
+
+    assert first.granted
+    assert (second.position, third.position) == (1, 2)
+    with pytest.raises(AdmissionQueueFullError):
+        controller.enqueue()
+
+    first.release()
+    first.release()
+
+    assert second.granted
+    assert third.position == 1
+    assert controller.estimate_wait(1) is not None
+
+    # 排队中退出不会占用名额
+    third.release()
+    second.release()
+
+    stats = controller.stats()
+    assert (stats["active"], stats["queued"]) == (0, 0)
+    assert stats["rejected"] == 1
+    assert stats["queue_length"]["count"] == 4
+    assert stats["wait_seconds"]["count"] == 2
+
+
+@pytest.mark.asyncio
+async def test_queued_job_reports_position_and_runs_after_slot_frees():
+    manager = GenerationJobManager(
+        FakeGenerationService(interval=0.01), AdmissionController("test", 1, 1)
+    )
+    first = await manager.start("task-1", "user-1", [])
+    second = await manager.start("task-2", "user-1", [])
+    with pytest.raises(AdmissionQueueFullError):
+        await manager.start("task-3", "user-1", [])
+
+    events = await drain(second.subscribe())
+    await first.task
+
+    queued = [event for event in events if event.event == "queued"]
+    assert [event.data["position"] for event in queued] == [1]
+    assert events[-1].event == "done"
+    assert manager.admission.active == 0
+
+
+def test_generate_stream_rejects_when_queue_full(client: TestClient, monkeypatch):
+    async def fake_verify(token, remote=None):
+        return {"id": "user-1", "email": "test@example.com", "user_metadata": {}, "created_at": None}
+
+    monkeypatch.setattr(token_verifier, "verify", fake_verify)
+    monkeypatch.setattr(generation_admission, "max_concurrency", 0)
+    monkeypatch.setattr(generation_admission, "max_queue", 0)
+
+    response = client.post(
+        "/api/faceflip/generate/stream",
+        json={"urls": ["https://in.example.com/a.png"], "task_id": "task-busy"},
+        headers={"Authorization": "Bearer test-token"},
+    )
+
+    assert response.json()["code"] == 11003
@@ -0,0 +1,38 @@
+"""Authentication flow tests"""
+
+from fastapi.testclient import TestClient
+
+from tests.conftest import AUTH_HEADERS
+
+
+def test_current_user_reuses_middleware_result(client: TestClient, verifier_calls):
+    """AuthMiddleware and CurrentUser share one verification per request"""
+    response = client.get("/api/users/me", headers=AUTH_HEADERS)
+
+    assert response.json()["data"]["user"]["id"] == "user-1"
+    assert len(verifier_calls) == 1
+
+
+def test_strict_user_verifies_remotely(client: TestClient, verifier_calls):
+    """/api/auth/verify re-checks the token with Supabase Auth to catch revoked sessions"""
+    response = client.get("/api/auth/verify", headers=AUTH_HEADERS)
+
+    assert response.json()["data"]["user"]["id"] == "user-1"
+    assert [remote for _, remote in verifier_calls] == [None, True]
+
+
+def test_current_user_verifies_when_middleware_disabled(verifier_calls):
+    """Without global auth (api/index.py) the dependency verifies exactly once"""
+    from api.index import app as serverless_app
+
+    response = TestClient(serverless_app).get("/api/users/me", headers=AUTH_HEADERS)
+
+    assert response.json()["data"]["user"]["id"] == "user-1"
+    assert len(verifier_calls) == 1
+
+
+def test_invalid_token_rejected_by_middleware(client: TestClient, verifier_calls):
+    response = client.get("/api/users/me", headers={"Authorization": "Bearer bad-token"})
+
+    assert response.json()["code"] == 13003
+    assert len(verifier_calls) == 1
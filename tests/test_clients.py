@@ -0,0 +1,30 @@
+"""Shared client registry tests"""
+
+import pytest
+
+from app.core.clients import ClientRegistry
+from app.core.config import settings
+
+
+@pytest.mark.asyncio
+async def test_clients_share_one_pool_and_close_on_shutdown(monkeypatch):
+    monkeypatch.setattr(settings, "supabase_url", "https://project.supabase.co")
+    monkeypatch.setattr(settings, "supabase_key", "anon-key")
+    monkeypatch.setattr(settings, "supabase_service_role_key", "service-role-key")
+
+    registry = ClientRegistry()
+    registry.startup()
+
+    service_client = registry.supabase
+    anon_client = registry.supabase_anon
+    pool = registry.http_client
+
+    assert registry.supabase is service_client
+    assert service_client.options.httpx_client is pool
+    assert anon_client.options.httpx_client is pool
+
+    await registry.shutdown()
+
+    assert pool.is_closed
+    assert registry.supabase is not service_client
+    await registry.shutdown()
@@ -0,0 +1,48 @@
+"""CORS preflight tests"""
+
+import statistics
+import time
+
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.core.resilience import auth_upstream
+
+PREFLIGHT_HEADERS = {
+    "Origin": "https://app.example.com",
+    "Access-Control-Request-Method": "POST",
+    "Access-Control-Request-Headers": "authorization, content-type",
+}
+
+
+def test_preflight_answered_without_auth(client: TestClient, verifier_calls):
+    response = client.options("/api/faceflip/generate/stream", headers=PREFLIGHT_HEADERS)
+
+    assert response.status_code == 200
+    assert response.headers["access-control-allow-origin"] == "https://app.example.com"
+    assert response.headers["access-control-max-age"] == str(settings.cors_max_age)
+    assert "authorization" in response.headers["access-control-allow-headers"].lower()
+    # 不经过认证中间件和日志中间件，也不调用上游认证服务
+    assert verifier_calls == []
+    assert auth_upstream.calls == 0
+    assert "X-Process-Time" not in response.headers
+
+
+def test_preflight_latency(client: TestClient, verifier_calls):
+    durations = []
+    for _ in range(50):
+        started = time.perf_counter()
+        response = client.options("/api/users/me", headers=PREFLIGHT_HEADERS)
+        durations.append(time.perf_counter() - started)
+        assert response.status_code == 200
+
+    assert statistics.median(durations) < 0.05
+    assert verifier_calls == []
+
+
+def test_auth_rejection_carries_cors_headers(client: TestClient, verifier_calls):
+    """CORS 在最外层，浏览器可以读取认证失败的错误信息"""
+    response = client.get("/api/users/me", headers={"Origin": "https://app.example.com"})
+
+    assert response.json()["code"] == 401
+    assert response.headers["access-control-allow-origin"] == "https://app.example.com"
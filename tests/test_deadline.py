@@ -0,0 +1,147 @@
+"""Deadline and per-phase timeout tests"""
+
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.admission import AdmissionController
+from app.core.config import settings
+from app.core.deadline import DeadlineExceededError, phase_timeout, start_deadline
+from app.core.token_verifier import token_verifier
+from app.services.generation_jobs import GenerationJobManager
+from app.services.image_generation_service import ImageGenerationService
+from app.services.user_service import UserService
+from tests.test_generation_jobs import SlowGenerationService
+from tests.test_image_generation import collect, fake_ark_response, fake_async_ark_stream
+
+
+@pytest.mark.asyncio
+async def test_phase_timeout_is_bounded_by_remaining_deadline():
+    # 没有截止时间时只应用阶段超时
+    with pytest.raises(DeadlineExceededError) as exc_info:
+        async with phase_timeout("upload", 0.02):
+            await asyncio.sleep(1)
+    assert exc_info.value.phase == "upload"
+
+    start_deadline(0.05)
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceededError):
+        async with phase_timeout("ark", 10):
+            await asyncio.sleep(1)
+    assert time.monotonic() - started < 0.5
+
+    # 剩余时间不足以覆盖阶段时不执行代码块
+    start_deadline(1)
+    entered = False
+    with pytest.raises(DeadlineExceededError):
+        async with phase_timeout("ark", 10, min_seconds=5):
+            entered = True
+    assert not entered
+
+    # 代码块内部的其他 TimeoutError 原样抛出
+    with pytest.raises(TimeoutError) as exc_info:
+        async with phase_timeout("db", 10):
+            raise TimeoutError("socket timeout")
+    assert not isinstance(exc_info.value, DeadlineExceededError)
+
+
+@pytest.mark.asyncio
+async def test_generation_fails_fast_when_budget_cannot_cover_ark(monkeypatch):
+    monkeypatch.setattr(settings, "ark_stream", False)
+    monkeypatch.setattr(settings, "ark_use_async_client", False)
+    monkeypatch.setattr(settings, "ark_min_budget_seconds", 20)
+    service = ImageGenerationService()
+    calls = []
+    monkeypatch.setattr(service, "_call_ark_api", lambda urls, prompt: calls.append(urls) or fake_ark_response(1))
+
+    start_deadline(5)
+    events = await collect(service.generate_images_stream(["https://in.example.com/a.png"], "task-1", "user-1"))
+
+    assert events[-1].event == "error"
+    assert events[-1].data["code"] == 11004 and events[-1].data["phase"] == "ark"
+    assert calls == []
+
+
+@pytest.mark.asyncio
+async def test_hung_ark_call_and_upload_time_out(monkeypatch):
+    monkeypatch.setattr(settings, "ark_stream", True)
+    monkeypatch.setattr(settings, "ark_use_async_client", True)
+    monkeypatch.setattr(settings, "ark_min_budget_seconds", 0)
+    monkeypatch.setattr(settings, "ark_timeout_seconds", 0.1)
+    monkeypatch.setattr(settings, "upload_timeout_seconds", 0.05)
+    monkeypatch.setattr(settings, "image_preview_enabled", False)
+    service = ImageGenerationService()
+    service._ark_async_client = fake_async_ark_stream(count=2, interval=0.06)
+
+    async def fake_upload(base64_data, filename, user_id):
+        if base64_data == "image-0":
+            await asyncio.sleep(1)
+        return f"https://storage.example.com/{base64_data}.png"
+
+    monkeypatch.setattr(service, "_upload_base64_to_supabase", fake_upload)
+
+    started = time.monotonic()
+    events = await collect(service.generate_images_stream(["https://in.example.com/a.png"], "task-1", "user-1"))
+
+    # 第一张图片生成后 ARK 超时；该图片的上传也超时，被跳过
+    assert time.monotonic() - started < 0.5
+    assert [event.event for event in events].count("image_generated") == 1
+    assert events[-1].event == "done"
+    assert events[-1].data["generated_images"] == []
+
+
+@pytest.mark.asyncio
+async def test_queued_job_stops_waiting_when_deadline_runs_out(monkeypatch):
+    monkeypatch.setattr(settings, "ark_min_budget_seconds", 0.95)
+    manager = GenerationJobManager(SlowGenerationService(ark_seconds=5), AdmissionController("test", 1, 4))
+
+    start_deadline(1)
+    running = await manager.start("task-1", "user-1", [])
+    queued = await manager.start("task-2", "user-1", [])
+    await asyncio.wait_for(queued.task, timeout=1)
+
+    error = queued.events[-1]
+    assert error.event == "error"
+    assert error.data["code"] == 11004 and error.data["phase"] == "queue"
+    assert manager.admission.queued == 0
+    assert running.status == "running"
+    await manager.shutdown()
+
+
+def test_auth_timeout_returns_deadline_code(client: TestClient, monkeypatch):
+    async def hung_verification(token, remote):
+        await asyncio.sleep(1)
+
+    monkeypatch.setattr(settings, "auth_cache_enabled", False)
+    monkeypatch.setattr(settings, "auth_timeout_seconds", 0.05)
+    monkeypatch.setattr(token_verifier, "_verify_uncached", hung_verification)
+
+    response = client.get("/api/faceflip/debug/executors", headers={"Authorization": "Bearer test-token"})
+
+    assert response.status_code == 200
+    assert response.json()["code"] == 11004
+
+
+class SlowQuery:
+    """PostgREST 查询构造器的替身，execute 一直挂起"""
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    async def execute(self):
+        await asyncio.sleep(10)
+
+
+@pytest.mark.asyncio
+async def test_db_timeout_is_not_reported_as_missing_user(monkeypatch):
+    monkeypatch.setattr(settings, "db_timeout_seconds", 0.02)
+    service = UserService(SlowQuery())
+
+    # 超时不能被当作"用户不存在"（None）或"删除失败"（False）吞掉
+    with pytest.raises(DeadlineExceededError) as exc_info:
+        await service.get_user_by_id("user-1")
+    assert exc_info.value.phase == "db"
+    with pytest.raises(DeadlineExceededError):
+        await service.delete_user("user-1")
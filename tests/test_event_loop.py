@@ -0,0 +1,108 @@
+"""Event loop responsiveness tests
+
+Supabase 数据库、认证和存储调用必须是 await 的异步调用，
+上游变慢时不能阻塞事件循环（否则所有 SSE 流都会一起卡住）
+"""
+
+import asyncio
+import gc
+import time
+
+import httpx
+import pytest
+
+from app.core.clients import ClientRegistry
+from app.core.config import settings
+from app.services import image_generation_service as image_module
+from app.services.auth_service import AuthService
+from app.services.user_service import UserService
+
+
+UPSTREAM_DELAY = 0.2
+MAX_LOOP_LAG = 0.05
+
+USER_ROW = {
+    "id": "user-1",
+    "email": "test@example.com",
+    "created_at": "2024-01-01T00:00:00+00:00",
+}
+AUTH_USER = {
+    **USER_ROW,
+    "aud": "authenticated",
+    "app_metadata": {},
+    "user_metadata": {},
+}
+
+
+async def slow_upstream(request: httpx.Request) -> httpx.Response:
+    """模拟响应缓慢的 Supabase"""
+    await asyncio.sleep(UPSTREAM_DELAY)
+    path = request.url.path
+    if path.startswith("/rest/v1/"):
+        return httpx.Response(200, json=[USER_ROW])
+    if path.startswith("/auth/v1/"):
+        return httpx.Response(200, json=AUTH_USER)
+    if path.startswith("/storage/v1/object/"):
+        return httpx.Response(200, json={"Key": path.removeprefix("/storage/v1/object/")})
+    return httpx.Response(404, json={})
+
+
+@pytest.fixture
+def frozen_gc():
+    """测量前冻结已有对象，避免整个测试会话累积的堆触发的全量 GC 被计入循环延迟"""
+    gc.collect()
+    gc.freeze()
+    yield
+    gc.unfreeze()
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(settings, "supabase_url", "https://project.supabase.co")
+    monkeypatch.setattr(settings, "supabase_key", "anon-key")
+    monkeypatch.setattr(settings, "supabase_service_role_key", "service-role-key")
+
+    registry = ClientRegistry()
+    registry._http_client = httpx.AsyncClient(transport=httpx.MockTransport(slow_upstream))
+    monkeypatch.setattr(image_module, "client_registry", registry)
+    return registry
+
+
+async def measure_max_lag(stop: asyncio.Event) -> float:
+    """心跳任务：记录事件循环两次调度之间的最大延迟"""
+    interval = 0.005
+    max_lag = 0.0
+    last = time.perf_counter()
+    while not stop.is_set():
+        await asyncio.sleep(interval)
+        now = time.perf_counter()
+        max_lag = max(max_lag, now - last - interval)
+        last = now
+    return max_lag
+
+
+@pytest.mark.asyncio
+async def test_slow_supabase_does_not_block_event_loop(registry, frozen_gc):
+    stop = asyncio.Event()
+    heartbeat = asyncio.create_task(measure_max_lag(stop))
+
+    started = time.perf_counter()
+    user, verified, url = await asyncio.gather(
+        UserService(registry.supabase).get_user_by_id("user-1"),
+        AuthService(registry.supabase).verify_token("token"),
+        image_module.ImageGenerationService()._upload_base64_to_supabase(
+            "aGVsbG8=", "test.png", "user-1"
+        ),
+    )
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    max_lag = await heartbeat
+    await registry.shutdown()
+
+    assert user is not None and user.id == "user-1"
+    assert verified["id"] == "user-1"
+    assert "test.png" in url
+    # 三个慢调用并发执行，且期间事件循环始终保持响应
+    assert elapsed < UPSTREAM_DELAY * 2
+    assert max_lag < MAX_LOOP_LAG
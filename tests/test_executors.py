@@ -0,0 +1,67 @@
+"""Dedicated executor tests"""
+
+import asyncio
+import io
+import threading
+
+import pytest
+from PIL import Image
+
+from app.core.executors import BoundedExecutor, ExecutorQueueFullError
+from app.utils import image_codec
+
+
+def make_png(width: int = 256, height: int = 256) -> bytes:
+    """生成渐变色测试 PNG"""
+    image = Image.new("RGB", (width, height))
+    image.putdata([(x, y, (x + y) // 2) for y in range(height) for x in range(width)])
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.mark.asyncio
+async def test_executor_bounds_queue_and_reports_depth():
+    executor = BoundedExecutor("test-pool", max_workers=1, max_queue=1)
+    release = threading.Event()
+    thread_names = []
+
+    def blocking():
+        thread_names.append(threading.current_thread().name)
+        release.wait(timeout=5)
+        return "ok"
+
+    running = executor.submit(blocking)
+    queued = executor.submit(blocking)
+    while executor.active == 0:
+        await asyncio.sleep(0.001)
+
+    assert executor.stats()["active"] == 1
+    assert executor.stats()["queued"] == 1
+    with pytest.raises(ExecutorQueueFullError):
+        executor.submit(blocking)
+
+    release.set()
+    assert await running == "ok"
+    assert await queued == "ok"
+
+    stats = executor.stats()
+    assert stats["active"] == 0 and stats["queued"] == 0
+    assert stats["completed"] == 2 and stats["rejected"] == 1
+    assert all(name.startswith("test-pool") for name in thread_names)
+    executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_process_pool_runs_image_encoding():
+    executor = BoundedExecutor("test-process", max_workers=1, max_queue=1, processes=True)
+    png = make_png()
+
+    encoded, seconds = await executor.run(image_codec.transcode, png, "webp", 80)
+
+    assert encoded[:4] == b"RIFF" and encoded[8:12] == b"WEBP"
+    assert len(encoded) < len(png)
+    assert seconds > 0
+    stats = executor.stats()
+    assert stats["kind"] == "process" and stats["completed"] == 1
+    executor.shutdown()
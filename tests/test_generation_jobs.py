@@ -0,0 +1,261 @@
+"""Generation job manager tests"""
+
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.admission import AdmissionController
+from app.core.config import settings
+from app.core.token_verifier import token_verifier
+from app.schemas.face_flip import SSEEvent
+from app.services import generation_jobs
+from app.services.generation_jobs import GenerationJobConflictError, GenerationJobManager
+from app.services.result_cache import GenerationResultCache, MemoryResultStore
+
+
+class FakeGenerationService:
+    """按固定间隔产出事件的假生成服务"""
+
+    def __init__(self, interval: float = 0.0):
+        self.interval = interval
+        self.calls = 0
+
+    async def generate_images_stream(self, urls, task_id, user_id, prompt=None, on_generation_done=None):
+        self.calls += 1
+        for name in ("process", "upload_start", "image_uploaded"):
+            await asyncio.sleep(self.interval)
+            yield SSEEvent(event=name, data={"task_id": task_id})
+        if on_generation_done is not None:
+            on_generation_done()
+        yield SSEEvent(event="done", data={"task_id": task_id, "generated_images": []})
+
+
+class SlowGenerationService(FakeGenerationService):
+    """ARK 生成耗时 ark_seconds 的假生成服务，记录是否被取消"""
+
+    def __init__(self, ark_seconds: float):
+        super().__init__()
+        self.ark_seconds = ark_seconds
+        self.cancelled = 0
+
+    async def generate_images_stream(self, urls, task_id, user_id, prompt=None, on_generation_done=None):
+        self.calls += 1
+        try:
+            yield SSEEvent(event="process", data={"task_id": task_id})
+            await asyncio.sleep(self.ark_seconds)
+            on_generation_done()
+            yield SSEEvent(event="image_generated", data={"task_id": task_id, "index": 0, "size": "2048x2048"})
+            images = [{"url": "https://cdn.example.com/1.png", "size": "2048x2048"}]
+            yield SSEEvent(event="done", data={"task_id": task_id, "generated_images": images})
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+
+def make_manager(service, max_concurrency=4, max_queue=4, cache=None) -> GenerationJobManager:
+    return GenerationJobManager(service, AdmissionController("test", max_concurrency, max_queue), cache)
+
+
+async def first_event(job):
+    """订阅任务、收到第一个事件后断开"""
+    subscription = job.subscribe()
+    event = await subscription.__anext__()
+    await subscription.aclose()
+    return event
+
+
+async def drain(iterator) -> list:
+    return [event async for event in iterator]
+
+
+@pytest.mark.asyncio
+async def test_job_keeps_running_after_subscriber_disconnects():
+    manager = make_manager(FakeGenerationService(interval=0.01))
+    job = await manager.start("task-1", "user-1", ["https://in.example.com/a.png"])
+
+    # 第一个连接只收到两个事件就断开
+    received = []
+    async for event in job.subscribe():
+        received.append(event)
+        if len(received) == 2:
+            break
+
+    # 重连后从 Last-Event-ID 继续，不会重复也不会丢失
+    resumed = await drain(job.subscribe(received[-1].id))
+
+    assert [event.id for event in received + resumed] == [1, 2, 3, 4, 5, 6]
+    assert [event.event for event in resumed[-2:]] == ["timing", "done"]
+    assert job.status == "done"
+    assert manager.service.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_duplicate_task_id_reuses_job():
+    service = FakeGenerationService(interval=0.01)
+    manager = make_manager(service)
+    urls = ["https://in.example.com/a.png"]
+
+    job = await manager.start("task-1", "user-1", urls)
+    # 运行中重复提交：附加到同一个任务并从头接收事件
+    assert await manager.start("task-1", "user-1", urls) is job
+    attached = await drain(job.attach())
+    assert attached[0].id == 1 and attached[-1].event == "done"
+
+    # 完成后重复提交：只重放 done 事件
+    replayed = await drain((await manager.start("task-1", "user-1", urls)).attach())
+    assert [event.event for event in replayed] == ["done"]
+
+    # 其他用户的相同 task_id 互不影响
+    assert await manager.start("task-1", "user-2", urls) is not job
+    with pytest.raises(GenerationJobConflictError):
+        await manager.start("task-1", "user-1", ["https://in.example.com/b.png"])
+    assert service.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_job_is_retried_on_resubmit():
+    class FailingService(FakeGenerationService):
+        async def generate_images_stream(self, *args, **kwargs):
+            self.calls += 1
+            raise RuntimeError("ARK unavailable")
+            yield
+
+    manager = make_manager(FailingService())
+    first = await manager.start("task-1", "user-1", [])
+    await first.task
+    assert first.status == "error"
+
+    second = await manager.start("task-1", "user-1", [])
+    await second.task
+    assert second is not first
+    assert manager.service.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_finished_jobs_evicted_after_ttl(monkeypatch):
+    monkeypatch.setattr(settings, "generation_job_ttl_seconds", 0)
+    manager = make_manager(FakeGenerationService())
+    job = await manager.start("task-1", "user-1", [])
+    await job.task
+    await asyncio.sleep(0.01)
+
+    assert manager.get("user-1", "task-1") is None
+
+
+@pytest.mark.asyncio
+async def test_retained_jobs_bounded(monkeypatch):
+    monkeypatch.setattr(settings, "generation_job_max_retained", 2)
+    manager = make_manager(FakeGenerationService())
+    for i in range(5):
+        await (await manager.start(f"task-{i}", "user-1", [])).task
+
+    assert manager.stats()["jobs"] <= 3
+    assert manager.get("user-1", "task-4") is not None
+
+
+@pytest.mark.asyncio
+async def test_jobs_without_subscribers_are_abandoned(monkeypatch):
+    monkeypatch.setattr(settings, "generation_abandon_grace_seconds", 0.02)
+    service = SlowGenerationService(ark_seconds=5)
+    manager = make_manager(service, max_concurrency=1)
+
+    running = await manager.start("task-1", "user-1", [])
+    queued = await manager.start("task-2", "user-1", [])
+    await first_event(queued)
+    while not running.events or running.events[-1].event != "process":
+        await asyncio.sleep(0.005)
+    await first_event(running)
+    await asyncio.gather(running.task, queued.task, return_exceptions=True)
+
+    assert running.status == "abandoned" and queued.status == "abandoned"
+    assert service.calls == 1 and service.cancelled == 1
+    # 生成名额和排队位置都已归还
+    assert manager.admission.active == 0 and manager.admission.queued == 0
+    stats = manager.stats()
+    assert stats["abandoned"] == 2 and stats["abandoned_finished"] == 0
+    assert 0 < stats["wasted_ark_seconds"] < 1
+
+
+@pytest.mark.asyncio
+async def test_reconnect_within_grace_keeps_job(monkeypatch):
+    monkeypatch.setattr(settings, "generation_abandon_grace_seconds", 0.05)
+    manager = make_manager(SlowGenerationService(ark_seconds=0.1))
+    job = await manager.start("task-1", "user-1", [])
+
+    await first_event(job)
+    await asyncio.sleep(0.02)
+    events = await drain(job.subscribe(1))
+
+    assert events[-1].event == "done"
+    assert manager.stats()["abandoned"] == 0
+
+
+@pytest.mark.asyncio
+async def test_abandoned_ark_work_finishes_into_cache(monkeypatch):
+    monkeypatch.setattr(settings, "generation_abandon_grace_seconds", 0.01)
+    monkeypatch.setattr(settings, "generation_abandon_finish_started", True)
+    service = SlowGenerationService(ark_seconds=0.05)
+    cache = GenerationResultCache(MemoryResultStore(max_entries=10))
+    manager = make_manager(service, cache=cache)
+
+    job = await manager.start("task-1", "user-1", ["https://in.example.com/a.png"])
+    while job.ark_started_at is None:
+        await asyncio.sleep(0.005)
+    await first_event(job)
+    await job.task
+
+    assert job.status == "done" and service.cancelled == 0
+    assert manager.stats()["abandoned_finished"] == 1
+    assert manager.stats()["wasted_ark_seconds"] == 0
+    assert await cache.get(["https://in.example.com/a.png"], None) is not None
+
+
+@pytest.mark.asyncio
+async def test_sse_stream_stops_when_client_disconnects(monkeypatch):
+    from app.api.endpoints.faceflip import _until_disconnected
+
+    class DisconnectedRequest:
+        async def is_disconnected(self):
+            return True
+
+    monkeypatch.setattr(settings, "sse_disconnect_poll_seconds", 0.01)
+    manager = make_manager(SlowGenerationService(ark_seconds=5))
+    job = await manager.start("task-1", "user-1", [])
+
+    received = await drain(_until_disconnected(job.subscribe(), DisconnectedRequest()))
+    await asyncio.sleep(0)
+
+    # 已有事件照常转发，等待下一个事件时发现断开
+    assert [event.event for event in received] == ["start", "process"]
+    assert job.subscribers == 0
+    await manager.shutdown()
+
+
+def test_events_endpoint_replays_from_last_event_id(client: TestClient, monkeypatch):
+    async def fake_verify(token, remote=None):
+        return {"id": "user-1", "email": "test@example.com", "user_metadata": {}, "created_at": None}
+
+    monkeypatch.setattr(token_verifier, "verify", fake_verify)
+    monkeypatch.setattr(
+        generation_jobs.generation_job_manager, "service", FakeGenerationService()
+    )
+    headers = {"Authorization": "Bearer test-token"}
+
+    response = client.post(
+        "/api/faceflip/generate/stream",
+        json={"urls": ["https://in.example.com/a.png"], "task_id": "task-replay"},
+        headers=headers,
+    )
+    assert "id: 5\nevent: timing" in response.text
+    assert "id: 6\nevent: done" in response.text
+
+    replay = client.get(
+        "/api/faceflip/tasks/task-replay/events",
+        headers={**headers, "Last-Event-ID": "3"},
+    )
+    assert replay.text.startswith("id: 4\nevent: image_uploaded")
+    assert replay.text.count("event:") == 3
+
+    missing = client.get("/api/faceflip/tasks/unknown/events", headers=headers)
+    assert missing.json()["code"] == 14001
@@ -0,0 +1,370 @@
+"""Image generation pipeline tests"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from volcenginesdkarkruntime import Ark, AsyncArk
+
+from app.core.admission import ByteBudget
+from app.core.clients import ClientRegistry
+from app.core.config import settings
+from app.services import image_generation_service as image_module
+from app.services.image_generation_service import ImageGenerationService
+from tests.test_executors import make_png
+
+
+ARK_BASE_URL = "http://fake-ark.local/api/v3"
+
+
+def fake_ark_response(count: int):
+    return SimpleNamespace(
+        data=[SimpleNamespace(b64_json=f"image-{i}", size="2048x2048") for i in range(count)]
+    )
+
+
+async def collect(stream) -> list:
+    return [event async for event in stream]
+
+
+def ark_stream_events(count: int) -> list:
+    """假 ARK 流式接口依次推送的 SSE 数据"""
+    events = []
+    for i in range(count):
+        event = {
+            "type": "image_generation.partial_succeeded",
+            "model": settings.ark_model,
+            "url": "",
+            "b64_json": f"image-{i}",
+            "size": "2048x2048",
+            "image_index": i,
+            "created_at": 0,
+        }
+        events.append(f"data: {json.dumps(event)}\n\n".encode())
+    completed = {
+        "type": "image_generation.completed",
+        "model": settings.ark_model,
+        "usage": {"generated_images": count, "output_tokens": 0, "total_tokens": 0},
+        "created_at": 0,
+    }
+    events.append(f"data: {json.dumps(completed)}\n\n".encode())
+    events.append(b"data: [DONE]\n\n")
+    return events
+
+
+def check_ark_request(request: httpx.Request) -> None:
+    assert request.url.path == "/api/v3/images/generations"
+    assert json.loads(request.content)["stream"] is True
+
+
+def fake_ark_stream(count: int, interval: float) -> Ark:
+    """本地假 ARK 接口（同步客户端）：每隔 interval 秒以 SSE 形式推送一张图片"""
+    def body():
+        for chunk in ark_stream_events(count):
+            time.sleep(interval)
+            yield chunk
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        check_ark_request(request)
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=body())
+
+    return Ark(
+        base_url=ARK_BASE_URL,
+        api_key="test-key",
+        http_client=httpx.Client(transport=httpx.MockTransport(handler)),
+    )
+
+
+def fake_async_ark_stream(count: int, interval: float) -> AsyncArk:
+    """本地假 ARK 接口（异步客户端）"""
+    async def body():
+        for chunk in ark_stream_events(count):
+            await asyncio.sleep(interval)
+            yield chunk
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        check_ark_request(request)
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=body())
+
+    return AsyncArk(
+        base_url=ARK_BASE_URL,
+        api_key="test-key",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(settings, "ark_stream", False)
+    monkeypatch.setattr(settings, "ark_use_async_client", False)
+    service = ImageGenerationService()
+    monkeypatch.setattr(service, "_call_ark_api", lambda urls, prompt: fake_ark_response(3))
+    return service
+
+
+@pytest.mark.asyncio
+async def test_uploads_run_concurrently_and_done_keeps_generation_order(service, monkeypatch):
+    delays = {"image-0": 0.06, "image-1": 0.04, "image-2": 0.02}
+    active, peak = 0, 0
+
+    async def fake_upload(base64_data, filename, user_id):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(delays[base64_data])
+        active -= 1
+        return f"https://storage.example.com/{base64_data}.png"
+
+    monkeypatch.setattr(service, "_upload_base64_to_supabase", fake_upload)
+
+    events = await collect(service.generate_images_stream(["https://in.example.com/a.png"], "task-1", "user-1"))
+
+    uploaded = [event.data["index"] for event in events if event.event == "image_uploaded"]
+    assert [event.data["index"] for event in events if event.event == "image_generated"] == [0, 1, 2]
+    done = events[-1]
+    assert peak == 3
+    assert uploaded == [2, 1, 0]
+    assert done.event == "done"
+    assert [image["url"] for image in done.data["generated_images"]] == [
+        "https://storage.example.com/image-0.png",
+        "https://storage.example.com/image-1.png",
+        "https://storage.example.com/image-2.png",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_failed_upload_is_skipped(service, monkeypatch):
+    async def fake_upload(base64_data, filename, user_id):
+        if base64_data == "image-1":
+            raise Exception("storage unavailable")
+        return f"https://storage.example.com/{base64_data}.png"
+
+    monkeypatch.setattr(service, "_upload_base64_to_supabase", fake_upload)
+
+    events = await collect(service.generate_images_stream(["https://in.example.com/a.png"], "task-1", "user-1"))
+
+    assert sorted(event.data["index"] for event in events if event.event == "image_uploaded") == [0, 2]
+    assert [image["url"] for image in events[-1].data["generated_images"]] == [
+        "https://storage.example.com/image-0.png",
+        "https://storage.example.com/image-2.png",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_image_bytes_budget_applies_backpressure(service, monkeypatch):
+    # 预算只够一张图片：上一张上传完成前不会接收下一张
+    budget = ByteBudget("test", limit=1)
+    monkeypatch.setattr(image_module, "image_bytes_budget", budget)
+    active, peak = 0, 0
+
+    async def fake_upload(base64_data, filename, user_id):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        return f"https://storage.example.com/{base64_data}.png"
+
+    monkeypatch.setattr(service, "_upload_base64_to_supabase", fake_upload)
+
+    events = await collect(service.generate_images_stream(["https://in.example.com/a.png"], "task-1", "user-1"))
+
+    assert peak == 1
+    assert len(events[-1].data["generated_images"]) == 3
+    assert budget.in_use == 0
+    assert budget.stats()["peak"] == len("image-0") + len("image-0") * 3 // 4
+    assert budget.waits == 3
+
+
+@pytest.mark.asyncio
+async def test_preview_sent_before_full_size_upload(service, monkeypatch):
+    monkeypatch.setattr(settings, "image_preview_max_bytes", 4096)
+    png_b64 = base64.b64encode(make_png(512, 512)).decode()
+    monkeypatch.setattr(service, "_call_ark_api", lambda urls, prompt: SimpleNamespace(
+        data=[SimpleNamespace(b64_json=png_b64, size="512x512")]
+    ))
+
+    async def slow_upload(base64_data, filename, user_id):
+        await asyncio.sleep(0.2)
+        return "https://storage.example.com/image-0.png"
+
+    monkeypatch.setattr(service, "_upload_base64_to_supabase", slow_upload)
+
+    events = await collect(service.generate_images_stream(["https://in.example.com/a.png"], "task-1", "user-1"))
+
+    names = [event.event for event in events]
+    assert names.index("image_generated") < names.index("preview") < names.index("image_uploaded")
+    preview = events[names.index("preview")].data
+    assert preview["index"] == 0
+    assert preview["data_uri"].startswith("data:image/webp;base64,")
+    assert len(preview["data_uri"]) <= 4096
+    assert events[-1].data["generated_images"] == [
+        {"url": "https://storage.example.com/image-0.png", "size": "512x512", "sha256": None, "original_url": None}
+    ]
+
+
+@pytest.mark.asyncio
+async def test_per_task_upload_limit(service, monkeypatch):
+    monkeypatch.setattr("app.core.config.settings.upload_concurrency_per_task", 1)
+    active, peak = 0, 0
+
+    async def fake_upload(base64_data, filename, user_id):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        return f"https://storage.example.com/{base64_data}.png"
+
+    monkeypatch.setattr(service, "_upload_base64_to_supabase", fake_upload)
+
+    events = await collect(service.generate_images_stream(["https://in.example.com/a.png"], "task-1", "user-1"))
+
+    assert peak == 1
+    assert len(events[-1].data["generated_images"]) == 3
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("use_async_client", [True, False], ids=["AsyncArk", "Ark"])
+async def test_streaming_mode_uploads_each_image_as_it_arrives(monkeypatch, use_async_client):
+    monkeypatch.setattr(settings, "ark_stream", True)
+    monkeypatch.setattr(settings, "ark_use_async_client", use_async_client)
+    service = ImageGenerationService()
+    if use_async_client:
+        service._ark_async_client = fake_async_ark_stream(count=3, interval=0.1)
+    else:
+        service._ark_client = fake_ark_stream(count=3, interval=0.1)
+
+    async def fake_upload(base64_data, filename, user_id):
+        await asyncio.sleep(0.01)
+        return f"https://storage.example.com/{base64_data}.png"
+
+    monkeypatch.setattr(service, "_upload_base64_to_supabase", fake_upload)
+
+    started = time.perf_counter()
+    timeline = []
+    async for event in service.generate_images_stream(["https://in.example.com/a.png"], "task-1", "user-1"):
+        timeline.append((event.event, time.perf_counter() - started, event.data))
+
+    first_uploaded = next(t for name, t, _ in timeline if name == "image_uploaded")
+    last_generated = [t for name, t, _ in timeline if name == "image_generated"][-1]
+    name, total, done = timeline[-1]
+
+    # 首张图片在约一张图片的耗时内就已上传完成，早于后续图片生成
+    assert first_uploaded < 0.2
+    assert first_uploaded < last_generated
+    assert total >= 0.3
+    assert name == "done"
+    assert [image["url"] for image in done["generated_images"]] == [
+        f"https://storage.example.com/image-{i}.png" for i in range(3)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_streaming_failure_before_first_image_reports_error(monkeypatch):
+    monkeypatch.setattr(settings, "ark_stream", True)
+    monkeypatch.setattr(settings, "ark_use_async_client", False)
+    service = ImageGenerationService()
+
+    def failing_call(urls, prompt, stream=False):
+        raise Exception("ark unavailable")
+
+    monkeypatch.setattr(service, "_call_ark_api", failing_call)
+
+    events = await collect(service.generate_images_stream(["https://in.example.com/a.png"], "task-1", "user-1"))
+
+    assert events[-1].event == "error"
+    assert events[-1].data["error"] == "ark unavailable"
+
+
+@pytest.mark.asyncio
+async def test_url_mode_streams_images_into_storage(monkeypatch):
+    monkeypatch.setattr(settings, "ark_stream", False)
+    monkeypatch.setattr(settings, "ark_use_async_client", False)
+    monkeypatch.setattr(settings, "ark_response_format", "url")
+    monkeypatch.setattr(settings, "image_transfer_chunk_size", 1024)
+    monkeypatch.setattr(settings, "supabase_url", "https://project.supabase.co")
+    monkeypatch.setattr(settings, "supabase_key", "anon-key")
+    images = {f"/images/{i}.png": bytes([i]) * 10_000 for i in range(2)}
+    stored = {}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "fake-ark.local":
+            # 分块返回图片，模拟大文件下载
+            data = images[request.url.path]
+            async def body():
+                for start in range(0, len(data), 4096):
+                    yield data[start:start + 4096]
+            return httpx.Response(200, headers={"content-type": "image/png"}, content=body())
+        if request.method == "POST" and request.url.path.startswith("/storage/v1/object/"):
+            assert request.headers["apikey"] == "anon-key"
+            assert "content-length" not in request.headers
+            stored[request.url.path] = b"".join([chunk async for chunk in request.stream])
+            return httpx.Response(200, json={"Key": request.url.path})
+        return httpx.Response(404, json={})
+
+    registry = ClientRegistry()
+    registry._http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(image_module, "client_registry", registry)
+    service = ImageGenerationService()
+    monkeypatch.setattr(service, "_call_ark_api", lambda urls, prompt: SimpleNamespace(data=[
+        SimpleNamespace(url=f"http://fake-ark.local{path}", size="2048x2048") for path in images
+    ]))
+
+    events = await collect(service.generate_images_stream(["https://in.example.com/a.png"], "task-1", "user-1"))
+    await registry.shutdown()
+
+    done = events[-1]
+    assert done.event == "done"
+    assert sorted(stored.values()) == sorted(images.values())
+    assert [image["sha256"] for image in done.data["generated_images"]] == [
+        hashlib.sha256(data).hexdigest() for data in images.values()
+    ]
+    assert all(image["url"].startswith("https://project.supabase.co/storage/v1/object/public/")
+               for image in done.data["generated_images"])
+
+
+@pytest.mark.asyncio
+async def test_transcoded_images_upload_with_format_content_type(monkeypatch):
+    monkeypatch.setattr(settings, "ark_stream", False)
+    monkeypatch.setattr(settings, "ark_use_async_client", False)
+    monkeypatch.setattr(settings, "image_transcode_format", "webp")
+    monkeypatch.setattr(settings, "image_transcode_keep_original", True)
+    monkeypatch.setattr(settings, "supabase_url", "https://project.supabase.co")
+    monkeypatch.setattr(settings, "supabase_key", "anon-key")
+    png = make_png()
+    stored = {}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.method == "POST" and request.url.path.startswith("/storage/v1/object/"):
+            # SDK 以 multipart 上传，content-type 在文件分段中
+            stored[request.url.path.rsplit(".", 1)[-1]] = await request.aread()
+            return httpx.Response(200, json={"Key": request.url.path})
+        return httpx.Response(404, json={})
+
+    registry = ClientRegistry()
+    registry._http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(image_module, "client_registry", registry)
+    service = ImageGenerationService()
+    monkeypatch.setattr(service, "_call_ark_api", lambda urls, prompt: SimpleNamespace(data=[
+        SimpleNamespace(b64_json=base64.b64encode(png).decode(), size="256x256")
+    ]))
+
+    events = await collect(service.generate_images_stream(["https://in.example.com/a.png"], "task-1", "user-1"))
+    await registry.shutdown()
+
+    uploaded = next(event.data for event in events if event.event == "image_uploaded")
+    assert uploaded["url"].endswith(".webp")
+    assert uploaded["original_url"].endswith(".png")
+    assert uploaded["transcode"]["format"] == "webp"
+    assert uploaded["transcode"]["original_bytes"] == len(png)
+    assert uploaded["transcode"]["bytes_saved"] > 0
+    assert "transcode" not in events[-1].data["generated_images"][0]
+    assert b"Content-Type: image/webp" in stored["webp"]
+    assert b"Content-Type: image/png" in stored["png"] and png in stored["png"]
+    assert service.transcode_stats()["images"] == 1
@@ -0,0 +1,140 @@
+"""Resized image variant tests"""
+
+import asyncio
+import io
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app.api.endpoints import faceflip
+from app.core.clients import ClientRegistry
+from app.core.config import settings
+from app.services import image_variants
+from app.services.image_variants import DiskLRUCache, ImageNotFoundError, ImageVariantService
+from tests.test_executors import make_png
+
+IMAGE_PATH = "user-1/2025-01-01/0f8fad5b-d9cb-469f-a165-70867728950e.png"
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    """假 Supabase Storage：只有 IMAGE_PATH 一张图片，记录下载次数"""
+    monkeypatch.setattr(settings, "supabase_url", "https://project.supabase.co")
+    monkeypatch.setattr(settings, "supabase_key", "anon-key")
+    png = make_png(512, 256)
+    downloads = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        prefix = f"/storage/v1/object/{settings.supabase_storage_bucket}/"
+        path = request.url.path.removeprefix(prefix)
+        downloads.append(path)
+        await asyncio.sleep(0.05)
+        if path == IMAGE_PATH:
+            return httpx.Response(200, headers={"content-type": "image/png"}, content=png)
+        return httpx.Response(400, json={"statusCode": "404", "error": "not_found", "message": "Object not found"})
+
+    registry = ClientRegistry()
+    registry._http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(image_variants, "client_registry", registry)
+    return downloads
+
+
+@pytest.fixture
+def variant_service(tmp_path, monkeypatch):
+    service = ImageVariantService(DiskLRUCache(tmp_path, max_bytes=1024 * 1024))
+    monkeypatch.setattr(faceflip, "image_variant_service", service)
+    return service
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_render_once(storage, variant_service):
+    results = await asyncio.gather(*[
+        variant_service.get_variant(IMAGE_PATH, 128, None, "webp") for _ in range(5)
+    ])
+
+    assert len(set(results)) == 1
+    with Image.open(io.BytesIO(results[0])) as image:
+        assert image.format == "WEBP"
+        assert image.size == (128, 64)
+    assert storage == [IMAGE_PATH]
+    assert variant_service.renders == 1 and variant_service.coalesced == 4
+
+    # 磁盘缓存命中，不再下载
+    await variant_service.get_variant(IMAGE_PATH, 128, None, "webp")
+    assert len(storage) == 1
+    assert variant_service.cache.stats()["hits"] == 1
+
+    with pytest.raises(ImageNotFoundError):
+        await variant_service.get_variant("user-1/2025-01-01/missing.png", 128, None, "webp")
+
+
+@pytest.mark.asyncio
+async def test_cancelled_leader_does_not_cancel_waiters(storage, variant_service):
+    leader = asyncio.create_task(variant_service.get_variant(IMAGE_PATH, 128, None, "webp"))
+    await asyncio.sleep(0.01)
+    waiter = asyncio.create_task(variant_service.get_variant(IMAGE_PATH, 128, None, "webp"))
+    await asyncio.sleep(0.01)
+
+    leader.cancel()
+
+    with Image.open(io.BytesIO(await waiter)) as image:
+        assert image.size == (128, 64)
+    assert leader.cancelled()
+    # 等待者接替渲染
+    assert variant_service.renders == 1 and len(storage) == 2
+
+
+@pytest.mark.asyncio
+async def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskLRUCache(tmp_path, max_bytes=250)
+    await cache.put("a.webp", b"a" * 100)
+    await cache.put("b.webp", b"b" * 100)
+    assert await cache.get("a.webp") == b"a" * 100
+
+    await cache.put("c.webp", b"c" * 100)
+
+    assert await cache.get("b.webp") is None
+    assert not (tmp_path / "b.webp").exists()
+    assert cache.stats()["bytes"] == 200
+
+    # 重启后从磁盘重建索引
+    reloaded = DiskLRUCache(tmp_path, max_bytes=250)
+    assert await reloaded.get("a.webp") is not None and await reloaded.get("c.webp") is not None
+
+
+def test_endpoint_returns_etag_and_304(client: TestClient, storage, variant_service):
+    url = f"/api/faceflip/images/{IMAGE_PATH}"
+
+    response = client.get(url, params={"w": 64, "fmt": "jpeg"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/jpeg"
+    assert "immutable" in response.headers["cache-control"]
+    etag = response.headers["etag"]
+    assert etag.startswith('"') and not etag.startswith("W/")
+
+    cached = client.get(url, params={"w": 64, "fmt": "jpeg"}, headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert len(storage) == 1
+
+    assert client.get("/api/faceflip/images/user-1/.env").json()["code"] == 12001
+    assert client.get(url, params={"fmt": "gif"}).json()["code"] == 12001
+    assert client.get(url, params={"w": 100000}).json()["code"] == 12001
+    missing = client.get("/api/faceflip/images/user-1/2025-01-01/missing.png")
+    assert missing.json()["code"] == 14001
+
+
+def test_requested_sizes_snap_to_allowed_edges(client: TestClient, storage, variant_service):
+    url = f"/api/faceflip/images/{IMAGE_PATH}"
+
+    etags = {client.get(url, params={"w": w}).headers["etag"] for w in (65, 100, 128)}
+
+    # 同一档位的不同尺寸共用一个变体，只渲染一次
+    assert len(etags) == 1
+    assert variant_service.renders == 1 and len(storage) == 1
+    with Image.open(io.BytesIO(client.get(url, params={"w": 100}).content)) as image:
+        assert image.size == (128, 64)
+    assert client.get(url, params={"h": 2049}).json()["code"] == 12001
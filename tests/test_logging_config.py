@@ -0,0 +1,103 @@
+"""Queue-backed JSON logging tests"""
+
+import json
+import logging
+import queue
+import sys
+
+import pytest
+
+from app.core import logging_config
+from app.core.config import settings
+from app.core.logging_config import (
+    JsonFormatter,
+    SamplingFilter,
+    TruncatingQueueHandler,
+    logging_stats,
+    setup_logging,
+    shutdown_logging,
+)
+
+
+def make_record(name="app.test", level=logging.INFO, msg="hello %s", args=("world",), **extra):
+    record = logging.LogRecord(name, level, __file__, 10, msg, args, None)
+    for key, value in extra.items():
+        setattr(record, key, value)
+    return record
+
+
+@pytest.fixture
+def restore_logging():
+    """恢复 app.main 导入时配置的根 logger 和后台线程"""
+    root = logging.getLogger()
+    listener, handlers, level = logging_config._listener, list(root.handlers), root.level
+    logging_config._listener = None
+    listener.stop()
+    yield
+    shutdown_logging()
+    root.handlers[:] = handlers
+    root.setLevel(level)
+    listener.start()
+    logging_config._listener = listener
+
+
+def test_json_formatter_outputs_extras_and_exception():
+    try:
+        raise ValueError("bad")
+    except ValueError:
+        record = make_record(task_id="task-1")
+        record.exc_info = sys.exc_info()
+
+    payload = json.loads(JsonFormatter().format(record))
+
+    assert payload["message"] == "hello world"
+    assert payload["level"] == "INFO" and payload["logger"] == "app.test"
+    assert payload["task_id"] == "task-1"
+    assert "ValueError: bad" in payload["exception"]
+
+
+def test_queue_handler_truncates_and_drops_when_full():
+    handler = TruncatingQueueHandler(queue.Queue(1), max_chars=10)
+
+    handler.handle(make_record(msg="x" * 50, args=None, payload="y" * 50))
+    handler.handle(make_record())
+
+    record = handler.queue.get_nowait()
+    assert record.msg.startswith("x" * 10) and "truncated 40 chars" in record.msg
+    assert record.payload.startswith("y" * 10) and len(record.payload) < 50
+    assert record.args is None
+    # 队列满时丢弃而不是阻塞
+    assert handler.dropped == 1
+
+
+def test_sampling_filter_applies_per_logger_below_warning():
+    sampler = SamplingFilter({"app.sse": 0})
+
+    assert not sampler.filter(make_record(name="app.sse"))
+    assert not sampler.filter(make_record(name="app.sse.child"))
+    assert sampler.filter(make_record(name="app.sse", level=logging.WARNING))
+    assert sampler.filter(make_record(name="app.access"))
+    assert sampler.sampled_out == 2
+
+
+def test_setup_logging_writes_rotating_json_files(tmp_path, monkeypatch, restore_logging):
+    monkeypatch.setattr(settings, "log_max_bytes", 1000)
+    monkeypatch.setattr(settings, "log_backup_count", 2)
+    monkeypatch.setattr(settings, "log_sample_rates", {"app.sse": 0})
+    log_file = tmp_path / "app.log"
+    setup_logging(log_level="INFO", log_file=str(log_file), enable_file_logging=True)
+
+    logger = logging.getLogger("app.test")
+    for index in range(20):
+        logger.info("request %d", index, extra={"status": 200})
+    logger.error("upload failed")
+    logging.getLogger("app.sse").info("sampled out")
+    assert logging_stats()["sampled_out"] == 1
+    shutdown_logging()
+
+    assert (tmp_path / "app.log.1").exists() and not (tmp_path / "app.log.3").exists()
+    lines = [json.loads(line) for line in log_file.read_text(encoding="utf-8").splitlines()]
+    assert lines[-1]["message"] == "upload failed"
+    assert all("sampled out" != line["message"] for line in lines)
+    errors = [json.loads(line) for line in (tmp_path / "error.log").read_text(encoding="utf-8").splitlines()]
+    assert [line["message"] for line in errors] == ["upload failed"]
@@ -0,0 +1,116 @@
+"""Metrics registry and /metrics endpoint tests"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.core.metrics import MetricsRegistry
+from app.core.token_verifier import TokenVerifier, auth_verifications_total
+from app.services import image_generation_service as image_module
+from app.services.image_generation_service import ImageGenerationService
+from tests.conftest import AUTH_HEADERS
+from tests.test_image_generation import collect, fake_ark_response
+
+
+def sample(text: str, line_prefix: str) -> float:
+    """取导出文本中以 line_prefix 开头的样本值"""
+    for line in text.splitlines():
+        if line.startswith(line_prefix + " "):
+            return float(line.rsplit(" ", 1)[1])
+    raise AssertionError(f"{line_prefix} not found")
+
+
+def test_registry_renders_prometheus_text():
+    registry = MetricsRegistry()
+    registry.counter("jobs_total", "Jobs", ("outcome",)).labels('say "hi"\n').inc(2)
+    registry.gauge("queue_depth", "Depth").labels().set(3)
+    registry.histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1)).labels("/a").observe(0.5)
+    registry.collector("pool_active", "Active", "gauge", ("pool",), lambda: {("ark",): 4})
+
+    text = registry.render()
+
+    assert "# TYPE jobs_total counter" in text
+    assert 'jobs_total{outcome="say \\"hi\\"\\n"} 2.0' in text
+    assert "queue_depth 3.0" in text
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 0' in text
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 1' in text
+    assert 'latency_seconds_count{route="/a"} 1' in text
+    assert 'pool_active{pool="ark"} 4.0' in text
+    with pytest.raises(ValueError):
+        registry.counter("jobs_total", "Jobs")
+
+
+def test_metrics_endpoint_is_public_and_uses_route_templates(client: TestClient, verifier_calls):
+    client.get("/api/faceflip/tasks/missing-task/events", headers=AUTH_HEADERS)
+    verifier_calls.clear()
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert verifier_calls == []
+    text = response.text
+    assert sample(
+        text,
+        'http_request_duration_seconds_count{method="GET",route="/api/faceflip/tasks/{task_id}/events",status="200"}'
+    ) >= 1
+    assert "missing-task" not in text
+    assert 'executor_queue_depth{executor="ark"}' in text
+    assert 'upstream_circuit_state{upstream="storage"} 0.0' in text
+    assert "sse_streams_in_flight 0.0" in text
+    assert "# TYPE generation_admission_queue_length histogram" in text
+    assert sample(text, 'generation_admission_queue_length_bucket{le="+Inf"}') >= 0
+
+
+def test_non_standard_methods_share_one_label(client: TestClient):
+    client.request("PROPFIND", "/health")
+    client.request("X-SCAN-1", "/health")
+
+    text = client.get("/metrics").text
+
+    assert 'method="OTHER"' in text
+    assert "PROPFIND" not in text
+    assert "X-SCAN-1" not in text
+
+
+@pytest.mark.asyncio
+async def test_auth_verification_outcomes_are_counted(monkeypatch):
+    monkeypatch.setattr(settings, "auth_cache_enabled", False)
+    verifier = TokenVerifier()
+
+    async def fake_verify(token, remote):
+        return {"id": "user-1"} if token == "good" else None
+
+    monkeypatch.setattr(verifier, "_verify_uncached", fake_verify)
+    valid = auth_verifications_total.labels("local", "valid")
+    invalid = auth_verifications_total.labels("local", "invalid")
+    before = (valid.value, invalid.value)
+
+    await verifier.verify("good", remote=False)
+    await verifier.verify("bad", remote=False)
+
+    assert (valid.value, invalid.value) == (before[0] + 1, before[1] + 1)
+
+
+@pytest.mark.asyncio
+async def test_ark_and_upload_metrics_are_recorded(monkeypatch):
+    monkeypatch.setattr(settings, "ark_stream", False)
+    monkeypatch.setattr(settings, "ark_use_async_client", False)
+    monkeypatch.setattr(settings, "image_preview_enabled", False)
+    service = ImageGenerationService()
+
+    async def fake_upload(base64_data, filename, user_id):
+        return f"https://storage.example.com/{base64_data}.png"
+
+    monkeypatch.setattr(service, "_call_ark_api", lambda urls, prompt: fake_ark_response(3))
+    monkeypatch.setattr(service, "_upload_base64_to_supabase", fake_upload)
+    images_before = image_module.ark_images_generated_total.value
+    calls_before = image_module.ark_call_duration_seconds.labels("success").count
+    uploads_before = image_module.image_upload_duration_seconds.labels("success").count
+
+    events = await collect(service.generate_images_stream(["https://in.example.com/a.png"], "task-1", "user-1"))
+
+    assert events[-1].event == "done"
+    assert image_module.ark_images_generated_total.value == images_before + 3
+    assert image_module.ark_call_duration_seconds.labels("success").count == calls_before + 1
+    assert image_module.image_upload_duration_seconds.labels("success").count == uploads_before + 3
@@ -0,0 +1,124 @@
+"""Pure ASGI middleware stack tests"""
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from app.core.deadline import DeadlineExceededError
+from app.core.resilience import UpstreamUnavailableError
+from app.core.response_code import ResponseCode
+from app.core.token_verifier import token_verifier
+from app.middleware import AuthMiddleware, ErrorHandlerMiddleware, LoggingMiddleware
+from tests.conftest import AUTH_HEADERS
+
+
+def build_app() -> FastAPI:
+    """与 app.main 相同顺序的中间件栈"""
+    app = FastAPI()
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    @app.get("/api/me")
+    async def me(request: Request):
+        return {"user": request.state.current_user, "token": request.state.auth_token}
+
+    @app.get("/api/boom")
+    async def boom():
+        raise RuntimeError("kaboom")
+
+    @app.get("/api/slow")
+    async def slow():
+        raise DeadlineExceededError("ark", "ark timed out")
+
+    @app.get("/api/stream")
+    async def stream():
+        async def chunks():
+            for index in range(3):
+                yield f"data: {index}\n\n"
+
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    app.add_middleware(LoggingMiddleware)
+    app.add_middleware(AuthMiddleware, enable=True)
+    app.add_middleware(ErrorHandlerMiddleware)
+    return app
+
+
+@pytest.fixture
+def stack():
+    return TestClient(build_app())
+
+
+def test_public_path_passes_without_token(stack: TestClient, verifier_calls):
+    response = stack.get("/health")
+
+    assert response.json() == {"status": "ok"}
+    assert float(response.headers["X-Process-Time"]) >= 0
+    assert verifier_calls == []
+
+
+def test_authenticated_user_is_stored_on_request_state(stack: TestClient, verifier_calls):
+    response = stack.get("/api/me", headers=AUTH_HEADERS)
+
+    assert response.json()["user"]["id"] == "user-1"
+    assert response.json()["token"] == "test-token"
+    assert "X-Process-Time" in response.headers
+
+
+@pytest.mark.parametrize(
+    "headers, code, msg",
+    [
+        ({}, 401, "missing authorization header"),
+        ({"Authorization": "Token abc"}, 401, "invalid authorization header format"),
+        ({"Authorization": "Bearer bad-token"}, 13003, "token not valid or expired"),
+    ],
+)
+def test_rejections_use_error_envelope(stack: TestClient, verifier_calls, headers, code, msg):
+    response = stack.get("/api/me", headers=headers)
+
+    assert response.status_code == 200
+    assert response.json() == {"code": code, "msg": msg, "data": None}
+
+
+def test_handler_errors_are_mapped_to_envelopes(stack: TestClient, verifier_calls):
+    deadline = stack.get("/api/slow", headers=AUTH_HEADERS).json()
+    assert deadline["code"] == 11004
+
+    # 普通异常由认证中间件内层包装，与原 BaseHTTPMiddleware 实现一致
+    boom = stack.get("/api/boom", headers=AUTH_HEADERS).json()
+    assert boom["code"] == 500 and boom["msg"] == "authentication error: kaboom"
+
+
+def test_error_handler_catches_exceptions_outside_auth(verifier_calls):
+    app = build_app()
+    app.user_middleware = [m for m in app.user_middleware if m.cls is not AuthMiddleware]
+
+    response = TestClient(app).get("/api/boom")
+
+    assert response.json()["msg"] == "system error: kaboom"
+
+    deadline = TestClient(app).get("/api/slow").json()
+    assert deadline["code"] == ResponseCode.E_DEADLINE_EXCEEDED.code
+
+
+def test_streaming_chunks_pass_through(stack: TestClient, verifier_calls):
+    with stack.stream("GET", "/api/stream", headers=AUTH_HEADERS) as response:
+        chunks = list(response.iter_text())
+
+    assert "".join(chunks) == "data: 0\n\ndata: 1\n\ndata: 2\n\n"
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert "X-Process-Time" in response.headers
+
+
+def test_auth_outage_is_a_retryable_system_error(stack: TestClient, monkeypatch):
+    async def unavailable(token, remote=None):
+        raise UpstreamUnavailableError("auth", ConnectionError("connection refused"))
+
+    monkeypatch.setattr(token_verifier, "verify", unavailable)
+
+    response = stack.get("/api/me", headers=AUTH_HEADERS)
+
+    assert response.json()["code"] == ResponseCode.E_SYSTEM_UNAVAILABLE.code
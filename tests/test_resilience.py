@@ -0,0 +1,188 @@
+"""Retry, hedging and circuit breaker tests"""
+
+import asyncio
+
+import httpx
+import pytest
+from storage3.exceptions import StorageApiError
+
+from app.core.admission import AdmissionController
+from app.core.clients import ClientRegistry
+from app.core.config import settings
+from app.core.metrics import Histogram
+from app.core.resilience import CircuitOpenError, Upstream, ark_upstream
+from app.services import image_generation_service as image_module
+from app.services.generation_jobs import GenerationJobManager
+from app.services.image_generation_service import ImageGenerationService
+from tests.test_generation_jobs import FakeGenerationService, drain
+from tests.test_image_generation import collect, fake_ark_response
+
+
+class ServiceUnavailableError(Exception):
+    status_code = 503
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(settings, "upstream_retry_base_delay", 0.001)
+
+
+def flaky(failures: int, error: Exception):
+    """前 failures 次调用抛出 error，之后返回调用次数"""
+    calls = []
+
+    async def func():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise error
+        return len(calls)
+
+    return func, calls
+
+
+@pytest.mark.asyncio
+async def test_transient_errors_are_retried():
+    upstream = Upstream("test")
+    func, calls = flaky(2, httpx.ConnectError("connection refused"))
+
+    assert await upstream.call(func) == 3
+    assert upstream.retries == 2 and upstream.failures == 2
+    assert upstream.breaker.state == "closed" and upstream.breaker.consecutive_failures == 0
+
+    # 4xx 不重试，也不计入熔断
+    func, calls = flaky(1, StorageApiError("invalid", "InvalidRequest", 400))
+    with pytest.raises(StorageApiError):
+        await upstream.call(func)
+    assert len(calls) == 1 and upstream.failures == 2
+
+
+@pytest.mark.asyncio
+async def test_circuit_opens_fails_fast_and_recovers(monkeypatch):
+    monkeypatch.setattr(settings, "circuit_failure_threshold", 3)
+    monkeypatch.setattr(settings, "circuit_reset_seconds", 0.05)
+    monkeypatch.setattr(settings, "upstream_retry_attempts", 1)
+    upstream = Upstream("test")
+    func, calls = flaky(3, ServiceUnavailableError())
+
+    for _ in range(3):
+        with pytest.raises(ServiceUnavailableError):
+            await upstream.call(func)
+    assert upstream.breaker.state == "open"
+
+    # 熔断期间不调用上游
+    with pytest.raises(CircuitOpenError):
+        await upstream.call(func)
+    assert len(calls) == 3
+    assert not upstream.breaker.available
+
+    # 冷却后只放行一次试探调用，成功后恢复
+    await asyncio.sleep(0.06)
+    assert upstream.breaker.available
+    assert await upstream.call(func) == 4
+    stats = upstream.stats()["circuit"]
+    assert stats["state"] == "closed" and stats["opened"] == 1 and stats["rejected"] == 1
+
+
+@pytest.mark.asyncio
+async def test_slow_call_is_hedged_after_p95(monkeypatch):
+    monkeypatch.setattr(settings, "upload_hedge_min_delay", 0.02)
+    upstream = Upstream("test")
+    for _ in range(20):
+        upstream.latency.observe(0.01)
+    started = []
+    cancelled = []
+
+    async def upload():
+        started.append(1)
+        if len(started) == 1:
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+        return "hedge"
+
+    result = await asyncio.wait_for(upstream.call(upload, hedge=True), timeout=1)
+    await asyncio.sleep(0)
+
+    assert result == "hedge"
+    assert upstream.hedges == 1 and upstream.hedge_wins == 1
+    assert cancelled == [1]
+
+
+def test_histogram_quantile_interpolates_buckets():
+    histogram = Histogram("test", (1, 2, 4))
+    assert histogram.quantile(0.95) is None
+    for value in (0.5, 1.5, 1.5, 3):
+        histogram.observe(value)
+
+    assert histogram.quantile(0.5) == pytest.approx(1.5)
+    assert histogram.quantile(1.0) == pytest.approx(4)
+
+
+@pytest.mark.asyncio
+async def test_storage_upload_retries_transient_5xx(monkeypatch):
+    monkeypatch.setattr(settings, "supabase_url", "https://project.supabase.co")
+    monkeypatch.setattr(settings, "supabase_key", "anon-key")
+    requests = []
+
+    async def storage(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if len(requests) == 1:
+            return httpx.Response(503, json={"statusCode": "503", "error": "Unavailable", "message": "try again"})
+        return httpx.Response(200, json={"Key": request.url.path.removeprefix("/storage/v1/object/")})
+
+    registry = ClientRegistry()
+    registry._http_client = httpx.AsyncClient(transport=httpx.MockTransport(storage))
+    monkeypatch.setattr(image_module, "client_registry", registry)
+
+    url = await ImageGenerationService()._upload_base64_to_supabase("aGVsbG8=", "test.png", "user-1")
+
+    assert "test.png" in url
+    assert len(requests) == 2
+    # 覆盖写入，重试不会因为第一次已经写入而失败
+    assert all(request.headers["x-upsert"] == "true" for request in requests)
+    assert image_module.storage_upstream.retries == 1
+    await registry.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_ark_failure_before_first_image_is_retried(monkeypatch):
+    monkeypatch.setattr(settings, "ark_stream", False)
+    monkeypatch.setattr(settings, "ark_use_async_client", False)
+    monkeypatch.setattr(settings, "image_preview_enabled", False)
+    service = ImageGenerationService()
+    attempts = []
+
+    def call_ark(urls, prompt):
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ServiceUnavailableError("ark 503")
+        return fake_ark_response(2)
+
+    async def fake_upload(base64_data, filename, user_id):
+        return f"https://storage.example.com/{base64_data}.png"
+
+    monkeypatch.setattr(service, "_call_ark_api", call_ark)
+    monkeypatch.setattr(service, "_upload_base64_to_supabase", fake_upload)
+
+    events = await collect(service.generate_images_stream(["https://in.example.com/a.png"], "task-1", "user-1"))
+
+    assert events[-1].event == "done"
+    assert len(events[-1].data["generated_images"]) == 2
+    assert len(attempts) == 2 and ark_upstream.retries == 1
+
+
+@pytest.mark.asyncio
+async def test_job_fails_fast_while_ark_circuit_is_open(monkeypatch):
+    monkeypatch.setattr(settings, "circuit_failure_threshold", 1)
+    ark_upstream.record(ServiceUnavailableError())
+    service = FakeGenerationService()
+    manager = GenerationJobManager(service, AdmissionController("test", 1, 4))
+
+    events = await drain((await manager.start("task-1", "user-1", [])).subscribe())
+
+    assert events[-1].event == "error"
+    assert events[-1].data["code"] == 11002 and events[-1].data["upstream"] == "ark"
+    assert service.calls == 0
+    assert manager.admission.active == 0
@@ -0,0 +1,149 @@
+"""Generation result cache tests"""
+
+import asyncio
+import base64
+from types import SimpleNamespace
+
+import pytest
+
+from app.core.admission import AdmissionController, AdmissionQueueFullError
+from app.core.config import settings
+from app.schemas.face_flip import GeneratedImage, SSEEvent
+from app.services.generation_jobs import GenerationJobManager
+from app.services.image_generation_service import ImageGenerationService
+from app.services.result_cache import GenerationResultCache, MemoryResultStore
+from tests.test_executors import make_png
+from tests.test_generation_jobs import FakeGenerationService, drain
+
+URLS = ["https://in.example.com/a.png"]
+
+
+class ImageService(FakeGenerationService):
+    """产出一张已上传图片的假生成服务"""
+
+    async def generate_images_stream(self, urls, task_id, user_id, prompt=None, on_generation_done=None):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        if on_generation_done is not None:
+            on_generation_done()
+        yield SSEEvent(event="image_generated", data={"task_id": task_id, "index": 0, "size": "2048x2048"})
+        yield SSEEvent(event="done", data={
+            "urls": urls,
+            "task_id": task_id,
+            "generated_images": [{"url": f"https://cdn.example.com/{task_id}.png", "size": "2048x2048"}],
+        })
+
+
+def make_manager(cache: GenerationResultCache) -> GenerationJobManager:
+    return GenerationJobManager(ImageService(), AdmissionController("test", 4, 4), cache)
+
+
+async def run(manager: GenerationJobManager, task_id: str, **kwargs) -> list:
+    job = await manager.start(task_id, "user-1", URLS, **kwargs)
+    events = await drain(job.subscribe())
+    await job.task
+    return events
+
+
+@pytest.mark.asyncio
+async def test_same_inputs_return_cached_images():
+    cache = GenerationResultCache(MemoryResultStore(max_entries=10))
+    manager = make_manager(cache)
+
+    await run(manager, "task-1")
+    events = await run(manager, "task-2")
+
+    done = events[-1]
+    assert done.data["cached"] is True
+    assert done.data["task_id"] == "task-2"
+    assert done.data["generated_images"][0]["url"] == "https://cdn.example.com/task-1.png"
+    assert manager.service.calls == 1
+    assert manager.admission.active == 0
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+    assert stats["hit_ratio"] == 0.5
+    assert stats["ark_seconds_saved"] > 0
+
+
+@pytest.mark.asyncio
+async def test_opt_out_and_settings_change_bypass_cache(monkeypatch):
+    cache = GenerationResultCache(MemoryResultStore(max_entries=10))
+    manager = make_manager(cache)
+
+    await run(manager, "task-1")
+    await run(manager, "task-2", use_cache=False)
+    monkeypatch.setattr(settings, "ark_image_size", "4K")
+    events = await run(manager, "task-3")
+
+    assert "cached" not in events[-1].data
+    assert manager.service.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_expired_entries_are_misses(monkeypatch):
+    monkeypatch.setattr(settings, "generation_cache_ttl_seconds", 0)
+    cache = GenerationResultCache(MemoryResultStore(max_entries=10))
+    manager = make_manager(cache)
+
+    await run(manager, "task-1")
+    await asyncio.sleep(0.01)
+    await run(manager, "task-2")
+
+    assert manager.service.calls == 2
+    assert cache.stats()["hits"] == 0
+
+
+@pytest.mark.asyncio
+async def test_cache_hits_skip_admission_when_queue_is_full(monkeypatch):
+    cache = GenerationResultCache(MemoryResultStore(max_entries=10))
+    manager = make_manager(cache)
+    await run(manager, "task-1")
+    monkeypatch.setattr(manager.admission, "max_concurrency", 0)
+    monkeypatch.setattr(manager.admission, "max_queue", 0)
+
+    events = await run(manager, "task-2")
+
+    assert events[-1].data["cached"] is True
+    assert manager.admission.rejected == 0
+    with pytest.raises(AdmissionQueueFullError):
+        await manager.start("task-3", "user-1", ["https://in.example.com/other.png"])
+    assert manager.get("user-1", "task-3") is None
+
+
+@pytest.mark.asyncio
+async def test_partial_results_are_not_cached(monkeypatch):
+    monkeypatch.setattr(settings, "ark_stream", False)
+    monkeypatch.setattr(settings, "ark_use_async_client", False)
+    monkeypatch.setattr(settings, "image_preview_enabled", False)
+    service = ImageGenerationService()
+    png = base64.b64encode(make_png()).decode()
+    ark_calls = []
+
+    def fake_ark(urls, prompt):
+        ark_calls.append(urls)
+        return SimpleNamespace(data=[SimpleNamespace(b64_json=png, size="256x256") for _ in range(2)])
+
+    uploads = []
+
+    async def fake_upload(index, image_data, size, user_id, task_semaphore, from_url=False):
+        uploads.append(index)
+        # 第一次生成的第二张图片上传失败
+        if len(uploads) == 2:
+            return index, None, None
+        return index, GeneratedImage(url=f"https://cdn.example.com/{len(uploads)}.png", size=size), None
+
+    monkeypatch.setattr(service, "_call_ark_api", fake_ark)
+    monkeypatch.setattr(service, "_upload_generated_image", fake_upload)
+    cache = GenerationResultCache(MemoryResultStore(max_entries=10))
+    manager = GenerationJobManager(service, AdmissionController("test", 4, 4), cache)
+
+    first = await run(manager, "task-1")
+    second = await run(manager, "task-2")
+
+    assert first[-1].data["failed_count"] == 1
+    assert len(first[-1].data["generated_images"]) == 1
+    assert "cached" not in second[-1].data
+    assert len(second[-1].data["generated_images"]) == 2
+    assert len(ark_calls) == 2
+    assert cache.stats()["hits"] == 0
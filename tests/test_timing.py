@@ -0,0 +1,122 @@
+"""Server-Timing header and generation timing event tests"""
+
+import base64
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.clients import ClientRegistry
+from app.core.config import settings
+from app.core.timing import RequestTimings, current_timings, record_phase, start_timing
+from app.core.token_verifier import token_verifier
+from app.services import image_generation_service as image_module
+from app.services.image_generation_service import ImageGenerationService
+from tests.conftest import AUTH_HEADERS, USER
+from tests.test_executors import make_png
+from tests.test_generation_jobs import FakeGenerationService, drain, make_manager
+from tests.test_image_generation import collect
+
+
+def parse_server_timing(header: str) -> dict:
+    metrics = {}
+    for metric in header.split(", "):
+        name, *params = metric.split(";")
+        metrics[name] = dict(param.split("=", 1) for param in params)
+    return metrics
+
+
+def test_server_timing_accumulates_repeated_phases():
+    timings = RequestTimings()
+    timings.add("upload", 0.25)
+    timings.add("upload", 0.5)
+    timings.add("auth", 0.002)
+
+    metrics = parse_server_timing(timings.server_timing())
+
+    assert list(metrics) == ["upload", "auth", "total"]
+    assert metrics["upload"] == {"dur": "750.0", "desc": '"x2"'}
+    assert metrics["auth"] == {"dur": "2.0"}
+    assert timings.as_dict()["phases"]["upload"] == {"ms": 750.0, "count": 2}
+
+
+def test_record_phase_without_collector_is_ignored():
+    assert current_timings() is None
+    record_phase("auth", 0.1)
+
+
+def test_responses_carry_server_timing(client: TestClient, monkeypatch):
+    monkeypatch.setattr(settings, "auth_cache_enabled", False)
+
+    async def fake_verify(token, remote):
+        return dict(USER)
+
+    monkeypatch.setattr(token_verifier, "_verify_uncached", fake_verify)
+
+    response = client.get("/api/faceflip/tasks/missing-task/events", headers=AUTH_HEADERS)
+
+    metrics = parse_server_timing(response.headers["Server-Timing"])
+    assert list(metrics) == ["auth", "handler", "total"]
+    assert float(metrics["total"]["dur"]) >= float(metrics["handler"]["dur"])
+
+    # 认证失败的响应同样带有已记录的阶段
+    rejected = client.get("/api/users/me")
+    assert "total;dur=" in rejected.headers["Server-Timing"]
+
+
+class TimedGenerationService(FakeGenerationService):
+    """记录 ARK 阶段耗时的假生成服务"""
+
+    async def generate_images_stream(self, urls, task_id, user_id, prompt=None, on_generation_done=None):
+        record_phase("ark", 0.5)
+        async for event in super().generate_images_stream(urls, task_id, user_id, prompt, on_generation_done):
+            yield event
+
+
+@pytest.mark.asyncio
+async def test_job_emits_timing_before_done():
+    manager = make_manager(TimedGenerationService())
+    request_timings = start_timing()
+
+    job = await manager.start("task-1", "user-1", ["https://in.example.com/a.png"])
+    events = await drain(job.subscribe())
+
+    assert [event.event for event in events[-2:]] == ["timing", "done"]
+    timing = events[-2].data
+    assert timing["task_id"] == "task-1"
+    assert timing["phases"]["ark"] == {"ms": 500.0, "count": 1}
+    assert "queue" in timing["phases"]
+    assert job.status == "done"
+    # 后台任务的阶段不会记到提交请求的记录上
+    assert request_timings.phases == {}
+
+
+@pytest.mark.asyncio
+async def test_generation_records_decode_and_upload_phases(monkeypatch):
+    monkeypatch.setattr(settings, "ark_stream", False)
+    monkeypatch.setattr(settings, "ark_use_async_client", False)
+    monkeypatch.setattr(settings, "image_preview_enabled", False)
+    monkeypatch.setattr(settings, "supabase_url", "https://project.supabase.co")
+    monkeypatch.setattr(settings, "supabase_key", "anon-key")
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={"Key": request.url.path})
+
+    registry = ClientRegistry()
+    registry._http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(image_module, "client_registry", registry)
+    service = ImageGenerationService()
+    png = base64.b64encode(make_png()).decode()
+    monkeypatch.setattr(service, "_call_ark_api", lambda urls, prompt: SimpleNamespace(data=[
+        SimpleNamespace(b64_json=png, size="256x256") for _ in range(2)
+    ]))
+    timings = start_timing()
+
+    events = await collect(service.generate_images_stream(["https://in.example.com/a.png"], "task-1", "user-1"))
+    await registry.shutdown()
+
+    assert events[-1].event == "done"
+    assert timings.phases["ark"][1] == 1
+    assert timings.phases["decode"][1] == 2
+    assert timings.phases["upload"][1] == 2
@@ -0,0 +1,172 @@
+"""Token verification cache tests"""
+
+import asyncio
+import time
+
+import pytest
+
+from app.core.token_cache import TokenCache
+
+
+USER = {"id": "user-1", "email": "test@example.com", "user_metadata": {}, "created_at": None}
+
+
+def make_cache(**overrides) -> TokenCache:
+    options = dict(ttl_seconds=60, negative_ttl_seconds=5, max_entries=100, max_bytes=1024 * 1024)
+    options.update(overrides)
+    return TokenCache(**options)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_verification():
+    cache = make_cache()
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return USER
+
+    key = TokenCache.make_key("token")
+    results = await asyncio.gather(*(cache.get_or_load(key, loader) for _ in range(10)))
+
+    assert results == [USER] * 10
+    assert len(calls) == 1
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["coalesced"] == 9
+
+    assert await cache.get_or_load(key, loader) == USER
+    assert cache.stats()["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_invalid_token_negatively_cached():
+    cache = make_cache()
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        return None
+
+    key = TokenCache.make_key("bad-token")
+    for _ in range(5):
+        assert await cache.get_or_load(key, loader) is None
+
+    assert len(calls) == 1
+    assert cache.stats()["negative_hits"] == 4
+
+
+@pytest.mark.asyncio
+async def test_expired_token_negatively_cached():
+    cache = make_cache()
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        return None
+
+    key = TokenCache.make_key("expired-token")
+    for _ in range(5):
+        assert await cache.get_or_load(key, loader, expires_at=time.time() - 10) is None
+
+    assert len(calls) == 1
+    assert cache.stats()["negative_hits"] == 4
+
+
+@pytest.mark.asyncio
+async def test_entry_never_outlives_token_expiry():
+    cache = make_cache()
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        return USER
+
+    key = TokenCache.make_key("expiring-token")
+    await cache.get_or_load(key, loader, expires_at=time.time() + 0.05)
+    await cache.get_or_load(key, loader)
+    await asyncio.sleep(0.06)
+    await cache.get_or_load(key, loader)
+
+    assert len(calls) == 2
+    assert cache.stats()["expirations"] == 1
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_entry_evicted():
+    cache = make_cache(max_entries=2)
+
+    async def loader():
+        return USER
+
+    keys = [TokenCache.make_key(f"token-{i}") for i in range(3)]
+    await cache.get_or_load(keys[0], loader)
+    await cache.get_or_load(keys[1], loader)
+    await cache.get_or_load(keys[0], loader)  # keys[1] 变为最久未使用
+    await cache.get_or_load(keys[2], loader)
+
+    assert cache.stats()["evictions"] == 1
+    assert cache._lookup(keys[0])[0] is True
+    assert cache._lookup(keys[1])[0] is False
+
+
+@pytest.mark.asyncio
+async def test_memory_cap_bounds_cache():
+    cache = make_cache(max_bytes=1000)
+
+    async def loader():
+        return USER
+
+    for i in range(50):
+        await cache.get_or_load(TokenCache.make_key(f"token-{i}"), loader)
+
+    stats = cache.stats()
+    assert stats["bytes"] <= 1000
+    assert stats["entries"] < 50
+    assert stats["evictions"] == 50 - stats["entries"]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_leader_does_not_cancel_waiters():
+    cache = make_cache()
+    calls = []
+    release = asyncio.Event()
+
+    async def loader():
+        calls.append(1)
+        await release.wait()
+        return USER
+
+    key = TokenCache.make_key("token")
+    leader = asyncio.create_task(cache.get_or_load(key, loader))
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(cache.get_or_load(key, loader))
+    await asyncio.sleep(0)
+
+    leader.cancel()
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await waiter == USER
+    assert leader.cancelled()
+    # 等待者接替发起校验
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_loader_errors_are_not_cached():
+    cache = make_cache()
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ConnectionError("auth upstream down")
+        return USER
+
+    key = TokenCache.make_key("token")
+    with pytest.raises(ConnectionError):
+        await cache.get_or_load(key, loader)
+
+    assert await cache.get_or_load(key, loader) == USER
+    assert cache.stats()["negative_hits"] == 0
@@ -0,0 +1,249 @@
+"""Local JWT verification tests"""
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+
+from app.core import token_verifier as token_verifier_module
+from app.core.clients import ClientRegistry
+from app.core.config import settings
+from app.core.resilience import UpstreamUnavailableError
+from app.core.token_verifier import LocalVerificationUnavailableError, TokenVerifier
+
+
+SUPABASE_URL = "https://project.supabase.co"
+SECRET = "test-jwt-secret-with-enough-length-for-hs256"
+
+
+@pytest.fixture(autouse=True)
+def jwt_settings(monkeypatch):
+    """Configure local verification against a fake project"""
+    monkeypatch.setattr(settings, "supabase_url", SUPABASE_URL)
+    monkeypatch.setattr(settings, "supabase_jwt_secret", SECRET)
+    monkeypatch.setattr(settings, "auth_verification_mode", "local")
+    monkeypatch.setattr(settings, "auth_remote_fallback", False)
+
+
+def make_claims(**overrides) -> dict:
+    now = int(time.time())
+    claims = {
+        "sub": "user-1",
+        "email": "test@example.com",
+        "aud": "authenticated",
+        "iss": f"{SUPABASE_URL}/auth/v1",
+        "iat": now,
+        "exp": now + 3600,
+        "user_metadata": {"full_name": "Test User"},
+    }
+    claims.update(overrides)
+    return claims
+
+
+@pytest.mark.asyncio
+async def test_hs256_token_verified_locally():
+    verifier = TokenVerifier()
+    token = jwt.encode(make_claims(), SECRET, algorithm="HS256")
+
+    user = await verifier.verify(token)
+
+    assert user == {
+        "id": "user-1",
+        "email": "test@example.com",
+        "user_metadata": {"full_name": "Test User"},
+        "created_at": None,
+    }
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "claims, key",
+    [
+        (make_claims(exp=int(time.time()) - 10), SECRET),
+        (make_claims(aud="anon"), SECRET),
+        (make_claims(iss="https://evil.example.com/auth/v1"), SECRET),
+        (make_claims(), "wrong-secret"),
+    ],
+    ids=["expired", "audience", "issuer", "signature"],
+)
+async def test_invalid_token_rejected(claims, key):
+    verifier = TokenVerifier()
+    token = jwt.encode(claims, key, algorithm="HS256")
+
+    assert await verifier.verify(token) is None
+
+
+def make_rsa_key(kid: str = "key-1"):
+    """生成 RSA 私钥（PEM）和对应的 JWKS 公钥"""
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    public_pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo,
+    )
+    public_jwk = jwk.construct(public_pem, "RS256").to_dict()
+    public_jwk["kid"] = kid
+    return private_pem, public_jwk
+
+
+@pytest.mark.asyncio
+async def test_rs256_token_verified_with_cached_jwks(monkeypatch):
+    private_pem, public_jwk = make_rsa_key()
+
+    verifier = TokenVerifier()
+    fetches = []
+
+    async def fake_refresh():
+        fetches.append(1)
+        verifier._jwks = {"keys": [public_jwk]}
+        verifier._jwks_fetched_at = time.monotonic()
+
+    monkeypatch.setattr(verifier, "_refresh_jwks", fake_refresh)
+
+    token = jwt.encode(make_claims(), private_pem, algorithm="RS256", headers={"kid": "key-1"})
+
+    assert (await verifier.verify(token))["id"] == "user-1"
+    assert (await verifier.verify(token))["id"] == "user-1"
+    assert len(fetches) == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_jwks_refreshes_share_one_request(monkeypatch):
+    private_pem, public_jwk = make_rsa_key()
+    requests = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request.url)
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json={"keys": [public_jwk]})
+
+    registry = ClientRegistry()
+    registry._http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(token_verifier_module, "client_registry", registry)
+    verifier = TokenVerifier()
+    tokens = [
+        jwt.encode(make_claims(sub=f"user-{i}"), private_pem, algorithm="RS256", headers={"kid": "key-1"})
+        for i in range(5)
+    ]
+
+    users = await asyncio.gather(*(verifier.verify_local(token) for token in tokens))
+    await registry.shutdown()
+
+    assert [user["id"] for user in users] == [f"user-{i}" for i in range(5)]
+    assert [str(url) for url in requests] == [f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json"]
+
+
+@pytest.mark.asyncio
+async def test_remote_verification_used_when_requested(monkeypatch):
+    verifier = TokenVerifier()
+    calls = []
+
+    async def fake_remote(token):
+        calls.append(token)
+        return {"id": "user-1", "email": "test@example.com", "user_metadata": {}, "created_at": None}
+
+    monkeypatch.setattr(verifier, "verify_remote", fake_remote)
+    token = jwt.encode(make_claims(), SECRET, algorithm="HS256")
+
+    await verifier.verify(token)
+    assert calls == []
+
+    await verifier.verify(token, remote=True)
+    assert calls == [token]
+
+
+class FakeAuthError(Exception):
+    """模拟 Supabase Auth SDK 的错误（带 HTTP 状态码）"""
+
+    def __init__(self, status: int):
+        super().__init__(f"status {status}")
+        self.status = status
+
+
+def fake_supabase(monkeypatch, error: Exception) -> list:
+    calls = []
+
+    async def get_user(token):
+        calls.append(token)
+        raise error
+
+    client = SimpleNamespace(supabase=SimpleNamespace(auth=SimpleNamespace(get_user=get_user)))
+    monkeypatch.setattr(token_verifier_module, "client_registry", client)
+    monkeypatch.setattr(settings, "upstream_retry_attempts", 1)
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_remote_rejection_is_invalid_token(monkeypatch):
+    fake_supabase(monkeypatch, FakeAuthError(401))
+
+    assert await TokenVerifier().verify_remote("revoked-token") is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "error", [httpx.ConnectError("connection refused"), FakeAuthError(503)], ids=["transport", "5xx"]
+)
+async def test_remote_outage_is_not_an_invalid_token(monkeypatch, error):
+    calls = fake_supabase(monkeypatch, error)
+    verifier = TokenVerifier()
+
+    with pytest.raises(UpstreamUnavailableError):
+        await verifier.verify("token", remote=True)
+    # 上游故障不写入负缓存，恢复后立即重新校验
+    with pytest.raises(UpstreamUnavailableError):
+        await verifier.verify("token", remote=True)
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_unavailable_jwks_is_not_an_invalid_token(monkeypatch):
+    verifier = TokenVerifier()
+
+    async def failed_refresh():
+        raise LocalVerificationUnavailableError("failed to fetch JWKS: connection refused")
+
+    monkeypatch.setattr(verifier, "_refresh_jwks", failed_refresh)
+    private_pem, _ = make_rsa_key()
+    token = jwt.encode(make_claims(), private_pem, algorithm="RS256", headers={"kid": "key-1"})
+
+    with pytest.raises(UpstreamUnavailableError):
+        await verifier.verify(token)
+    assert verifier.cache.stats()["entries"] == 0
+
+
+@pytest.mark.asyncio
+async def test_algorithms_are_pinned_to_the_verifying_key(monkeypatch):
+    private_pem, public_jwk = make_rsa_key()
+    verifier = TokenVerifier()
+    fetches = []
+
+    async def fake_refresh():
+        fetches.append(1)
+        verifier._jwks = {"keys": [public_jwk]}
+        verifier._jwks_fetched_at = time.monotonic()
+
+    monkeypatch.setattr(verifier, "_refresh_jwks", fake_refresh)
+    claims = make_claims()
+
+    # 没有 kid 时不会退回到 JWKS 中的任意公钥
+    no_kid = jwt.encode(claims, private_pem, algorithm="RS256")
+    assert await verifier.verify_local(no_kid) is None
+    assert fetches == []
+
+    # token 头部的算法与公钥声明的算法不一致
+    rs512 = jwt.encode(claims, private_pem, algorithm="RS512", headers={"kid": "key-1"})
+    assert await verifier.verify_local(rs512) is None
+
+    # 项目密钥只接受 HS256
+    hs512 = jwt.encode(claims, SECRET, algorithm="HS512")
+    assert await verifier.verify_local(hs512) is None